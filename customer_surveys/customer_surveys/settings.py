@@ -48,10 +48,12 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "survey.middleware.CompressionMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "survey.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -99,6 +101,93 @@ DATABASES = {
     }
 }
 
+# Шардирование статистики ответов: default - каталог (опросы, вопросы, пользователи),
+# статистика каждого опроса хранится в одной из баз SURVEY_SHARDS (по хэшу номера опроса).
+# SURVEY_SHARD_DATABASES - имена баз шардов на том же сервере через запятую, новые базы
+# добавляются в конец списка. Без шардов вся статистика хранится в default.
+SURVEY_SHARD_DATABASES = [name.strip() for name in os.getenv("SURVEY_SHARD_DATABASES", "").split(",") if name.strip()]
+for index, name in enumerate(SURVEY_SHARD_DATABASES):
+    DATABASES[f'shard_{index}'] = {**DATABASES['default'], 'NAME': name}
+SURVEY_SHARDS = [f'shard_{index}' for index in range(len(SURVEY_SHARD_DATABASES))] or ['default']
+DATABASE_ROUTERS = ['survey.sharding.SurveyShardRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.0/topics/cache/
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    }
+}
+
+# Общий кэш для всех процессов (нужен для сессий в режиме cache)
+if os.getenv("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL"),
+    }
+
+
+# Sessions and authentication
+# https://docs.djangoproject.com/en/5.0/topics/http/sessions/#configuring-the-session-engine
+
+# Хранение сессий (SURVEY_SESSION_MODE):
+# - db: таблица django_session (запрос к базе на каждый запрос пользователя);
+# - cached_db: кэш с записью в базу, чтение из базы только при промахе кэша;
+# - cache: только кэш, без обращений к базе (нужен общий кэш, см. REDIS_URL);
+# - cookies: подписанные cookie, без обращений к базе и кэшу.
+SESSION_ENGINES = {
+    "db": "django.contrib.sessions.backends.db",
+    "cached_db": "django.contrib.sessions.backends.cached_db",
+    "cache": "django.contrib.sessions.backends.cache",
+    "cookies": "django.contrib.sessions.backends.signed_cookies",
+}
+SESSION_ENGINE = SESSION_ENGINES[os.getenv("SURVEY_SESSION_MODE", "db")]
+
+# Пользователь сессии кэшируется, чтобы не читать auth_user на каждом запросе.
+# ModelBackend оставлен для сессий, созданных до включения кэширования.
+AUTHENTICATION_BACKENDS = [
+    "survey.backends.CachedModelBackend",
+    "django.contrib.auth.backends.ModelBackend",
+]
+SURVEY_USER_CACHE_TTL = int(os.getenv("SURVEY_USER_CACHE_TTL", 60))
+
+# Время хранения ответов на запросы с заголовком Idempotency-Key (в секундах)
+SURVEY_IDEMPOTENCY_TTL = 60 * 60
+# Время жизни блокировки обрабатываемого запроса с Idempotency-Key (в секундах):
+# после падения обработчика повторы снова принимаются через это время
+SURVEY_IDEMPOTENCY_LOCK_TTL = 30
+
+# Время кэширования сводки по опросам (в секундах)
+SURVEY_DASHBOARD_CACHE_TTL = 30
+
+# Интервал рассылки изменений результатов подписчикам survey/<id>/live/ и интервал
+# служебных сообщений, поддерживающих соединение (в секундах)
+SURVEY_LIVE_TICK = 1.0
+SURVEY_LIVE_HEARTBEAT = 15
+
+# Отставание окна обновления скетчей времени прохождения от текущего времени (в секундах):
+# ответы со временем внутри окна должны успеть зафиксироваться до его обработки
+SURVEY_TIMING_SETTLE = 60
+
+# Профилирование запросов: доля случайно профилируемых запросов (0 - только по заголовку
+# X-Profile: 1 от staff-пользователя), каталог для профилей и количество хранимых профилей
+SURVEY_PROFILING_SAMPLE_RATE = float(os.getenv('SURVEY_PROFILING_SAMPLE_RATE', 0))
+SURVEY_PROFILING_DIR = BASE_DIR / 'profiles'
+SURVEY_PROFILING_MAX_FILES = 200
+
+# Сжатие ответов API (brotli или gzip): минимальный размер ответа в байтах и сжимаемые типы содержимого
+SURVEY_COMPRESS_MIN_SIZE = 1024
+SURVEY_COMPRESS_CONTENT_TYPES = (
+    'application/json',
+    'application/vnd.survey.columns+json',
+    'application/msgpack',
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.0/ref/settings/#auth-password-validators
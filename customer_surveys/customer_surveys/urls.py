@@ -1,7 +1,15 @@
 from django.contrib import admin
 from django.urls import path, include
 
+from survey.views import ProfileListView, ProfileFileView
+
 urlpatterns = [
+    path("admin/profiles/", admin.site.admin_view(ProfileListView.as_view()), name='profiles'),
+    path(
+        "admin/profiles/<str:name>.<str:extension>",
+        admin.site.admin_view(ProfileFileView.as_view()),
+        name='profile_file'
+    ),
     path("admin/", admin.site.urls),
     path('', include("survey.urls")),
 ]
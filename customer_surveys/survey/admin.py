@@ -1,12 +1,40 @@
-from django.contrib import admin
-from .models import Survey, Question, Answer, AnswerGroup, UserStatistics
+from django.conf import settings
+from django.contrib import admin, messages
+from django.http import QueryDict
+from .models import Survey, SurveyQuestion, Question, Answer, AnswerGroup, UserStatistics, SurveySnapshot
+from .service import close_survey
+from .graph import clone_survey
+from .sharding import using_shard
+
+
+class SurveyQuestionInline(admin.TabularInline):
+    model = SurveyQuestion
+    fields = ('position', 'question')
+    raw_id_fields = ('question',)
+    extra = 1
 
 
 @admin.register(Survey)
 class SurveyAdmin(admin.ModelAdmin):
-    list_display = ('id', 'title')
+    list_display = ('id', 'title', 'closed_at')
     list_display_links = ('id', 'title',)
-    filter_horizontal = ('participants', 'questions',)
+    filter_horizontal = ('participants',)
+    inlines = (SurveyQuestionInline,)
+    readonly_fields = ('closed_at', 'shard')
+    actions = ('close_surveys', 'clone_surveys')
+
+    @admin.action(description='Закрыть опрос и сохранить снимок аналитики')
+    def close_surveys(self, request, queryset):
+        for survey in queryset:
+            try:
+                close_survey(survey.pk)
+            except ValueError as error:
+                self.message_user(request, f"{survey}: {error}", messages.WARNING)
+
+    @admin.action(description='Создать копию опроса')
+    def clone_surveys(self, request, queryset):
+        for survey in queryset:
+            clone_survey(survey.pk)
 
 
 @admin.register(Question)
@@ -31,9 +59,91 @@ class AnswerGroupAdmin(admin.ModelAdmin):
     list_display_links = ('name',)
 
 
+def get_statistics_shard(request) -> str:
+    """
+    База статистики, выбранная в списке UserStatisticsAdmin (параметр shard, на страницах
+    объекта - в сохранённых фильтрах списка). По умолчанию - первая база SURVEY_SHARDS.
+    """
+    shard = request.GET.get('shard')
+    if shard is None:
+        shard = QueryDict(request.GET.get('_changelist_filters', '')).get('shard')
+    return shard if shard in settings.SURVEY_SHARDS else settings.SURVEY_SHARDS[0]
+
+
+class StatisticsShardFilter(admin.SimpleListFilter):
+    """
+    Выбор базы статистики: строки каждой базы SURVEY_SHARDS показываются отдельно.
+    """
+    title = 'база данных'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(shard, shard) for shard in settings.SURVEY_SHARDS]
+
+    def choices(self, changelist):
+        # Варианта «Все» нет: объединить списки нескольких баз в одном QuerySet нельзя
+        selected = self.value() if self.value() in settings.SURVEY_SHARDS else settings.SURVEY_SHARDS[0]
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': selected == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        # База выбирается в UserStatisticsAdmin.get_queryset
+        return queryset
+
+
 @admin.register(UserStatistics)
 class UserStatisticsAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'survey', 'answers_given', 'questions_answered', 'timestamp')
     list_display_links = ('id', 'user', 'survey', 'answers_given', 'questions_answered', 'timestamp')
     list_filter = ('id', 'user', 'survey')
     search_fields = ('id', 'user', 'survey')
+    # Связанные объекты хранятся в каталоге: в базе статистики их не соединить JOIN,
+    # поэтому они подгружаются отдельными запросами к каталогу (prefetch_related)
+    list_select_related = ()
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).using(get_statistics_shard(request)).prefetch_related(
+            'user', 'survey', 'answers_given', 'questions_answered'
+        )
+
+    # Админка выполняет часть запросов без объекта (транзакции, сбор удаляемых объектов),
+    # поэтому представления работают внутри выбранной базы статистики
+    def changelist_view(self, request, extra_context=None):
+        with using_shard(get_statistics_shard(request)):
+            return super().changelist_view(request, extra_context)
+
+    def changeform_view(self, request, object_id=None, form_url='', extra_context=None):
+        with using_shard(get_statistics_shard(request)):
+            return super().changeform_view(request, object_id, form_url, extra_context)
+
+    def delete_view(self, request, object_id, extra_context=None):
+        with using_shard(get_statistics_shard(request)):
+            return super().delete_view(request, object_id, extra_context)
+
+    def history_view(self, request, object_id, extra_context=None):
+        with using_shard(get_statistics_shard(request)):
+            return super().history_view(request, object_id, extra_context)
+
+    def get_list_filter(self, request):
+        list_filter = super().get_list_filter(request)
+        if len(settings.SURVEY_SHARDS) > 1:
+            return (StatisticsShardFilter, *list_filter)
+        return list_filter
+
+
+@admin.register(SurveySnapshot)
+class SurveySnapshotAdmin(admin.ModelAdmin):
+    list_display = ('id', 'survey', 'created_at')
+    list_display_links = ('id', 'survey')
+    exclude = ('data',)
+    readonly_fields = ('survey', 'created_at')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
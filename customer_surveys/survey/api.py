@@ -1,8 +1,19 @@
+import hashlib
+import io
+import json
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.permissions import IsAdminUser
+from django.conf import settings
+from django.core.cache import cache
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
 from .models import Survey
+from .graph import export_survey_graph, import_survey_graph, clone_survey
+from .stats import add_confidence
+from .renderers import ANALYTICS_RENDERERS
 from .serializers import (
     QuestionSerializer,
     PostAnswerSerializer,
@@ -14,9 +25,67 @@ from .service import (
     get_number_answers,
     get_number_respondents,
     process_user_answer,
+    close_survey,
+    get_survey_snapshot,
+    get_surveys_dashboard,
+    enroll_participants,
+    read_user_ids,
+    get_first_question,
+    get_survey_timing,
 )
 
 
+def get_confidence_level(request):
+    """
+    Возвращает уровень доверия из параметра confidence запроса (например, ?confidence=0.95) или None.
+
+    Исключения:
+    - ValueError: Если уровень доверия не число от 0 до 1.
+    """
+    value = request.query_params.get('confidence')
+    if value is None:
+        return None
+    level = float(value)
+    if not 0 < level < 1:
+        raise ValueError(value)
+    return level
+
+
+def get_sample_params(request):
+    """
+    Возвращает долю выборки в процентах и метод выборки из параметров sample и sample_method запроса
+    (например, ?sample=5&sample_method=system). По умолчанию метод BERNOULLI, без параметра sample
+    возвращает (None, 'BERNOULLI').
+
+    Исключения:
+    - ValueError: Если доля выборки не число от 0 до 100 или метод неизвестен.
+    """
+    method = request.query_params.get('sample_method', 'bernoulli').upper()
+    if method not in ('SYSTEM', 'BERNOULLI'):
+        raise ValueError(method)
+    value = request.query_params.get('sample')
+    if value is None:
+        return None, method
+    sample = float(value)
+    if not 0 < sample <= 100:
+        raise ValueError(value)
+    return (sample if sample < 100 else None), method
+
+
+def get_body_hash(request) -> str:
+    """
+    Возвращает хэш тела запроса ответа в каноническом виде: одни и те же данные, отправленные
+    формой и JSON ('1' и 1), дают один хэш. Корректное тело приводится PostAnswerSerializer
+    (поля, которые обработка ответа не читает, не учитываются), некорректное хэшируется как есть.
+    """
+    serializer = PostAnswerSerializer(data=request.data)
+    data = serializer.validated_data if serializer.is_valid() else request.data
+    if hasattr(data, 'dict'):
+        # QueryDict формы: по одному значению на поле, как при обработке
+        data = data.dict()
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
 class SurveyView(APIView):
     """
     Класс для обработки запросов, связанных с прохождением опросов.
@@ -40,6 +109,8 @@ class SurveyView(APIView):
     - post(self, request, pk):
         Обработчик POST-запроса. Обрабатывает ответ пользователя на вопрос и возвращает данные
         для следующего вопроса или сообщение об окончании опроса.
+        Повторный запрос с тем же заголовком Idempotency-Key получает сохранённый ответ
+        без обращения к базе данных.
 
         Параметры:
         - request: Request, объект запроса.
@@ -51,8 +122,8 @@ class SurveyView(APIView):
     serializer_class = QuestionSerializer
 
     def get(self, request, pk):
-        survey = get_object_or_404(Survey, pk=pk)
-        first_question = survey.questions.first()  # первый вопрос
+        get_object_or_404(Survey, pk=pk)
+        first_question = get_first_question(pk)  # первый вопрос
         serializer = self.serializer_class(first_question)
         return Response(serializer.data)
 
@@ -61,6 +132,13 @@ class SurveyView(APIView):
         Обработчик POST-запроса. Обрабатывает ответ пользователя на вопрос и возвращает данные
         для следующего вопроса или сообщение об окончании опроса.
 
+        Если передан заголовок Idempotency-Key, ответ сохраняется в кэше на
+        SURVEY_IDEMPOTENCY_TTL секунд, и повторы запроса получают его без повторной обработки.
+        Повтор, пришедший пока исходный запрос ещё обрабатывается, получает 409
+        (блокировка живёт SURVEY_IDEMPOTENCY_LOCK_TTL секунд на случай падения обработчика).
+        Повтор того же ключа с другими данными ответа получает 422 (тело сравнивается
+        в каноническом виде, см. get_body_hash).
+
         Параметры:
         - request: Request, объект запроса.
         - pk: int, идентификатор опроса.
@@ -69,10 +147,45 @@ class SurveyView(APIView):
         - Response: Ответ с данными для следующего вопроса или сообщением об окончании опроса.
         """
         author = self.request.user
+        idempotency_key = request.headers.get('Idempotency-Key')
+
+        if not idempotency_key:
+            return Response(self.process_answer(request, author, pk))
+
+        if len(idempotency_key) > 255:
+            return Response({"error": "Слишком длинный Idempotency-Key"}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Ключ хэшируется, чтобы длина ключа кэша не зависела от заголовка (memcached - до 250 байт)
+        key_hash = hashlib.sha256(idempotency_key.encode('utf-8')).hexdigest()
+        cache_key = f'survey:idempotency:{author.pk}:{pk}:{key_hash}'
+        body_hash = get_body_hash(request)
+
+        cached = cache.get(cache_key)
+        if cached is not None:
+            if cached['body_hash'] != body_hash:
+                return Response({"error": "Idempotency-Key уже использован с другими данными запроса"},
+                                status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+            return Response(cached['response'])
+
+        lock_key = f'{cache_key}:lock'
+        if not cache.add(lock_key, True, settings.SURVEY_IDEMPOTENCY_LOCK_TTL):
+            return Response({"error": "Запрос с этим Idempotency-Key уже обрабатывается"},
+                            status=status.HTTP_409_CONFLICT)
+
+        try:
+            response_data = self.process_answer(request, author, pk)
+            cache.set(cache_key, {'body_hash': body_hash, 'response': response_data},
+                      settings.SURVEY_IDEMPOTENCY_TTL)
+        finally:
+            cache.delete(lock_key)
+
+        return Response(response_data)
+
+    @staticmethod
+    def process_answer(request, author, pk):
         request_data = PostAnswerSerializer(data=request.data)
         survey = get_object_or_404(Survey, pk=pk)
-        response_data = process_user_answer(author, request_data, survey)
-        return Response(response_data)
+        return process_user_answer(author, request_data, survey)
 
 
 class NumberRespondents(APIView):
@@ -80,6 +193,7 @@ class NumberRespondents(APIView):
     Получение общего количества участников опроса по его ID
     (survey/<int:pk>/respondents/  - здесь <int:pk>- это pk опроса)
     """
+    renderer_classes = ANALYTICS_RENDERERS
 
     def get(self, request, pk):
         """
@@ -91,7 +205,11 @@ class NumberRespondents(APIView):
         Возвращает:
         - JSON-ответ с общим количеством участников опроса.
         """
-        result = get_number_respondents(pk)
+        snapshot = get_survey_snapshot(pk)
+        if snapshot is not None:
+            result = snapshot['number_respondents']
+        else:
+            result = get_number_respondents(pk)
         return Response(result, status=status.HTTP_200_OK)
 
 
@@ -100,6 +218,7 @@ class NumberAnswers(APIView):
     Кол-во ответивших и их доля от общего кол-ва участников опроса (например, 95 / 95%)
     (survey/<int:survey_id>/respondents/<int:question_id>/)
     """
+    renderer_classes = ANALYTICS_RENDERERS
 
     def get(self, request, survey_id: int, question_id: int) -> Response:
         """
@@ -112,7 +231,14 @@ class NumberAnswers(APIView):
         Возвращает:
         - Response: Ответ с результатами запроса.
         """
-        response_data = get_number_answers(survey_id, question_id)
+        snapshot = get_survey_snapshot(survey_id)
+        if snapshot is not None:
+            response_data = snapshot['number_answers'].get(
+                str(question_id),
+                {"total_respondents": 0, "percentage_respondents": "0.00%"}
+            )
+        else:
+            response_data = get_number_answers(survey_id, question_id)
         return Response(response_data)
 
 
@@ -121,8 +247,10 @@ class OrderingQuestions(APIView):
     Порядковый номер вопроса по количеству ответивших.
     Если кол-во совпадает, то и номер должен совпадать.
     (survey/<int:survey_id>/ordering/)
+    ?sample=5 - приближённый расчёт по выборке 5% строк (sample_method=bernoulli|system, для system без *_se)
     <int:survey_id> - id опроса
     """
+    renderer_classes = ANALYTICS_RENDERERS
 
     def get(self, request, survey_id: int) -> Response:
         """
@@ -134,7 +262,17 @@ class OrderingQuestions(APIView):
         Возвращает:
         - Response: Ответ с результатами запроса.
         """
-        response_data = get_ordering_questions(survey_id)
+        try:
+            sample, sample_method = get_sample_params(request)
+        except ValueError:
+            return Response({"error": "sample должен быть числом от 0 до 100, sample_method - bernoulli или system"},
+                            status=400)
+
+        snapshot = get_survey_snapshot(survey_id)
+        if snapshot is not None:
+            response_data = snapshot['ordering']
+        else:
+            response_data = get_ordering_questions(survey_id, sample, sample_method)
         return Response(response_data)
 
 
@@ -142,9 +280,12 @@ class ResponseRate(APIView):
     """
     Класс для подсчета количества выбравших каждый вариант ответа.
     (survey/<int:survey_id>/response_rate/<int:question_id>/)
+    ?confidence=0.95 - добавить доверительные интервалы и попарную значимость различий
+    ?sample=5 - приближённый расчёт по выборке 5% строк (sample_method=bernoulli|system, для system без *_se)
     <int:survey_id> - id опроса
     <int:question_id> - id вопроса
     """
+    renderer_classes = ANALYTICS_RENDERERS
 
     def get(self, request, survey_id: int, question_id: int) -> Response:
         """
@@ -157,7 +298,25 @@ class ResponseRate(APIView):
         Возвращает:
         - Response: Ответ с результатами подсчета.
         """
-        response_data = calculate_response_rate(survey_id, question_id)
+        try:
+            confidence = get_confidence_level(request)
+        except ValueError:
+            return Response({"error": "confidence должен быть числом от 0 до 1"}, status=400)
+
+        try:
+            sample, sample_method = get_sample_params(request)
+        except ValueError:
+            return Response({"error": "sample должен быть числом от 0 до 100, sample_method - bernoulli или system"},
+                            status=400)
+
+        snapshot = get_survey_snapshot(survey_id)
+        if snapshot is not None:
+            response_data = snapshot['response_rate'].get(str(question_id), [{'total_users_count': 0}])
+            if confidence is not None:
+                answers = response_data[:-1]
+                add_confidence(answers, [question_id] * len(answers), 'user_count', 'answer_id', confidence)
+        else:
+            response_data = calculate_response_rate(survey_id, question_id, confidence, sample, sample_method)
         return Response(response_data)
 
 
@@ -165,6 +324,7 @@ class SurveyStatistics(APIView):
     """
     Представление для получения статистики опроса.
     (survey/<int:survey_id>/statistics/)
+    ?confidence=0.95 - добавить доверительные интервалы и попарную значимость различий
     <int:survey_id> - id опроса
 
     Параметры:
@@ -173,6 +333,7 @@ class SurveyStatistics(APIView):
     Возвращает:
     - Response: JSON-ответ с статистикой опроса.
     """
+    renderer_classes = ANALYTICS_RENDERERS
 
     def get(self, request, survey_id: int) -> Response:
         """
@@ -189,5 +350,247 @@ class SurveyStatistics(APIView):
         except ValueError:
             return Response({"error": "Неверный survey_id"}, status=400)
 
-        response_data = get_survey_statistics(survey_id)
+        try:
+            confidence = get_confidence_level(request)
+        except ValueError:
+            return Response({"error": "confidence должен быть числом от 0 до 1"}, status=400)
+
+        snapshot = get_survey_snapshot(survey_id)
+        if snapshot is not None:
+            response_data = snapshot['statistics']
+            # Интервалы считаются по номеру вопроса из снимка; в снимках, сохранённых
+            # до появления поля, номера нет - группируем по тексту вопроса
+            groups = [row.pop('question_id', row['question_text']) for row in response_data]
+            if confidence is not None:
+                add_confidence(response_data, groups, 'answer_count', 'answer_text', confidence)
+        else:
+            response_data = get_survey_statistics(survey_id, confidence)
         return Response(response_data)
+
+
+class CompletionTime(APIView):
+    """
+    Представление для получения квантилей времени прохождения опроса и времени ответа на вопросы.
+    (survey/<int:survey_id>/timing/)
+    <int:survey_id> - id опроса
+    """
+    renderer_classes = ANALYTICS_RENDERERS
+
+    def get(self, request, survey_id: int) -> Response:
+        """
+        Получить p50, p90 и p99 времени прохождения опроса и времени ответа на каждый вопрос.
+
+        Параметры:
+        - survey_id (int): Идентификатор опроса.
+
+        Возвращает:
+        - Response: JSON-ответ с квантилями в секундах.
+        """
+        return Response(get_survey_timing(survey_id))
+
+
+class CloseSurvey(APIView):
+    """
+    Закрытие опроса с сохранением неизменяемого снимка итоговой аналитики.
+    После закрытия все эндпоинты аналитики отдают данные из снимка.
+    (survey/<int:survey_id>/close/)
+    <int:survey_id> - id опроса
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, survey_id: int) -> Response:
+        """
+        Обработка POST-запроса для закрытия опроса.
+
+        Параметры:
+        - survey_id: int, номер опроса.
+
+        Возвращает:
+        - Response: Ответ с датой закрытия опроса или ошибкой, если опрос уже закрыт.
+        """
+        try:
+            snapshot = close_survey(survey_id)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"closed_at": snapshot.created_at}, status=status.HTTP_201_CREATED)
+
+
+class SurveysDashboard(APIView):
+    """
+    Сводка основных показателей по набору опросов одним запросом к базе данных.
+    (survey/dashboard/?ids=1,2,3 или survey/dashboard/?start=1&end=500)
+    Постраничный вывод: page (с 1) и page_size (не больше max_page_size).
+    """
+    renderer_classes = ANALYTICS_RENDERERS
+    page_size = 100
+    max_page_size = 500
+    max_ids = 1000
+
+    def get(self, request) -> Response:
+        """
+        Обработка GET-запроса для получения сводки по опросам.
+
+        Параметры (query string):
+        - ids: str, номера опросов через запятую.
+        - start, end: int, диапазон номеров опросов, если ids не передан.
+        - page: int, номер страницы.
+        - page_size: int, размер страницы.
+
+        Возвращает:
+        - Response: Ответ с общим количеством опросов и показателями опросов страницы.
+        """
+        params = request.query_params
+        try:
+            page = int(params.get('page', 1))
+            page_size = min(int(params.get('page_size', self.page_size)), self.max_page_size)
+            if params.get('ids'):
+                survey_ids = sorted({int(item) for item in params['ids'].split(',') if item.strip()})
+                id_range = None
+            else:
+                survey_ids = None
+                id_range = (int(params['start']), int(params['end']))
+        except (KeyError, ValueError):
+            return Response({"error": "Передайте ids или start и end"}, status=status.HTTP_400_BAD_REQUEST)
+
+        if page < 1 or page_size < 1:
+            return Response({"error": "Неверные page или page_size"}, status=status.HTTP_400_BAD_REQUEST)
+        if survey_ids is not None and len(survey_ids) > self.max_ids:
+            return Response({"error": f"Не больше {self.max_ids} опросов в ids"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        surveys_key = ','.join(map(str, survey_ids)) if survey_ids is not None else '{}-{}'.format(*id_range)
+        # Список ids может быть длинным (до max_ids), в ключ кэша попадает его хэш
+        surveys_hash = hashlib.sha256(surveys_key.encode('utf-8')).hexdigest()
+        cache_key = f'survey:dashboard:{surveys_hash}:{page}:{page_size}'
+        response_data = cache.get(cache_key)
+        if response_data is None:
+            response_data = get_surveys_dashboard(
+                survey_ids=survey_ids,
+                id_range=id_range,
+                limit=page_size,
+                offset=(page - 1) * page_size
+            )
+            response_data.update({'page': page, 'page_size': page_size})
+            cache.set(cache_key, response_data, settings.SURVEY_DASHBOARD_CACHE_TTL)
+
+        response = Response(response_data)
+        patch_cache_control(response, max_age=settings.SURVEY_DASHBOARD_CACHE_TTL)
+        return response
+
+
+class ExportSurvey(APIView):
+    """
+    Выгрузка опроса с вопросами, группами ответов и ответами в JSON.
+    (survey/<int:survey_id>/export/)
+    <int:survey_id> - id опроса
+    """
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, survey_id: int) -> Response:
+        """
+        Обработка GET-запроса для выгрузки опроса.
+
+        Параметры:
+        - survey_id: int, номер опроса.
+
+        Возвращает:
+        - Response: JSON-описание графа опроса.
+        """
+        get_object_or_404(Survey, pk=survey_id)
+        return Response(export_survey_graph(survey_id))
+
+
+class ImportSurvey(APIView):
+    """
+    Создание опроса по JSON-описанию, полученному из survey/<int:survey_id>/export/.
+    (survey/import/)
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request) -> Response:
+        """
+        Обработка POST-запроса для загрузки опроса.
+
+        Параметры:
+        - request.data: JSON-описание графа опроса, необязательный ключ new_title - название нового опроса.
+
+        Возвращает:
+        - Response: Ответ с id созданного опроса.
+        """
+        if not isinstance(request.data, dict):
+            return Response({"error": "Ожидается JSON-объект с описанием опроса"},
+                            status=status.HTTP_400_BAD_REQUEST)
+        title = request.data.get('new_title')
+        if title is not None and not isinstance(title, str):
+            return Response({"error": "new_title должен быть строкой"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            survey = import_survey_graph(request.data, title=title)
+        except ValueError as error:
+            return Response({"error": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({"id": survey.pk}, status=status.HTTP_201_CREATED)
+
+
+class CloneSurvey(APIView):
+    """
+    Копирование опроса со всеми вопросами, группами ответов и ответами.
+    (survey/<int:survey_id>/clone/)
+    <int:survey_id> - id опроса
+    Пример запроса: { "title": "Опрос для клиента" }
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, survey_id: int) -> Response:
+        """
+        Обработка POST-запроса для копирования опроса.
+
+        Параметры:
+        - survey_id: int, номер копируемого опроса.
+
+        Возвращает:
+        - Response: Ответ с id созданной копии.
+        """
+        get_object_or_404(Survey, pk=survey_id)
+        if not isinstance(request.data, dict):
+            return Response({"error": "Ожидается JSON-объект"}, status=status.HTTP_400_BAD_REQUEST)
+        title = request.data.get('title')
+        if title is not None and not isinstance(title, str):
+            return Response({"error": "title должен быть строкой"}, status=status.HTTP_400_BAD_REQUEST)
+
+        survey = clone_survey(survey_id, title=title)
+        return Response({"id": survey.pk}, status=status.HTTP_201_CREATED)
+
+
+class EnrollParticipants(APIView):
+    """
+    Массовое добавление участников опроса.
+    (survey/<int:survey_id>/participants/)
+    <int:survey_id> - id опроса
+    Пример запроса: { "user_ids": [1, 2, 3] } или CSV-файл в поле file (id пользователя в первой колонке).
+    """
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, survey_id: int) -> Response:
+        """
+        Обработка POST-запроса для добавления участников опроса.
+
+        Параметры:
+        - survey_id: int, номер опроса.
+
+        Возвращает:
+        - Response: Ответ с количеством добавленных и пропущенных пользователей.
+        """
+        get_object_or_404(Survey, pk=survey_id)
+
+        if 'file' in request.FILES:
+            user_ids = read_user_ids(io.TextIOWrapper(request.FILES['file'].file, encoding='utf-8-sig'))
+        else:
+            user_ids = request.data.get('user_ids')
+            if not isinstance(user_ids, list) or not all(isinstance(item, int) for item in user_ids):
+                return Response({"error": "Передайте список user_ids или CSV-файл в поле file"},
+                                status=status.HTTP_400_BAD_REQUEST)
+
+        result = enroll_participants(survey_id, user_ids)
+        return Response(result, status=status.HTTP_200_OK)
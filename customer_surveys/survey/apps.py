@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class SurveyConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "survey"
+
+    def ready(self):
+        # Регистрирует сброс кэша пользователей при их изменении
+        from . import backends  # noqa: F401
+        # Регистрирует удаление статистики в шардах при удалении объектов каталога
+        from . import sharding  # noqa: F401
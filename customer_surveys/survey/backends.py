@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+User = get_user_model()
+
+
+def user_cache_key(user_id) -> str:
+    return f'survey:user:{user_id}'
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend с кэшированием пользователя, которого AuthenticationMiddleware
+    загружает из сессии на каждом запросе.
+
+    Пользователь хранится в кэше SURVEY_USER_CACHE_TTL секунд (0 - без кэширования)
+    и удаляется из него при сохранении или удалении. С локальным кэшем (LocMemCache)
+    другие процессы увидят изменения пользователя только по истечении TTL.
+    """
+
+    def get_user(self, user_id):
+        ttl = settings.SURVEY_USER_CACHE_TTL
+        if not ttl:
+            return super().get_user(user_id)
+
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, ttl)
+        return user
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    cache.delete(user_cache_key(instance.pk))
@@ -0,0 +1,151 @@
+import json
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from typing import Dict, Union
+
+import numpy as np
+
+from .models import UserStatistics, Question, Answer
+from .sharding import get_survey_shard
+
+# Колонки выгрузки и их типы. Время хранится в микросекундах от начала эпохи (UTC).
+COLUMNS = {
+    'user_id': np.int32,
+    'questions_shown_id': np.int32,
+    'questions_answered_id': np.int32,
+    'answers_given_id': np.int32,
+    'timestamp': np.int64,
+}
+DICTIONARY_FILE = 'dictionary.json'
+CHUNK_SIZE = 100_000
+
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def export_survey_columns(survey_id: int, directory: Union[str, Path]) -> int:
+    """
+    Выгружает статистику опроса в колоночном бинарном формате:
+    по одному .npy файлу на колонку и словарь текстов вопросов и ответов.
+
+    Строки читаются из базы порциями и сразу пишутся в файлы, отображённые в память,
+    поэтому потребление памяти не зависит от размера опроса.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+    - directory: каталог, в который записываются файлы выгрузки.
+
+    Возвращает:
+    - int: Количество выгруженных строк.
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    statistics = UserStatistics.objects.using(get_survey_shard(survey_id)).filter(survey_id=survey_id)
+    # Фиксируем границу выгрузки, чтобы новые ответы не меняли размер массивов
+    max_id = statistics.order_by('-id').values_list('id', flat=True).first() or 0
+    statistics = statistics.filter(id__lte=max_id)
+    total = statistics.count()
+
+    arrays = {
+        name: np.lib.format.open_memmap(
+            directory / f'{name}.npy', mode='w+', dtype=dtype, shape=(total,)
+        )
+        for name, dtype in COLUMNS.items()
+    }
+
+    rows = statistics.order_by('id').values_list(
+        'user_id',
+        'questions_shown_id',
+        'questions_answered_id',
+        'answers_given_id',
+        'timestamp',
+    ).iterator(chunk_size=CHUNK_SIZE)
+
+    count = 0
+    question_ids = set()
+    answer_ids = set()
+    chunk = []
+    for row in rows:
+        if count + len(chunk) >= total:
+            break
+        chunk.append(row)
+        if len(chunk) == CHUNK_SIZE:
+            _write_chunk(arrays, chunk, count, question_ids, answer_ids)
+            count += len(chunk)
+            chunk = []
+    if chunk:
+        _write_chunk(arrays, chunk, count, question_ids, answer_ids)
+        count += len(chunk)
+
+    for array in arrays.values():
+        array.flush()
+
+    dictionary = {
+        'survey_id': survey_id,
+        'rows': count,
+        'columns': {name: np.dtype(dtype).str for name, dtype in COLUMNS.items()},
+        'timestamp_unit': 'us',
+        'questions': {
+            str(question_id): text
+            for question_id, text in Question.objects.filter(id__in=question_ids).values_list('id', 'text')
+        },
+        'answers': {
+            str(answer_id): text
+            for answer_id, text in Answer.objects.filter(id__in=answer_ids).values_list('id', 'text')
+        },
+    }
+    with open(directory / DICTIONARY_FILE, 'w', encoding='utf-8') as file:
+        json.dump(dictionary, file, ensure_ascii=False)
+
+    return count
+
+
+def _write_chunk(arrays: Dict[str, np.ndarray], chunk: list, offset: int, question_ids: set, answer_ids: set):
+    """
+    Записывает порцию строк в отображённые в память массивы начиная с offset.
+    """
+    user_ids, shown_ids, answered_ids, given_ids, timestamps = zip(*chunk)
+    end = offset + len(chunk)
+    arrays['user_id'][offset:end] = user_ids
+    arrays['questions_shown_id'][offset:end] = shown_ids
+    arrays['questions_answered_id'][offset:end] = answered_ids
+    arrays['answers_given_id'][offset:end] = given_ids
+    arrays['timestamp'][offset:end] = [(timestamp - EPOCH) // MICROSECOND for timestamp in timestamps]
+
+    question_ids.update(shown_ids)
+    question_ids.update(answered_ids)
+    answer_ids.update(given_ids)
+
+
+def load_survey_columns(directory: Union[str, Path]) -> Dict:
+    """
+    Открывает колоночную выгрузку опроса без чтения данных в память.
+
+    Массивы открываются через np.load(mmap_mode='r'), поэтому страницы файлов
+    подгружаются операционной системой только при обращении к ним.
+
+    Параметры:
+    - directory: каталог с файлами выгрузки.
+
+    Возвращает:
+    - Dict: Словарь с ключами 'columns' (имя колонки -> массив только для чтения),
+      'questions' и 'answers' (id -> текст), 'survey_id' и 'rows'.
+    """
+    directory = Path(directory)
+    with open(directory / DICTIONARY_FILE, encoding='utf-8') as file:
+        dictionary = json.load(file)
+
+    rows = dictionary['rows']
+    columns = {
+        name: np.load(directory / f'{name}.npy', mmap_mode='r')[:rows]
+        for name in dictionary['columns']
+    }
+
+    return {
+        'survey_id': dictionary['survey_id'],
+        'rows': rows,
+        'columns': columns,
+        'questions': {int(key): text for key, text in dictionary['questions'].items()},
+        'answers': {int(key): text for key, text in dictionary['answers'].items()},
+    }
@@ -0,0 +1,177 @@
+from typing import Dict, Optional
+
+from django.db import transaction
+
+from .models import Survey, SurveyQuestion, Question, Answer, AnswerGroup
+
+GRAPH_FORMAT_VERSION = 2
+
+
+def export_survey_graph(survey_id: int) -> Dict:
+    """
+    Выгружает опрос вместе с вопросами, группами ответов и ответами в словарь для JSON.
+    Количество запросов не зависит от размера опроса.
+
+    В граф входят вопросы опроса (Survey.questions) в порядке их номеров.
+    Ссылки parent_question и next_question на вопросы вне графа не сохраняются.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - Dict: Описание графа опроса с исходными id объектов.
+    """
+    survey = Survey.objects.get(pk=survey_id)
+    survey_questions = list(
+        SurveyQuestion.objects.filter(
+            survey_id=survey_id
+        ).order_by('position').values_list('question_id', flat=True)
+    )
+    question_ids = set(survey_questions)
+
+    questions = list(
+        Question.objects.filter(id__in=question_ids).order_by('id').values(
+            'id', 'text', 'question_processed', 'answer_group_id', 'parent_question_id'
+        )
+    )
+    answers = list(
+        Answer.objects.filter(question_id__in=question_ids).order_by('id').values(
+            'id', 'number_answer', 'text', 'question_id', 'next_question_id', 'group_id'
+        )
+    )
+    group_ids = {question['answer_group_id'] for question in questions}
+    group_ids.update(answer['group_id'] for answer in answers)
+    answer_groups = list(
+        AnswerGroup.objects.filter(id__in=group_ids).order_by('id').values('id', 'name')
+    )
+
+    return {
+        'version': GRAPH_FORMAT_VERSION,
+        'title': survey.title,
+        'answer_groups': answer_groups,
+        'questions': [
+            {
+                'id': question['id'],
+                'text': question['text'],
+                'question_processed': question['question_processed'],
+                'answer_group': question['answer_group_id'],
+                'parent_question': question['parent_question_id']
+                if question['parent_question_id'] in question_ids else None,
+            }
+            for question in questions
+        ],
+        'answers': [
+            {
+                'id': answer['id'],
+                'number_answer': answer['number_answer'],
+                'text': answer['text'],
+                'question': answer['question_id'],
+                'next_question': answer['next_question_id']
+                if answer['next_question_id'] in question_ids else None,
+                'group': answer['group_id'],
+            }
+            for answer in answers
+        ],
+        'survey_questions': survey_questions,
+    }
+
+
+def import_survey_graph(data: Dict, title: Optional[str] = None) -> Survey:
+    """
+    Создаёт новый опрос по описанию графа из export_survey_graph.
+
+    Id объектов из описания переназначаются в памяти, все объекты создаются
+    фиксированным количеством bulk_create, независимо от размера опроса.
+    Описания версии 1 (две M2M-связи опроса и вопросов) тоже принимаются.
+
+    Параметры:
+    - data: Dict, описание графа опроса.
+    - title: Optional[str], название нового опроса (по умолчанию - из описания).
+
+    Возвращает:
+    - Survey: Созданный опрос.
+
+    Исключения:
+    - ValueError: Если описание графа некорректно.
+    """
+    if data.get('version') not in (1, GRAPH_FORMAT_VERSION):
+        raise ValueError('Неподдерживаемая версия описания опроса')
+
+    try:
+        with transaction.atomic():
+            survey = Survey.objects.create(title=title or data['title'])
+
+            groups = {
+                item['id']: AnswerGroup(name=item['name'])
+                for item in data['answer_groups']
+            }
+            AnswerGroup.objects.bulk_create(groups.values())
+
+            questions = {
+                item['id']: Question(
+                    text=item['text'],
+                    question_processed=item.get('question_processed', False),
+                    answer_group=_remap(groups, item['answer_group']),
+                )
+                for item in data['questions']
+            }
+            Question.objects.bulk_create(questions.values())
+
+            # parent_question ссылается на вопросы этого же графа, поэтому проставляется после вставки
+            children = []
+            for item in data['questions']:
+                if item['parent_question'] is not None:
+                    question = questions[item['id']]
+                    question.parent_question = _remap(questions, item['parent_question'])
+                    children.append(question)
+            if children:
+                Question.objects.bulk_update(children, ['parent_question'])
+
+            Answer.objects.bulk_create(
+                Answer(
+                    number_answer=item['number_answer'],
+                    text=item['text'],
+                    question=_remap(questions, item['question']),
+                    next_question=_remap(questions, item['next_question']),
+                    group=_remap(groups, item['group']),
+                )
+                for item in data['answers']
+            )
+
+            survey_questions = list(dict.fromkeys(data['survey_questions'] + data.get('question_surveys', [])))
+            SurveyQuestion.objects.bulk_create(
+                SurveyQuestion(survey=survey, question=_remap(questions, question_id), position=position)
+                for position, question_id in enumerate(survey_questions, start=1)
+            )
+    except (KeyError, TypeError) as error:
+        raise ValueError(f'Некорректное описание опроса: {error}')
+
+    return survey
+
+
+def clone_survey(survey_id: int, title: Optional[str] = None) -> Survey:
+    """
+    Создаёт копию опроса со всеми вопросами, группами ответов и ответами.
+    Участники и статистика не копируются.
+
+    Параметры:
+    - survey_id: int, номер копируемого опроса.
+    - title: Optional[str], название копии.
+
+    Возвращает:
+    - Survey: Созданная копия опроса.
+    """
+    data = export_survey_graph(survey_id)
+    return import_survey_graph(data, title=title or f"{data['title']} (копия)")
+
+
+def _remap(objects: Dict, old_id: Optional[int]):
+    """
+    Возвращает новый объект по id из описания графа или None.
+    """
+    if old_id is None:
+        return None
+    try:
+        return objects[old_id]
+    except KeyError:
+        raise ValueError(f'Ссылка на неизвестный объект {old_id}')
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+from collections import Counter
+from typing import Dict, Optional, Set
+
+from django.conf import settings
+
+
+class SurveyBroadcaster:
+    """
+    Раздача изменений результатов опросов подписчикам Server-Sent Events внутри процесса.
+
+    Ответы пользователей только меняют счётчики в памяти (publish), а раз в тик
+    накопленные изменения одним событием рассылаются всем подписчикам опроса.
+    Поэтому нагрузка на базу данных не зависит от количества подключённых зрителей.
+
+    Ограничение: подписчики видят только ответы, записанные в этом же процессе.
+    Ответы, принятые другими процессами (несколько воркеров uvicorn или gunicorn,
+    отдельный WSGI-сервер для API), в трансляцию не попадут. Поэтому и ответы,
+    и трансляцию должен обслуживать один процесс ASGI
+    (uvicorn customer_surveys.asgi:application без --workers).
+    """
+
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._pending: Dict[int, Dict[str, Counter]] = {}
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+        self._task = None
+
+    def publish(self, survey_id: int, question_id: int, answer_id: int,
+                previous_answer_id: Optional[int] = None):
+        """
+        Учитывает новый ответ или, если передан previous_answer_id, замену ответа на вопрос:
+        прежний вариант уменьшается на 1, новый увеличивается на 1, количество ответов
+        на вопрос не меняется. Безопасно вызывать из любого потока.
+        """
+        if survey_id not in self._subscribers:
+            return
+        with self._lock:
+            pending = self._pending.setdefault(
+                survey_id, {'questions': Counter(), 'answers': Counter()}
+            )
+            if previous_answer_id is None:
+                pending['questions'][question_id] += 1
+            else:
+                pending['answers'][previous_answer_id] -= 1
+            pending['answers'][answer_id] += 1
+
+    def subscribe(self, survey_id: int) -> asyncio.Queue:
+        """
+        Подписывает на изменения опроса. Вызывается из цикла событий.
+        """
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers.setdefault(survey_id, set()).add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, survey_id: int, queue: asyncio.Queue):
+        subscribers = self._subscribers.get(survey_id)
+        if subscribers is None:
+            return
+        subscribers.discard(queue)
+        if not subscribers:
+            del self._subscribers[survey_id]
+            with self._lock:
+                self._pending.pop(survey_id, None)
+
+    async def _run(self):
+        while self._subscribers:
+            await asyncio.sleep(settings.SURVEY_LIVE_TICK)
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+
+        for survey_id, delta in pending.items():
+            event = {
+                'survey_id': survey_id,
+                'responses': sum(delta['questions'].values()),
+                'questions': {str(key): value for key, value in delta['questions'].items() if value},
+                'answers': {str(key): value for key, value in delta['answers'].items() if value},
+            }
+            for queue in list(self._subscribers.get(survey_id, ())):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Подписчик не успевает читать: очищаем очередь и закрываем поток,
+                    # клиент переподключится и заново получит текущие результаты
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+                    self.unsubscribe(survey_id, queue)
+
+
+broadcaster = SurveyBroadcaster()
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.models import Survey
+from survey.service import enroll_participants, read_user_ids
+
+
+class Command(BaseCommand):
+    """
+    Массовое добавление участников опроса из CSV (id пользователя в первой колонке).
+    Пример: python manage.py enroll_participants 1 users.csv
+    """
+    help = 'Добавляет участников опроса пачками из CSV-файла или stdin'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_id', type=int, help='id опроса')
+        parser.add_argument('path', help='Путь к CSV-файлу или - для чтения из stdin')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        survey_id = options['survey_id']
+        if not Survey.objects.filter(pk=survey_id).exists():
+            raise CommandError(f'Опрос {survey_id} не найден')
+
+        if options['path'] == '-':
+            result = enroll_participants(survey_id, read_user_ids(sys.stdin), options['batch_size'])
+        else:
+            with open(options['path'], encoding='utf-8-sig', newline='') as file:
+                result = enroll_participants(survey_id, read_user_ids(file), options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Добавлено: {result['inserted']}, пропущено: {result['skipped']}"
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from survey.columnar import export_survey_columns
+from survey.models import Survey
+
+
+class Command(BaseCommand):
+    """
+    Выгрузка статистики опроса в колоночном бинарном формате (.npy + словарь текстов).
+    Пример: python manage.py export_survey_columns 1 exports/survey_1
+    """
+    help = 'Выгружает статистику опроса в колоночные .npy файлы для офлайн-анализа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_id', type=int, help='id опроса')
+        parser.add_argument('directory', help='Каталог для файлов выгрузки')
+
+    def handle(self, *args, **options):
+        survey_id = options['survey_id']
+        if not Survey.objects.filter(pk=survey_id).exists():
+            raise CommandError(f'Опрос {survey_id} не найден')
+
+        count = export_survey_columns(survey_id, options['directory'])
+        self.stdout.write(self.style.SUCCESS(f'Выгружено строк: {count}'))
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from survey.models import Survey, UserStatistics
+from survey.service import move_survey_statistics
+from survey.sharding import get_survey_shard
+
+
+class Command(BaseCommand):
+    """
+    Перенос статистики опросов между базами SURVEY_SHARDS.
+
+    С номером опроса и --to переносит статистику опроса в указанную базу и закрепляет
+    опрос за ней. С --all находит в каждой базе опросы, статистика которых лежит не в их
+    текущей базе (например, после добавления баз в SURVEY_SHARD_DATABASES или после включения
+    шардирования, когда статистика ещё лежит в default), и переносит её.
+    Открытые опросы переносятся только с --force: ответы, записанные или изменённые
+    во время переноса, остаются в исходной базе до следующего запуска с --all.
+    Примеры: python manage.py rebalance_shards 15 --to shard_1
+             python manage.py rebalance_shards --all --force
+    """
+    help = 'Переносит статистику опросов между базами данных шардов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_id', type=int, nargs='?', help='id опроса')
+        parser.add_argument('--to', dest='target', choices=settings.SURVEY_SHARDS, help='База, в которую переносится опрос')
+        parser.add_argument('--all', action='store_true', help='Перенести все опросы, лежащие не в своей базе')
+        parser.add_argument('--force', action='store_true', help='Переносить открытые опросы')
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет перенесено')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        if options['all']:
+            moves = self.plan_rebalance()
+        elif options['survey_id'] is not None and options['target']:
+            survey = Survey.objects.filter(pk=options['survey_id']).first()
+            if survey is None:
+                raise CommandError(f"Опрос {options['survey_id']} не найден")
+            source = get_survey_shard(survey)
+            if source == options['target']:
+                raise CommandError(f'Статистика опроса {survey.pk} уже хранится в {source}')
+            moves = [(survey, source, options['target'], True)]
+        else:
+            raise CommandError('Передайте номер опроса и --to или --all')
+
+        for survey, source, target, pin in moves:
+            if not survey.is_closed and not options['force']:
+                self.stdout.write(self.style.WARNING(
+                    f'Опрос {survey.pk} открыт, пропущен ({source} -> {target}), используйте --force'
+                ))
+                continue
+            if options['dry_run']:
+                self.stdout.write(f'Опрос {survey.pk}: {source} -> {target}')
+                continue
+            copied = move_survey_statistics(survey.pk, source, target, pin, options['batch_size'])
+            self.stdout.write(f'Опрос {survey.pk}: {source} -> {target}, строк: {copied}')
+            if UserStatistics.objects.using(source).filter(survey_id=survey.pk).exists():
+                self.stdout.write(self.style.WARNING(
+                    f'В {source} остались ответы опроса {survey.pk}, записанные во время переноса, '
+                    f'перенесите их повторным запуском с --all'
+                ))
+
+        self.stdout.write(self.style.SUCCESS('Готово'))
+
+    def plan_rebalance(self):
+        """
+        Возвращает переносы (опрос, исходная база, целевая база, закрепить) для статистики,
+        лежащей не в текущей базе своего опроса.
+        """
+        moves = []
+        for source in dict.fromkeys([DEFAULT_DB_ALIAS, *settings.SURVEY_SHARDS]):
+            survey_ids = set(
+                UserStatistics.objects.using(source).values_list('survey_id', flat=True).distinct()
+            )
+            surveys = {survey.pk: survey for survey in Survey.objects.filter(pk__in=survey_ids)}
+            for survey_id in sorted(survey_ids):
+                survey = surveys.get(survey_id)
+                if survey is None:
+                    self.stdout.write(self.style.WARNING(f'В {source} есть статистика удалённого опроса {survey_id}'))
+                    continue
+                target = get_survey_shard(survey)
+                if target != source:
+                    moves.append((survey, source, target, survey.shard in settings.SURVEY_SHARDS))
+        return moves
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import django
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from survey.models import Survey
+
+
+def init_worker():
+    """
+    Инициализация процесса пула: своя настройка Django и свои соединения с базой данных.
+    """
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+
+def recompute_chunk(survey_ids):
+    from survey.service import recompute_survey_aggregates
+    return recompute_survey_aggregates(survey_ids)
+
+
+class Command(BaseCommand):
+    """
+    Параллельный пересчёт агрегатов всех опросов (total_participants, total_responses,
+    снимков закрытых опросов и скетчей времени прохождения). Опросы делятся на пачки, пачки обрабатываются в пуле процессов.
+    Номера обработанных опросов пишутся в файл состояния, поэтому после сбоя
+    команду можно перезапустить с --resume.
+    Пример: python manage.py recompute_statistics --workers 8 --resume
+    """
+    help = 'Пересчитывает агрегаты и снимки всех опросов в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(), help='Количество процессов')
+        parser.add_argument('--chunk-size', type=int, default=100, help='Количество опросов в пачке')
+        parser.add_argument('--resume', action='store_true', help='Пропустить опросы, пересчитанные при прошлом запуске')
+        parser.add_argument('--state-file', default='recompute_statistics.state',
+                            help='Файл с номерами уже пересчитанных опросов')
+
+    def handle(self, *args, **options):
+        state_file = options['state_file']
+        done = set()
+        if options['resume'] and os.path.exists(state_file):
+            with open(state_file) as file:
+                done = {int(line) for line in file if line.strip()}
+        elif os.path.exists(state_file):
+            os.remove(state_file)
+
+        survey_ids = [
+            survey_id for survey_id in Survey.objects.order_by('pk').values_list('pk', flat=True)
+            if survey_id not in done
+        ]
+        chunk_size = options['chunk_size']
+        chunks = [survey_ids[i:i + chunk_size] for i in range(0, len(survey_ids), chunk_size)]
+        total = len(survey_ids)
+        self.stdout.write(f'Опросов к пересчёту: {total} (пропущено уже пересчитанных: {len(done)})')
+
+        # Соединения родителя не должны наследоваться дочерними процессами
+        connections.close_all()
+        processed = 0
+        failed = 0
+        with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker) as executor, \
+                open(state_file, 'a') as state:
+            futures = {executor.submit(recompute_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    recomputed = future.result()
+                except Exception as error:
+                    failed += len(chunk)
+                    self.stderr.write(f'Ошибка пересчёта опросов {chunk[0]}-{chunk[-1]}: {error}')
+                    continue
+                state.write(''.join(f'{survey_id}\n' for survey_id in chunk))
+                state.flush()
+                processed += len(recomputed)
+                self.stdout.write(f'[{processed + failed}/{total}] пересчитано: {processed}, с ошибкой: {failed}')
+
+        if failed:
+            raise CommandError(f'Не пересчитано опросов: {failed}. Перезапустите команду с --resume')
+
+        os.remove(state_file)
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано опросов: {processed}'))
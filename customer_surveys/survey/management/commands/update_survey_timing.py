@@ -0,0 +1,55 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from survey.models import Survey
+from survey.service import update_survey_timing
+
+
+class Command(BaseCommand):
+    """
+    Дополняет скетчи времени прохождения опросов новыми ответами (эндпоинт survey/<id>/timing/
+    только читает их). Без номеров обновляются открытые опросы и закрытые опросы,
+    ответы которых ещё учтены не до конца. Запускается по расписанию, например раз в минуту из cron.
+    Примеры: python manage.py update_survey_timing
+             python manage.py update_survey_timing 15 --rebuild
+    """
+    help = 'Обновляет скетчи времени прохождения опросов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('survey_ids', type=int, nargs='*', help='Номера опросов')
+        parser.add_argument('--rebuild', action='store_true', help='Пересчитать скетчи по всем ответам')
+        parser.add_argument('--batch-size', type=int, default=10000, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        if options['survey_ids']:
+            survey_ids = options['survey_ids']
+        else:
+            settle = timedelta(seconds=settings.SURVEY_TIMING_SETTLE)
+            survey_ids = Survey.objects.filter(
+                Q(closed_at__isnull=True)
+                | Q(timing__isnull=True)
+                | Q(timing__processed_until__isnull=True)
+                | Q(timing__processed_until__lt=F('closed_at') + settle)
+            ).order_by('pk').values_list('pk', flat=True)
+
+        updated = 0
+        failed = []
+        for survey_id in survey_ids:
+            try:
+                update_survey_timing(survey_id, options['rebuild'], options['batch_size'])
+            except Survey.DoesNotExist:
+                failed.append(survey_id)
+                self.stderr.write(f'Опрос {survey_id} не найден')
+                continue
+            except Exception as error:
+                failed.append(survey_id)
+                self.stderr.write(f'Ошибка обновления опроса {survey_id}: {error}')
+                continue
+            updated += 1
+
+        if failed:
+            raise CommandError(f'Не обновлено опросов: {len(failed)} ({", ".join(map(str, failed))})')
+        self.stdout.write(self.style.SUCCESS(f'Обновлено опросов: {updated}'))
@@ -0,0 +1,191 @@
+import cProfile
+import json
+import random
+import re
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, List
+
+import brotli
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_string
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование отдельных запросов по требованию.
+
+    Запрос профилируется, если staff-пользователь передал заголовок X-Profile: 1
+    или запрос попал в выборку SURVEY_PROFILING_SAMPLE_RATE (доля от 0 до 1).
+    Запрос выполняется под cProfile, а все SQL-запросы и их длительность записываются
+    через execute_wrapper. Результат сохраняется в SURVEY_PROFILING_DIR: файл .prof
+    (для pstats/snakeviz) и .json с описанием запроса. Хранятся последние
+    SURVEY_PROFILING_MAX_FILES профилей, список самых медленных - в admin/profiles/.
+
+    Должен стоять после AuthenticationMiddleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self.should_profile(request):
+            return self.get_response(request)
+
+        queries = []
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(QueryRecorder(connection.alias, queries)))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        duration = time.perf_counter() - started
+
+        name = save_profile(request, response, profiler, queries, duration)
+        response['X-Profile-Id'] = name
+        return response
+
+    @staticmethod
+    def should_profile(request) -> bool:
+        if request.headers.get('X-Profile') == '1':
+            user = getattr(request, 'user', None)
+            return bool(user and user.is_staff)
+        rate = settings.SURVEY_PROFILING_SAMPLE_RATE
+        return rate > 0 and random.random() < rate
+
+
+class CompressionMiddleware:
+    """
+    Сжатие больших ответов API (brotli или gzip по заголовку Accept-Encoding клиента).
+
+    Сжимаются только ответы длиннее SURVEY_COMPRESS_MIN_SIZE байт с типом содержимого
+    из SURVEY_COMPRESS_CONTENT_TYPES: HTML-страницы с CSRF-токеном не сжимаются
+    (защита от BREACH), потоковые ответы (Server-Sent Events) не буферизуются.
+
+    Должен стоять в начале списка MIDDLEWARE, как GZipMiddleware.
+    """
+    brotli_quality = 5
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            response.streaming
+            or response.has_header('Content-Encoding')
+            or response.get('Content-Type', '').split(';')[0] not in settings.SURVEY_COMPRESS_CONTENT_TYPES
+        ):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+        if len(response.content) < settings.SURVEY_COMPRESS_MIN_SIZE:
+            return response
+
+        accepted = {
+            item.split(';')[0].strip().lower()
+            for item in request.headers.get('Accept-Encoding', '').split(',')
+        }
+        if 'br' in accepted:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=self.brotli_quality)
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            compressed = compress_string(response.content, max_random_bytes=100)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response['ETag'] = 'W/' + etag
+        return response
+
+
+class QueryRecorder:
+    """
+    Обёртка execute_wrapper, записывающая SQL-запросы и их длительность.
+    """
+
+    def __init__(self, alias: str, queries: List[Dict]):
+        self.alias = alias
+        self.queries = queries
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'alias': self.alias,
+                'sql': sql,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def save_profile(request, response, profiler: cProfile.Profile, queries: List[Dict], duration: float) -> str:
+    """
+    Сохраняет профиль запроса и удаляет самые старые профили сверх SURVEY_PROFILING_MAX_FILES.
+
+    Возвращает:
+    - str: Имя сохранённого профиля.
+    """
+    directory = Path(settings.SURVEY_PROFILING_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    slug = re.sub(r'[^A-Za-z0-9]+', '_', request.path).strip('_')[:60] or 'root'
+    name = f"{timezone.now():%Y%m%d%H%M%S%f}_{request.method}_{slug}"
+    profiler.dump_stats(directory / f'{name}.prof')
+
+    user = getattr(request, 'user', None)
+    with open(directory / f'{name}.json', 'w', encoding='utf-8') as file:
+        json.dump({
+            'name': name,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': user.get_username() if user and user.is_authenticated else None,
+            'status': response.status_code,
+            'created_at': timezone.now().isoformat(),
+            'duration_ms': round(duration * 1000, 3),
+            'sql_count': len(queries),
+            'sql_duration_ms': round(sum(query['duration_ms'] for query in queries), 3),
+            'queries': queries,
+        }, file, ensure_ascii=False)
+
+    profiles = sorted(directory.glob('*.json'))
+    for old in profiles[:-settings.SURVEY_PROFILING_MAX_FILES]:
+        old.unlink(missing_ok=True)
+        old.with_suffix('.prof').unlink(missing_ok=True)
+
+    return name
+
+
+def list_profiles(limit: int = 50) -> List[Dict]:
+    """
+    Возвращает описания сохранённых профилей, отсортированные по убыванию длительности запроса.
+    """
+    profiles = []
+    for path in Path(settings.SURVEY_PROFILING_DIR).glob('*.json'):
+        try:
+            with open(path, encoding='utf-8') as file:
+                profile = json.load(file)
+        except (OSError, ValueError):
+            continue
+        profile.pop('queries', None)
+        profiles.append(profile)
+
+    profiles.sort(key=lambda profile: profile['duration_ms'], reverse=True)
+    return profiles[:limit]
@@ -0,0 +1,95 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:25
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnswerGroup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, verbose_name='Название группы ответов')),
+            ],
+            options={
+                'verbose_name': 'Группа ответов',
+                'verbose_name_plural': 'Группы ответов',
+            },
+        ),
+        migrations.CreateModel(
+            name='Question',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(default='Default Text', verbose_name='Текст вопроса')),
+                ('question_processed', models.BooleanField(default=False, verbose_name='Вопрос обработан')),
+                ('answer_group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='questions', to='survey.answergroup', verbose_name='Группа ответов для вопроса')),
+                ('parent_question', models.ForeignKey(blank=True, help_text='Если вопрос зависит от предыдущего ответа, выберите предыдущий вопрос.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='child_questions', to='survey.question', verbose_name='Предыдущий вопрос')),
+            ],
+            options={
+                'verbose_name': 'Вопрос',
+                'verbose_name_plural': 'Вопросы',
+            },
+        ),
+        migrations.CreateModel(
+            name='Answer',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number_answer', models.IntegerField(default=1, verbose_name='Номер ответа')),
+                ('text', models.TextField(default='Default Text', verbose_name='Текст ответа')),
+                ('group', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='group_answers', to='survey.answergroup', verbose_name='Группа, которой принадлежит этот ответ')),
+                ('next_question', models.ForeignKey(blank=True, help_text='Если ответ влияет на следующий вопрос, выберите следующий вопрос.', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='next_question', to='survey.question', verbose_name='Следующий вопрос')),
+                ('question', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='answers', to='survey.question', verbose_name='Вопрос, к которому относится ответ')),
+            ],
+            options={
+                'verbose_name': 'Ответ',
+                'verbose_name_plural': 'Ответы',
+            },
+        ),
+        migrations.CreateModel(
+            name='Survey',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, verbose_name='Название опроса')),
+                ('total_participants', models.PositiveIntegerField(default=0, verbose_name='Общее количество участников опроса')),
+                ('total_responses', models.PositiveIntegerField(default=0, verbose_name='Общее количество ответивших')),
+                ('participants', models.ManyToManyField(related_name='participated_surveys', to=settings.AUTH_USER_MODEL, verbose_name='Участники опроса')),
+                ('questions', models.ManyToManyField(related_name='surveys_questions', to='survey.question', verbose_name='Вопросы для опроса')),
+            ],
+            options={
+                'verbose_name': 'Опрос',
+                'verbose_name_plural': 'Опросы',
+            },
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='survey',
+            field=models.ManyToManyField(related_name='survey_questions', to='survey.survey', verbose_name='Опрос'),
+        ),
+        migrations.CreateModel(
+            name='UserStatistics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('timestamp', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата и время ответа')),
+                ('question_processed', models.BooleanField(default=False, verbose_name='Вопрос обработан')),
+                ('answers_given', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_answers_given', to='survey.answer', verbose_name='Какими ответами ответил')),
+                ('questions_answered', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_questions_answered', to='survey.question', verbose_name='Вопросы, на которые ответил')),
+                ('questions_shown', models.ForeignKey(default=1, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_questions_shown', to='survey.question', verbose_name='Показанные вопросы')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_survey', to='survey.survey', verbose_name='Опрос')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Статистика пользователя',
+                'verbose_name_plural': 'Статистика пользователей',
+            },
+        ),
+    ]
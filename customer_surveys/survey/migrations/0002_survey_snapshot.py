@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='closed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата и время закрытия опроса'),
+        ),
+        migrations.CreateModel(
+            name='SurveySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField(verbose_name='Сжатые данные аналитики')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата и время создания снимка')),
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot', to='survey.survey', verbose_name='Опрос')),
+            ],
+            options={
+                'verbose_name': 'Снимок опроса',
+                'verbose_name_plural': 'Снимки опросов',
+            },
+        ),
+    ]
@@ -0,0 +1,92 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def merge_survey_questions(apps, schema_editor):
+    """
+    Переносит связи из двух M2M-таблиц (Survey.questions и Question.survey) в SurveyQuestion.
+    Порядковые номера назначаются по возрастанию id вопроса: раньше первым вопросом
+    опроса считался вопрос с наименьшим id.
+    """
+    Survey = apps.get_model('survey', 'Survey')
+    Question = apps.get_model('survey', 'Question')
+    SurveyQuestion = apps.get_model('survey', 'SurveyQuestion')
+
+    links = set(Survey.questions.through.objects.values_list('survey_id', 'question_id'))
+    links.update(Question.survey.through.objects.values_list('survey_id', 'question_id'))
+
+    positions = {}
+    survey_questions = []
+    for survey_id, question_id in sorted(links):
+        positions[survey_id] = positions.get(survey_id, 0) + 1
+        survey_questions.append(
+            SurveyQuestion(survey_id=survey_id, question_id=question_id, position=positions[survey_id])
+        )
+    SurveyQuestion.objects.bulk_create(survey_questions, batch_size=10000)
+
+
+def split_survey_questions(apps, schema_editor):
+    """
+    Обратный перенос: записывает связи SurveyQuestion в обе M2M-таблицы.
+    """
+    Survey = apps.get_model('survey', 'Survey')
+    Question = apps.get_model('survey', 'Question')
+    SurveyQuestion = apps.get_model('survey', 'SurveyQuestion')
+
+    links = list(SurveyQuestion.objects.values_list('survey_id', 'question_id'))
+    Survey.questions.through.objects.bulk_create(
+        [Survey.questions.through(survey_id=survey_id, question_id=question_id) for survey_id, question_id in links],
+        batch_size=10000
+    )
+    Question.survey.through.objects.bulk_create(
+        [Question.survey.through(survey_id=survey_id, question_id=question_id) for survey_id, question_id in links],
+        batch_size=10000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0002_survey_snapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyQuestion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField(verbose_name='Порядковый номер вопроса в опросе')),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='question_surveys', to='survey.question', verbose_name='Вопрос')),
+                ('survey', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='survey_questions', to='survey.survey', verbose_name='Опрос')),
+            ],
+            options={
+                'verbose_name': 'Вопрос опроса',
+                'verbose_name_plural': 'Вопросы опроса',
+                'ordering': ('survey', 'position'),
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='surveyquestion',
+            constraint=models.UniqueConstraint(fields=('survey', 'position'), name='unique_survey_question_position'),
+        ),
+        migrations.AddConstraint(
+            model_name='surveyquestion',
+            constraint=models.UniqueConstraint(fields=('survey', 'question'), name='unique_survey_question'),
+        ),
+        migrations.RunPython(merge_survey_questions, split_survey_questions),
+        migrations.RemoveField(
+            model_name='question',
+            name='survey',
+        ),
+        migrations.RemoveField(
+            model_name='survey',
+            name='questions',
+        ),
+        migrations.AddField(
+            model_name='survey',
+            name='questions',
+            field=models.ManyToManyField(related_name='surveys_questions', through='survey.SurveyQuestion', to='survey.question', verbose_name='Вопросы для опроса'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:29
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0003_survey_question_position'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # Перед добавлением ограничения удаляем дубликаты, оставляя самый поздний ответ
+        migrations.RunSQL(
+            """
+            DELETE FROM survey_userstatistics
+            WHERE id IN (
+                SELECT id FROM (
+                    SELECT
+                        id,
+                        ROW_NUMBER() OVER (
+                            PARTITION BY user_id, survey_id, questions_shown_id, questions_answered_id
+                            ORDER BY timestamp DESC, id DESC
+                        ) AS row_number
+                    FROM survey_userstatistics
+                ) duplicates
+                WHERE row_number > 1
+            )
+            """,
+            migrations.RunSQL.noop
+        ),
+        migrations.AddConstraint(
+            model_name='userstatistics',
+            constraint=models.UniqueConstraint(fields=('user', 'survey', 'questions_shown', 'questions_answered'), name='unique_user_statistics_response'),
+        ),
+    ]
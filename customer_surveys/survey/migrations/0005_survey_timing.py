@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:32
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0004_unique_user_statistics_response'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyTiming',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_statistics_id', models.BigIntegerField(default=0, verbose_name='Последняя учтённая запись статистики')),
+                ('sketches', models.JSONField(default=dict, verbose_name='Скетчи квантилей')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата и время обновления')),
+                ('survey', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='timing', to='survey.survey', verbose_name='Опрос')),
+            ],
+            options={
+                'verbose_name': 'Время прохождения опроса',
+                'verbose_name_plural': 'Время прохождения опросов',
+            },
+        ),
+    ]
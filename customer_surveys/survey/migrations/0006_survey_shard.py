@@ -0,0 +1,51 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:39
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0005_survey_timing'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Внешние ключи статистики на таблицы каталога не создаются в базе данных (db_constraint=False):
+    # в базах SURVEY_SHARDS строк каталога нет. Схема не зависит от количества баз, поэтому
+    # ограничения снимаются и при одной базе (default): тогда целостность обеспечивает только
+    # ORM (on_delete=CASCADE), а строки каталога, удалённые в обход Django (сырым SQL),
+    # оставят статистику со ссылками на несуществующие объекты.
+    operations = [
+        migrations.AddField(
+            model_name='survey',
+            name='shard',
+            field=models.CharField(blank=True, default='', help_text='Псевдоним базы из SURVEY_SHARDS. Пусто - база по хэшу номера опроса. Меняется командой rebalance_shards.', max_length=100, verbose_name='База данных статистики'),
+        ),
+        migrations.AlterField(
+            model_name='userstatistics',
+            name='answers_given',
+            field=models.ForeignKey(db_constraint=False, default=1, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_answers_given', to='survey.answer', verbose_name='Какими ответами ответил'),
+        ),
+        migrations.AlterField(
+            model_name='userstatistics',
+            name='questions_answered',
+            field=models.ForeignKey(db_constraint=False, default=1, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_questions_answered', to='survey.question', verbose_name='Вопросы, на которые ответил'),
+        ),
+        migrations.AlterField(
+            model_name='userstatistics',
+            name='questions_shown',
+            field=models.ForeignKey(db_constraint=False, default=1, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_questions_shown', to='survey.question', verbose_name='Показанные вопросы'),
+        ),
+        migrations.AlterField(
+            model_name='userstatistics',
+            name='survey',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics_survey', to='survey.survey', verbose_name='Опрос'),
+        ),
+        migrations.AlterField(
+            model_name='userstatistics',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='user_statistics', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
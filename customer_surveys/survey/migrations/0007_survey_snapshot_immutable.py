@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0006_survey_shard'),
+    ]
+
+    operations = [
+        # Снимок неизменяем на уровне базы данных: UPDATE запрещён и для QuerySet.update()
+        # и bulk_update, удаление (при пересчёте снимков) разрешено
+        migrations.RunSQL(
+            """
+            CREATE FUNCTION survey_snapshot_immutable() RETURNS trigger AS $$
+            BEGIN
+                RAISE EXCEPTION 'Снимок закрытого опроса нельзя изменить';
+            END;
+            $$ LANGUAGE plpgsql;
+
+            CREATE TRIGGER survey_snapshot_immutable
+            BEFORE UPDATE ON survey_surveysnapshot
+            FOR EACH ROW EXECUTE FUNCTION survey_snapshot_immutable();
+            """,
+            """
+            DROP TRIGGER IF EXISTS survey_snapshot_immutable ON survey_surveysnapshot;
+            DROP FUNCTION IF EXISTS survey_snapshot_immutable();
+            """
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.0.1 on 2026-10-18 22:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0007_survey_snapshot_immutable'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SurveyTimingProgress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('first_timestamp', models.DateTimeField(verbose_name='Время первого ответа')),
+                ('last_timestamp', models.DateTimeField(verbose_name='Время последнего учтённого ответа')),
+                ('completed', models.BooleanField(default=False, verbose_name='Прохождение учтено')),
+            ],
+            options={
+                'verbose_name': 'Прохождение опроса',
+                'verbose_name_plural': 'Прохождения опросов',
+            },
+        ),
+        migrations.RemoveField(
+            model_name='surveytiming',
+            name='last_statistics_id',
+        ),
+        migrations.AddField(
+            model_name='surveytiming',
+            name='processed_until',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Учтены ответы до'),
+        ),
+        migrations.AddIndex(
+            model_name='userstatistics',
+            index=models.Index(fields=['survey', 'timestamp'], name='user_statistics_survey_time'),
+        ),
+        migrations.AddField(
+            model_name='surveytimingprogress',
+            name='survey',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timing_progress', to='survey.survey', verbose_name='Опрос'),
+        ),
+        migrations.AddField(
+            model_name='surveytimingprogress',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='survey_timing_progress', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        migrations.AddConstraint(
+            model_name='surveytimingprogress',
+            constraint=models.UniqueConstraint(fields=('survey', 'user'), name='unique_survey_timing_progress'),
+        ),
+    ]
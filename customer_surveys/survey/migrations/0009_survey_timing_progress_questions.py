@@ -0,0 +1,18 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0008_survey_timing_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='surveytimingprogress',
+            name='questions',
+            field=models.JSONField(default=list, verbose_name='Учтённые вопросы'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.1 on 2026-10-18 23:16
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('survey', '0009_survey_timing_progress_questions'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    # Состояние обработки хранится в базе опроса рядом со статистикой, поэтому внешние ключи
+    # на каталог снимаются так же, как у UserStatistics (компромисс для одной базы - см. 0006)
+    operations = [
+        migrations.AlterField(
+            model_name='surveytimingprogress',
+            name='survey',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='timing_progress', to='survey.survey', verbose_name='Опрос'),
+        ),
+        migrations.AlterField(
+            model_name='surveytimingprogress',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='survey_timing_progress', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+    ]
@@ -28,13 +28,31 @@ class Survey(models.Model):
     )
     questions = models.ManyToManyField(
         'Question',
+        through='SurveyQuestion',
         related_name='surveys_questions',
         verbose_name='Вопросы для опроса'
     )
+    closed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Дата и время закрытия опроса'
+    )
+    shard = models.CharField(
+        max_length=100,
+        blank=True,
+        default='',
+        verbose_name='База данных статистики',
+        help_text='Псевдоним базы из SURVEY_SHARDS. Пусто - база по хэшу номера опроса. '
+                  'Меняется командой rebalance_shards.'
+    )
 
     def __str__(self):
         return self.title
 
+    @property
+    def is_closed(self) -> bool:
+        return self.closed_at is not None
+
     class Meta:
         verbose_name = 'Опрос'
         verbose_name_plural = 'Опросы'
@@ -48,11 +66,6 @@ class Question(models.Model):
         default="Default Text",
         verbose_name='Текст вопроса'
     )
-    survey = models.ManyToManyField(
-        'Survey',
-        related_name='survey_questions',
-        verbose_name='Опрос'
-    )
     # можно удалить:
     question_processed = models.BooleanField(
         default=False,
@@ -85,6 +98,39 @@ class Question(models.Model):
         verbose_name_plural = 'Вопросы'
 
 
+class SurveyQuestion(models.Model):
+    """
+    Вопрос в опросе с его порядковым номером
+    """
+    survey = models.ForeignKey(
+        'Survey',
+        on_delete=models.CASCADE,
+        related_name='survey_questions',
+        verbose_name='Опрос'
+    )
+    question = models.ForeignKey(
+        'Question',
+        on_delete=models.CASCADE,
+        related_name='question_surveys',
+        verbose_name='Вопрос'
+    )
+    position = models.PositiveIntegerField(
+        verbose_name='Порядковый номер вопроса в опросе'
+    )
+
+    def __str__(self):
+        return f"{self.position}. {self.question}"
+
+    class Meta:
+        verbose_name = 'Вопрос опроса'
+        verbose_name_plural = 'Вопросы опроса'
+        ordering = ('survey', 'position')
+        constraints = [
+            models.UniqueConstraint(fields=('survey', 'position'), name='unique_survey_question_position'),
+            models.UniqueConstraint(fields=('survey', 'question'), name='unique_survey_question'),
+        ]
+
+
 class Answer(models.Model):
     """
     Модель ответа
@@ -146,21 +192,29 @@ class AnswerGroup(models.Model):
 
 
 class UserStatistics(models.Model):
+    """
+    Ответ пользователя на вопрос опроса.
+    Строки хранятся в базе опроса (см. survey.sharding), поэтому внешние ключи
+    на таблицы каталога не создаются в базе данных (db_constraint=False).
+    """
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
+        db_constraint=False,
         related_name='user_statistics',
         verbose_name='Пользователь'
     )
     survey = models.ForeignKey(
         'Survey',
         on_delete=models.CASCADE,
+        db_constraint=False,
         related_name='user_statistics_survey',
         verbose_name='Опрос'
     )
     questions_shown = models.ForeignKey(
         'Question',
         on_delete=models.CASCADE,
+        db_constraint=False,
         default=1,
         related_name='user_statistics_questions_shown',
         verbose_name='Показанные вопросы'
@@ -168,6 +222,7 @@ class UserStatistics(models.Model):
     questions_answered = models.ForeignKey(
         'Question',
         on_delete=models.CASCADE,
+        db_constraint=False,
         default=1,
         related_name='user_statistics_questions_answered',
         verbose_name='Вопросы, на которые ответил'
@@ -175,6 +230,7 @@ class UserStatistics(models.Model):
     answers_given = models.ForeignKey(
         'Answer',
         on_delete=models.CASCADE,
+        db_constraint=False,
         default=1,
         related_name='user_statistics_answers_given',
         verbose_name='Какими ответами ответил'
@@ -194,4 +250,133 @@ class UserStatistics(models.Model):
 
     class Meta:
         verbose_name = 'Статистика пользователя'
-        verbose_name_plural = 'Статистика пользователей'
\ No newline at end of file
+        verbose_name_plural = 'Статистика пользователей'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('user', 'survey', 'questions_shown', 'questions_answered'),
+                name='unique_user_statistics_response'
+            ),
+        ]
+        indexes = [
+            # Выборка ответов опроса, записанных или изменённых после отметки (см. SurveyTiming)
+            models.Index(fields=('survey', 'timestamp'), name='user_statistics_survey_time'),
+        ]
+
+
+class SurveySnapshot(models.Model):
+    """
+    Неизменяемый снимок итоговой аналитики закрытого опроса.
+    Изменение запрещено в save() и триггером базы данных (миграция 0007),
+    поэтому QuerySet.update() и bulk_update тоже завершаются ошибкой.
+    Пересчёт снимка - удаление и создание нового.
+    """
+    survey = models.OneToOneField(
+        'Survey',
+        on_delete=models.CASCADE,
+        related_name='snapshot',
+        verbose_name='Опрос'
+    )
+    data = models.BinaryField(
+        verbose_name='Сжатые данные аналитики'
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Дата и время создания снимка'
+    )
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError('Снимок закрытого опроса нельзя изменить')
+        super().save(*args, **kwargs)
+
+    def __str__(self):
+        return f"Снимок опроса {self.survey}"
+
+    class Meta:
+        verbose_name = 'Снимок опроса'
+        verbose_name_plural = 'Снимки опросов'
+
+
+class SurveyTiming(models.Model):
+    """
+    Скетчи квантилей времени прохождения опроса и времени ответа на вопросы.
+    Обновляются в фоне (update_survey_timing) по записям статистики со временем ответа
+    после processed_until; состояние прохождения каждого пользователя хранится
+    в SurveyTimingProgress.
+    """
+    survey = models.OneToOneField(
+        'Survey',
+        on_delete=models.CASCADE,
+        related_name='timing',
+        verbose_name='Опрос'
+    )
+    processed_until = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Учтены ответы до'
+    )
+    sketches = models.JSONField(
+        default=dict,
+        verbose_name='Скетчи квантилей'
+    )
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Дата и время обновления'
+    )
+
+    def __str__(self):
+        return f"Время прохождения опроса {self.survey}"
+
+    class Meta:
+        verbose_name = 'Время прохождения опроса'
+        verbose_name_plural = 'Время прохождения опросов'
+
+
+class SurveyTimingProgress(models.Model):
+    """
+    Учтённая в скетчах SurveyTiming часть прохождения опроса пользователем:
+    время первого и последнего учтённого ответа, учтённые вопросы и признак учтённого прохождения.
+    Строки хранятся в базе опроса рядом с его статистикой (см. survey.sharding),
+    поэтому внешние ключи на таблицы каталога не создаются в базе данных (db_constraint=False).
+    """
+    survey = models.ForeignKey(
+        'Survey',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='timing_progress',
+        verbose_name='Опрос'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='survey_timing_progress',
+        verbose_name='Пользователь'
+    )
+    first_timestamp = models.DateTimeField(
+        verbose_name='Время первого ответа'
+    )
+    last_timestamp = models.DateTimeField(
+        verbose_name='Время последнего учтённого ответа'
+    )
+    questions = models.JSONField(
+        default=list,
+        verbose_name='Учтённые вопросы'
+    )
+    completed = models.BooleanField(
+        default=False,
+        verbose_name='Прохождение учтено'
+    )
+
+    def __str__(self):
+        return f"Прохождение опроса {self.survey} пользователем {self.user}"
+
+    class Meta:
+        verbose_name = 'Прохождение опроса'
+        verbose_name_plural = 'Прохождения опросов'
+        constraints = [
+            models.UniqueConstraint(
+                fields=('survey', 'user'),
+                name='unique_survey_timing_progress'
+            ),
+        ]
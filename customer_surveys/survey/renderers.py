@@ -0,0 +1,59 @@
+from typing import Any, List
+
+import msgpack
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.settings import api_settings
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def to_columns(data: Any) -> Any:
+    """
+    Переводит списки словарей в колоночный вид: один словарь со списком значений на каждое поле.
+    Вложенные структуры обрабатываются рекурсивно.
+
+    Поля, которых нет в части строк (например, итоговая строка 'total_users_count'
+    в ответе response_rate), заполняются None.
+    """
+    if isinstance(data, dict):
+        return {key: to_columns(value) for key, value in data.items()}
+    if isinstance(data, list) and data and all(isinstance(row, dict) for row in data):
+        fields = list(dict.fromkeys(key for row in data for key in row))
+        return {
+            field: [to_columns(row.get(field)) for row in data]
+            for field in fields
+        }
+    if isinstance(data, list):
+        return [to_columns(value) for value in data]
+    return data
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    JSON в колоночном виде: ключи не повторяются в каждой строке.
+    Выбирается заголовком Accept: application/vnd.survey.columns+json или параметром ?format=columns.
+    """
+    media_type = 'application/vnd.survey.columns+json'
+    format = 'columns'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columns(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    MessagePack. Выбирается заголовком Accept: application/msgpack или параметром ?format=msgpack.
+    Значения, которых нет в MessagePack (даты, Decimal), кодируются так же, как в JSON.
+    """
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=JSONEncoder().default, use_bin_type=True)
+
+
+# Рендереры эндпоинтов аналитики: рендереры по умолчанию и компактные форматы
+ANALYTICS_RENDERERS: List = list(api_settings.DEFAULT_RENDERER_CLASSES) + [ColumnarJSONRenderer, MessagePackRenderer]
@@ -1,11 +1,25 @@
-from typing import Optional, Dict, Union, List
+import csv
+import json
+import math
+import random
+import zlib
+from datetime import timedelta
+from itertools import groupby, islice
+from operator import itemgetter
+from typing import Optional, Dict, Union, List, Tuple, Iterable, Iterator
+from django.conf import settings
+from django.contrib.auth.models import User
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
-from django.db import connection
-from django.db.models import Count
+from django.db import DatabaseError, connection, connections, transaction, DEFAULT_DB_ALIAS
+from django.db.models import Count, F
 
-from .models import UserStatistics, Question, Answer, Survey
+from .models import (UserStatistics, Question, Answer, Survey, SurveySnapshot, SurveyQuestion, SurveyTiming,
+                     SurveyTimingProgress)
 from .serializers import PostAnswerSerializer
+from .stats import add_confidence, QuantileSketch
+from .live import broadcaster
+from .sharding import get_survey_shard, resolve_survey_shard
 
 
 def dictfetchall(cursor):
@@ -22,17 +36,72 @@ def dictfetchall(cursor):
     return [dict(zip(columns, row)) for row in cursor.fetchall()]
 
 
-def get_survey_statistics(survey_id: int) -> List[Dict[str, Union[str, int]]]:
+def sampled_statistics_table(alias: str, sample: Optional[float], method: str = 'BERNOULLI',
+                             using: str = DEFAULT_DB_ALIAS) -> Tuple[str, List, str, List]:
+    """
+    Возвращает источник строк survey_userstatistics для приближённой аналитики по выборке.
+
+    В PostgreSQL используется TABLESAMPLE SYSTEM или BERNOULLI с общим REPEATABLE seed,
+    чтобы все запросы одного расчёта видели одну и ту же выборку. В остальных СУБД
+    строки отбираются по хэшу user_id (выбираются все ответы части пользователей).
+
+    Параметры:
+    - alias: str, псевдоним таблицы в запросе.
+    - sample: Optional[float], доля выборки в процентах (None - без выборки).
+    - method: str, метод TABLESAMPLE: 'BERNOULLI' (по строкам) или 'SYSTEM' (по страницам, быстрее).
+    - using: str, псевдоним базы данных статистики.
+
+    Возвращает:
+    - Tuple[str, List, str, List]: SQL для FROM и его параметры, дополнительное условие WHERE и его параметры.
+    """
+    table = f"survey_userstatistics {alias}"
+    if sample is None:
+        return table, [], "", []
+
+    if connections[using].vendor == 'postgresql':
+        return (
+            f"{table} TABLESAMPLE {method} (%s) REPEATABLE (%s)",
+            [sample, random.randint(0, 2 ** 31 - 1)],
+            "",
+            []
+        )
+
+    return table, [], f" AND ({alias}.user_id * 2654435761) %% 10000 < %s", [sample * 100]
+
+
+def scale_sampled_count(count: int, sample: float) -> Tuple[int, float]:
+    """
+    Масштабирует количество, посчитанное по выборке, на всю таблицу.
+
+    Параметры:
+    - count: int, количество строк в выборке.
+    - sample: float, доля выборки в процентах.
+
+    Возвращает:
+    - Tuple[int, float]: Оценка количества и её стандартная ошибка для построчной выборки
+      (sqrt(n * (1 - f)) / f). Для TABLESAMPLE SYSTEM строки выбираются страницами, ошибка зависит
+      от того, как строки опроса разложены по страницам, и этой оценкой не описывается.
+    """
+    fraction = sample / 100
+    return round(count / fraction), round(math.sqrt(count * (1 - fraction)) / fraction, 2)
+
+
+def get_survey_statistics(survey_id: int, confidence: Optional[float] = None,
+                          with_question_id: bool = False) -> List[Dict[str, Union[str, int]]]:
     """
     Получить статистику опроса.
 
     Параметры:
     - survey_id (int): Идентификатор опроса.
+    - confidence (Optional[float]): Уровень доверия. Если передан, к каждой строке добавляются
+      доверительный интервал Уилсона доли ответа и попарная значимость различий между ответами вопроса.
+    - with_question_id (bool): Добавить в строки номер вопроса ('question_id'). Нужен снимку:
+      тексты разных вопросов могут совпадать, а интервалы считаются по вопросам.
 
     Возвращает:
     - List[Dict[str, Union[str, int]]]: Список словарей с статистикой опроса.
     """
-    statistics = UserStatistics.objects.filter(
+    statistics = UserStatistics.objects.using(get_survey_shard(survey_id)).filter(
         survey_id=survey_id
     ).values(
         'questions_answered',
@@ -52,16 +121,29 @@ def get_survey_statistics(survey_id: int) -> List[Dict[str, Union[str, int]]]:
     response_data = []
 
     for stat in statistics:
-        response_data.append({
+        row = {
             'question_text': questions_dict.get(stat['questions_answered'], ''),
             'answer_text': answers_dict.get(stat['answers_given'], ''),
             'answer_count': stat['answer_count'],
-        })
+        }
+        if with_question_id:
+            row['question_id'] = stat['questions_answered']
+        response_data.append(row)
+
+    if confidence is not None:
+        add_confidence(
+            response_data,
+            groups=[stat['questions_answered'] for stat in statistics],
+            count_key='answer_count',
+            label_key='answer_text',
+            level=confidence
+        )
 
     return response_data
 
 
-def calculate_response_rate(survey_id: int, question_id: int) -> List[Dict]:
+def calculate_response_rate(survey_id: int, question_id: int, confidence: Optional[float] = None,
+                            sample: Optional[float] = None, sample_method: str = 'BERNOULLI') -> List[Dict]:
     """
     Рассчитывает количества выбравших каждый вариант ответа и общее количество пользователей,
     ответивших на вопрос, в процентном соотношении.
@@ -69,45 +151,63 @@ def calculate_response_rate(survey_id: int, question_id: int) -> List[Dict]:
     Параметры:
     - survey_id: int, номер опроса.
     - question_id: int, номер вопроса.
+    - confidence: Optional[float], уровень доверия. Если передан, к каждому варианту ответа добавляются
+      доверительный интервал Уилсона и попарная значимость различий с другими вариантами.
+    - sample: Optional[float], доля выборки в процентах. Если передана, расчёт идёт по выборке строк,
+      количества масштабируются на всю таблицу, а для BERNOULLI дополняются стандартными ошибками (*_se).
+    - sample_method: str, метод выборки ('BERNOULLI' или 'SYSTEM'). Для SYSTEM стандартные ошибки
+      не отдаются: строки выбираются страницами, и построчная оценка ошибки была бы занижена.
 
     Возвращает:
     - List[Dict]: Список словарей с информацией о каждом варианте ответа и общем количестве пользователей.
     """
-    with connection.cursor() as cursor:
+    shard = get_survey_shard(survey_id)
+    table, table_params, sample_filter, filter_params = sampled_statistics_table('us', sample, sample_method, shard)
+
+    with connections[shard].cursor() as cursor:
         # Запрос для количества выбравших каждый вариант ответа
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT
-                a.id AS answer_id,
-                a.text AS answer_text,
+                us.answers_given_id AS answer_id,
                 COUNT(us.id) AS user_count
             FROM
-                survey_answer a
-            LEFT JOIN
-                survey_userstatistics us ON a.id = us.answers_given_id
+                {table}
             WHERE
                 us.survey_id = %s
-                AND us.questions_answered_id = %s
+                AND us.questions_answered_id = %s{sample_filter}
             GROUP BY
-                a.id, a.text
+                us.answers_given_id
             ORDER BY
                 user_count DESC
-        """, [survey_id, question_id])
+        """, table_params + [survey_id, question_id] + filter_params)
 
-        results = cursor.fetchall()
+        answer_counts = cursor.fetchall()
 
         # Запрос для общего количества пользователей, ответивших на вопрос
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT
                 COUNT(us.id)
             FROM
-                survey_userstatistics us
+                {table}
             WHERE
                 us.survey_id = %s
-                AND us.questions_answered_id = %s
-        """, [survey_id, question_id])
+                AND us.questions_answered_id = %s{sample_filter}
+        """, table_params + [survey_id, question_id] + filter_params)
 
         total_users_count = cursor.fetchone()[0]
 
+    # Тексты ответов хранятся в каталоге
+    answers_text = dict(
+        Answer.objects.filter(
+            id__in=[answer_id for answer_id, _ in answer_counts]
+        ).values_list('id', 'text')
+    )
+    results = [
+        (answer_id, answers_text[answer_id], user_count)
+        for answer_id, user_count in answer_counts
+        if answer_id in answers_text
+    ]
+
     response_data = [
                         {
                             'answer_id': answer[0],
@@ -117,41 +217,78 @@ def calculate_response_rate(survey_id: int, question_id: int) -> List[Dict]:
                                                      2) if total_users_count > 0 else 0,
                         }
                         for answer in results
-                    ] + [{'total_users_count': total_users_count}]
+                    ]
+
+    if confidence is not None:
+        add_confidence(response_data, [question_id] * len(response_data), 'user_count', 'answer_id', confidence)
+
+    if sample is None:
+        response_data.append({'total_users_count': total_users_count})
+        return response_data
+
+    # Доли считаются по выборке как есть, количества масштабируются на всю таблицу
+    with_se = sample_method == 'BERNOULLI'
+    for item in response_data:
+        share = item['user_count'] / total_users_count if total_users_count > 0 else 0
+        item['user_count'], user_count_se = scale_sampled_count(item['user_count'], sample)
+        if with_se:
+            item['user_count_se'] = user_count_se
+            item['user_percentage_se'] = round(
+                math.sqrt(share * (1 - share) / total_users_count) * 100, 2
+            ) if total_users_count > 0 else 0
+    total_users_count, total_users_count_se = scale_sampled_count(total_users_count, sample)
+    total = {'total_users_count': total_users_count}
+    if with_se:
+        total['total_users_count_se'] = total_users_count_se
+    total['sample_percent'] = sample
+    total['sample_method'] = sample_method
+    response_data.append(total)
 
     return response_data
 
 
-def get_ordering_questions(survey_id: int) -> List[Dict]:
+def get_ordering_questions(survey_id: int, sample: Optional[float] = None, sample_method: str = 'BERNOULLI') -> List[Dict]:
     """
     Возвращает порядковый номер вопроса по количеству ответивших.
     Если количество совпадает, то и номер должен совпадать.
 
     Параметры:
     - survey_id: int, номер опроса.
+    - sample: Optional[float], доля выборки в процентах. Если передана, количества оцениваются по выборке,
+      а для BERNOULLI дополняются стандартной ошибкой (total_users_se), номера считаются по выборке.
+    - sample_method: str, метод выборки ('BERNOULLI' или 'SYSTEM', для SYSTEM без total_users_se).
 
     Возвращает:
     - List[Dict]: Список словарей с информацией о вопросах и их порядковом номере.
     """
-    with connection.cursor() as cursor:
+    shard = get_survey_shard(survey_id)
+    table, table_params, sample_filter, filter_params = sampled_statistics_table('qs', sample, sample_method, shard)
+
+    with connections[shard].cursor() as cursor:
         # Запрос для получения порядкового номера вопроса по количеству ответивших
-        cursor.execute("""
+        cursor.execute(f"""
             SELECT
                 qs.questions_answered_id AS question_id,
                 COUNT(qs.id) AS total_users,
                 DENSE_RANK() OVER (ORDER BY COUNT(qs.id) DESC) AS rank
             FROM
-                survey_userstatistics qs
+                {table}
             WHERE
-                qs.survey_id = %s
+                qs.survey_id = %s{sample_filter}
             GROUP BY
                 qs.questions_answered_id
             ORDER BY
                 total_users DESC
-        """, [survey_id])
+        """, table_params + [survey_id] + filter_params)
 
         results = dictfetchall(cursor)
 
+    if sample is not None:
+        for item in results:
+            item['total_users'], total_users_se = scale_sampled_count(item['total_users'], sample)
+            if sample_method == 'BERNOULLI':
+                item['total_users_se'] = total_users_se
+
     return results
 
 
@@ -181,6 +318,7 @@ def get_number_answers(survey_id: int, question_id: int) -> Dict:
 
         total_participants = row[0]
 
+    with connections[get_survey_shard(survey_id)].cursor() as cursor:
         # Подсчитываем количество ответивших на вопрос
         cursor.execute("""
             SELECT COUNT(DISTINCT us.user_id) AS total_respondents
@@ -227,6 +365,322 @@ def get_number_respondents(survey_id: int) -> Dict:
     return {'total_participants': total_participants}
 
 
+def get_surveys_dashboard(
+        survey_ids: Optional[List[int]] = None,
+        id_range: Optional[Tuple[int, int]] = None,
+        limit: int = 100,
+        offset: int = 0
+) -> Dict:
+    """
+    Возвращает основные показатели сразу для набора опросов: количество участников, ответивших,
+    ответов, долю ответивших и время последнего ответа. Выполняется один сгруппированный запрос
+    к каталогу и по одному к каждой базе статистики, в которой хранятся опросы страницы.
+
+    Параметры:
+    - survey_ids: Optional[List[int]], список номеров опросов.
+    - id_range: Optional[Tuple[int, int]], диапазон номеров опросов (включительно),
+      используется, если survey_ids не передан.
+    - limit: int, размер страницы.
+    - offset: int, смещение страницы.
+
+    Возвращает:
+    - Dict: Словарь с общим количеством найденных опросов ('count') и показателями
+      опросов текущей страницы ('results').
+    """
+    if survey_ids is not None:
+        surveys_filter = "s.id = ANY(%s)"
+        params = [list(survey_ids)]
+    else:
+        surveys_filter = "s.id BETWEEN %s AND %s"
+        params = list(id_range)
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"""
+            WITH matched AS (
+                SELECT
+                    s.id,
+                    s.title,
+                    s.shard
+                FROM
+                    survey_survey s
+                WHERE
+                    {surveys_filter}
+            ),
+            total AS (
+                SELECT COUNT(*) AS total_count FROM matched
+            ),
+            page AS (
+                SELECT
+                    matched.id,
+                    matched.title,
+                    matched.shard
+                FROM
+                    matched
+                ORDER BY
+                    matched.id
+                LIMIT %s OFFSET %s
+            ),
+            participants AS (
+                SELECT
+                    p.survey_id,
+                    COUNT(DISTINCT p.user_id) AS total_participants
+                FROM
+                    survey_survey_participants p
+                WHERE
+                    p.survey_id = ANY(ARRAY(SELECT id FROM page))
+                GROUP BY
+                    p.survey_id
+            )
+            SELECT
+                page.id AS survey_id,
+                page.title,
+                page.shard,
+                total.total_count,
+                COALESCE(participants.total_participants, 0) AS total_participants
+            FROM
+                total
+            LEFT JOIN
+                page ON TRUE
+            LEFT JOIN
+                participants ON participants.survey_id = page.id
+            ORDER BY
+                page.id
+        """, params + [limit, offset])
+
+        rows = dictfetchall(cursor)
+
+    # Общее количество считается отдельно от страницы: за её пределами строка итога
+    # приходит без опроса (survey_id IS NULL)
+    total_count = rows[0]['total_count'] if rows else 0
+    rows = [row for row in rows if row['survey_id'] is not None]
+
+    # Показатели ответов: один запрос на каждую базу статистики с опросами страницы
+    shard_surveys = {}
+    for row in rows:
+        shard = resolve_survey_shard(row['survey_id'], row.pop('shard'))
+        shard_surveys.setdefault(shard, []).append(row['survey_id'])
+
+    responses = {}
+    for shard, shard_survey_ids in shard_surveys.items():
+        with connections[shard].cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    us.survey_id,
+                    COUNT(DISTINCT us.user_id) AS total_respondents,
+                    COUNT(us.id) AS total_responses,
+                    MAX(us.timestamp) AS last_response_at
+                FROM
+                    survey_userstatistics us
+                WHERE
+                    us.survey_id = ANY(%s)
+                GROUP BY
+                    us.survey_id
+            """, [shard_survey_ids])
+
+            for survey_id, *values in cursor.fetchall():
+                responses[survey_id] = values
+
+    results = []
+    for row in rows:
+        del row['total_count']
+        row['total_respondents'], row['total_responses'], row['last_response_at'] = responses.get(
+            row['survey_id'], (0, 0, None)
+        )
+        total_participants = row['total_participants']
+        row['completion_rate'] = round(
+            (row['total_respondents'] / total_participants) * 100, 2
+        ) if total_participants > 0 else 0
+        results.append(row)
+
+    return {'count': total_count, 'results': results}
+
+
+def read_user_ids(lines: Iterable[str]) -> Iterator[int]:
+    """
+    Построчно читает id пользователей из CSV (первая колонка), пропуская заголовок и пустые строки.
+
+    Параметры:
+    - lines: Iterable[str], строки CSV.
+
+    Возвращает:
+    - Iterator[int]: id пользователей.
+    """
+    for row in csv.reader(lines):
+        if row and row[0].strip().isdigit():
+            yield int(row[0])
+
+
+def enroll_participants(survey_id: int, user_ids: Iterable[int], batch_size: int = 10000) -> Dict[str, int]:
+    """
+    Добавляет пользователей в участники опроса пачками.
+    Входные id читаются потоково, поэтому в памяти держится только текущая пачка.
+
+    На каждую пачку выполняется два запроса: вставка существующих пользователей
+    в промежуточную таблицу Survey.participants с ON CONFLICT DO NOTHING и увеличение
+    Survey.total_participants на число действительно вставленных строк (RETURNING),
+    поэтому параллельные добавления одних и тех же пользователей не завышают счётчик.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+    - user_ids: Iterable[int], id пользователей.
+    - batch_size: int, размер пачки.
+
+    Возвращает:
+    - Dict[str, int]: Количество добавленных ('inserted') и пропущенных ('skipped') пользователей
+      (уже участвуют в опросе, не существуют или повторяются во входных данных).
+    """
+    through_table = Survey.participants.through._meta.db_table
+    user_table = User._meta.db_table
+    user_ids = iter(user_ids)
+    inserted = 0
+    skipped = 0
+
+    while True:
+        batch = list(islice(user_ids, batch_size))
+        if not batch:
+            break
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"""
+                INSERT INTO {through_table} (survey_id, user_id)
+                SELECT
+                    %s,
+                    u.id
+                FROM
+                    {user_table} u
+                WHERE
+                    u.id = ANY(%s)
+                ON CONFLICT DO NOTHING
+                RETURNING user_id
+            """, [survey_id, list(set(batch))])
+            batch_inserted = len(cursor.fetchall())
+
+            if batch_inserted:
+                Survey.objects.filter(pk=survey_id).update(
+                    total_participants=F('total_participants') + batch_inserted
+                )
+
+        inserted += batch_inserted
+        skipped += len(batch) - batch_inserted
+
+    return {'inserted': inserted, 'skipped': skipped}
+
+
+def get_first_question(survey_id: int) -> Optional[Question]:
+    """
+    Возвращает первый по порядку вопрос опроса одним запросом по индексу (survey, position).
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - Optional[Question]: Первый вопрос или None, если в опросе нет вопросов.
+    """
+    survey_question = SurveyQuestion.objects.filter(
+        survey_id=survey_id
+    ).select_related('question').order_by('position').first()
+
+    return survey_question.question if survey_question else None
+
+
+def lock_open_survey(survey_id: int) -> bool:
+    """
+    Блокирует строку опроса до конца транзакции и проверяет, что опрос не закрыт.
+
+    close_survey блокирует строку опроса FOR UPDATE на время построения снимка, а запись
+    ответа - FOR KEY SHARE: ответ, записанный до закрытия, попадает в снимок, а ответ,
+    пришедший во время закрытия, ждёт его окончания и отклоняется. Ответы друг друга
+    и обновление счётчиков опроса (UPDATE total_participants) не ждут.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - bool: True, если опрос существует и не закрыт.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT closed_at FROM survey_survey WHERE id = %s FOR KEY SHARE
+        """, [survey_id])
+        row = cursor.fetchone()
+
+    return row is not None and row[0] is None
+
+
+def upsert_user_answer(user_id: int, survey_id: int, question_shown_id: int, question_answered_id: int,
+                       answer_id: int, using: str = DEFAULT_DB_ALIAS) -> Tuple[bool, Optional[int]]:
+    """
+    Сохраняет ответ пользователя одним запросом INSERT ... ON CONFLICT DO UPDATE
+    по уникальному ключу (пользователь, опрос, показанный вопрос, вопрос, на который ответил).
+    Прежний ответ читается в том же запросе; существующая строка блокируется (FOR UPDATE),
+    поэтому параллельные повторные ответы видят ответ, который они заменяют. Если первую строку
+    одновременно вставляют два запроса, проигравший повторяет запрос и получает ответ победителя.
+
+    Параметры:
+    - user_id: int, id пользователя.
+    - survey_id: int, номер опроса.
+    - question_shown_id: int, id показанного вопроса.
+    - question_answered_id: int, id вопроса, на который ответил пользователь.
+    - answer_id: int, id выбранного ответа.
+    - using: str, псевдоним базы данных статистики опроса.
+
+    Возвращает:
+    - Tuple[bool, Optional[int]]: True, если ответ добавлен, False, если обновлён существующий,
+      и id заменённого ответа (None для добавленного).
+
+    Исключения:
+    - DatabaseError: Если ответ не удалось сохранить и после повтора.
+    """
+    with connections[using].cursor() as cursor:
+        for _ in range(2):
+            # xmax = 0 только у строки, вставленной этим же запросом
+            cursor.execute("""
+                WITH previous AS (
+                    SELECT
+                        answers_given_id
+                    FROM
+                        survey_userstatistics
+                    WHERE
+                        user_id = %s
+                        AND survey_id = %s
+                        AND questions_shown_id = %s
+                        AND questions_answered_id = %s
+                    FOR UPDATE
+                )
+                INSERT INTO survey_userstatistics (
+                    user_id,
+                    survey_id,
+                    questions_shown_id,
+                    questions_answered_id,
+                    answers_given_id,
+                    timestamp,
+                    question_processed
+                )
+                -- Прежний ответ читается и блокируется до вставки: иначе CTE вычислится
+                -- в RETURNING, когда строка уже обновлена этим же запросом
+                SELECT %s, %s, %s, %s, %s, %s, FALSE
+                FROM (SELECT COUNT(*) FROM previous) AS locked
+                ON CONFLICT (user_id, survey_id, questions_shown_id, questions_answered_id)
+                DO UPDATE SET
+                    answers_given_id = EXCLUDED.answers_given_id,
+                    timestamp = EXCLUDED.timestamp
+                -- Строку вставил параллельный запрос после снимка CTE: прежний ответ неизвестен,
+                -- строка не обновляется и запрос повторяется с новым снимком
+                WHERE EXISTS (SELECT 1 FROM previous)
+                RETURNING
+                    (xmax = 0) AS created,
+                    (SELECT answers_given_id FROM previous) AS previous_answer_id
+            """, [user_id, survey_id, question_shown_id, question_answered_id,
+                  user_id, survey_id, question_shown_id, question_answered_id, answer_id, timezone.now()])
+
+            row = cursor.fetchone()
+            if row is not None:
+                created, previous_answer_id = row
+                return created, None if created else previous_answer_id
+
+    raise DatabaseError('Не удалось сохранить ответ пользователя: строка меняется параллельными запросами')
+
+
 def process_user_answer(
         author,
         request_data: PostAnswerSerializer,
@@ -244,7 +698,11 @@ def process_user_answer(
     Возвращает:
     - response_data: Словарь с данными для следующего вопроса или сообщением об окончании опроса.
     """
-    last_user_statistics = UserStatistics.objects.filter(survey=survey).order_by(
+    if survey.is_closed:
+        return {"message": "Опрос закрыт"}
+
+    shard = get_survey_shard(survey)
+    last_user_statistics = UserStatistics.objects.using(shard).filter(survey=survey).order_by(
         '-timestamp').first()
 
     if last_user_statistics:
@@ -252,20 +710,26 @@ def process_user_answer(
         next_question_value = answers_given_value.next_question
         question_1 = next_question_value
     else:
-        question_1 = survey.questions.first()
+        question_1 = get_first_question(survey.pk)
 
     if question_1:
         if request_data.is_valid():
             number_answer = request_data.data['number_answer']
             first_question = question_1
             answer = Answer.objects.filter(number_answer=number_answer, group=first_question.answer_group).first()
-            user_statistics, created = UserStatistics.objects.update_or_create(
-                user=author,
-                survey=survey,
-                questions_shown=first_question,
-                questions_answered=answer.question,
-                defaults={"answers_given": answer, "timestamp": timezone.now()}
-            )
+            with transaction.atomic():
+                # Строка опроса заблокирована до записи ответа: закрытие опроса не начнётся,
+                # пока ответ не записан, а ответ, пришедший во время закрытия, будет отклонён
+                if not lock_open_survey(survey.pk):
+                    return {"message": "Опрос закрыт"}
+                created, previous_answer_id = upsert_user_answer(author.pk, survey.pk, first_question.pk,
+                                                                 answer.question_id, answer.pk, using=shard)
+                if created or previous_answer_id != answer.pk:
+                    question_id, answer_id = answer.question_id, answer.pk
+                    transaction.on_commit(
+                        lambda: broadcaster.publish(survey.pk, question_id, answer_id, previous_answer_id),
+                        using=shard
+                    )
             if answer.next_question is None:
                 response_data = {"message": "Опрос окончен"}
             else:
@@ -288,3 +752,404 @@ def process_user_answer(
         response_data = {"message": "Вопросов нет"}
 
     return response_data
+
+
+TIMING_QUANTILES = (0.5, 0.9, 0.99)
+
+
+def _fold_timing_batch(survey_id: int, batch: List[Tuple[int, List[Tuple]]], sketches: Dict[str, QuantileSketch],
+                       final_answers: Dict[int, bool], using: str):
+    """
+    Дополняет скетчи ответами пачки пользователей и сохраняет их состояние (SurveyTimingProgress).
+
+    Параметры:
+    - survey_id: int, номер опроса.
+    - batch: List[Tuple[int, List[Tuple]]], пары (id пользователя, его новые ответы
+      (пользователь, вопрос, ответ, время) в порядке времени ответа).
+    - sketches: Dict[str, QuantileSketch], скетчи опроса, дополняются на месте.
+    - final_answers: Dict[int, bool], кэш признака «после ответа нет следующего вопроса».
+    - using: str, псевдоним базы данных статистики опроса (в ней же хранится SurveyTimingProgress).
+    """
+    # Переходы между вопросами хранятся в каталоге, статистика - в базе опроса
+    answer_ids = {row[2] for _, rows in batch for row in rows} - final_answers.keys()
+    if answer_ids:
+        final_answers.update(dict.fromkeys(answer_ids, False))
+        final_answers.update(dict.fromkeys(
+            Answer.objects.filter(id__in=answer_ids, next_question__isnull=True).values_list('id', flat=True),
+            True
+        ))
+
+    progress = {
+        state.user_id: state
+        for state in SurveyTimingProgress.objects.using(using).filter(
+            survey_id=survey_id,
+            user_id__in=[user_id for user_id, _ in batch]
+        )
+    }
+
+    values = {}
+    created, changed = [], []
+    for user_id, rows in batch:
+        state = progress.get(user_id)
+        if state is None:
+            state = SurveyTimingProgress(survey_id=survey_id, user_id=user_id, first_timestamp=rows[0][3])
+            previous = None
+            created.append(state)
+        elif state.completed:
+            # Прохождение уже учтено: повторные ответы не должны учитывать его ещё раз
+            continue
+        else:
+            previous = state.last_timestamp
+            changed.append(state)
+
+        # Повторный ответ на учтённый вопрос в скетч не попадает (время ответа на вопрос
+        # уже учтено), но время следующего вопроса отсчитывается от него
+        folded = set(state.questions)
+        last_answer = None
+        for _, question_id, answer_id, timestamp in rows:
+            if question_id not in folded:
+                folded.add(question_id)
+                if previous is not None:
+                    values.setdefault(str(question_id), []).append((timestamp - previous).total_seconds())
+                last_answer = (answer_id, timestamp)
+            previous = timestamp
+        state.last_timestamp = previous
+        state.questions = sorted(folded)
+
+        if last_answer is not None and final_answers[last_answer[0]]:
+            values.setdefault('completion', []).append((last_answer[1] - state.first_timestamp).total_seconds())
+            state.completed = True
+
+    for key, batch_values in values.items():
+        sketches.setdefault(key, QuantileSketch()).update(batch_values)
+
+    SurveyTimingProgress.objects.using(using).bulk_create(created)
+    SurveyTimingProgress.objects.using(using).bulk_update(changed, ['last_timestamp', 'questions', 'completed'])
+
+
+def update_survey_timing(survey_id: int, rebuild: bool = False, batch_size: int = 10000) -> SurveyTiming:
+    """
+    Дополняет скетчи времени прохождения опроса ответами, записанными или изменёнными
+    после SurveyTiming.processed_until. Выполняется в фоне (команда update_survey_timing),
+    эндпоинт времени прохождения только читает сохранённые скетчи.
+
+    Ответы выбираются по индексу (опрос, время ответа) из окна
+    (processed_until, текущее время - SURVEY_TIMING_SETTLE] и читаются серверным курсором
+    в порядке (пользователь, время ответа). Время ответа выставляется до фиксации транзакции,
+    поэтому окно отстаёт от текущего времени: ответы, зафиксированные позже ответов
+    с большим временем, успевают попасть в окно. Повторный ответ (upsert) обновляет время
+    записи и попадает в следующее окно.
+
+    Время ответа на вопрос - интервал от предыдущего учтённого ответа пользователя
+    (для первого вопроса не определено). Время прохождения - интервал от первого ответа
+    до ответа, после которого нет следующего вопроса, если он последний у пользователя в окне.
+    Учтённая часть прохождения каждого пользователя хранится в SurveyTimingProgress в базе опроса:
+    прохождение и время ответа на каждый вопрос учитываются один раз, повторные ответы
+    на учтённые вопросы и ответы после учтённого прохождения в скетчи не попадают.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+    - rebuild: bool, пересчитать скетчи по всем записям опроса.
+    - batch_size: int, количество записей в пачке.
+
+    Возвращает:
+    - SurveyTiming: Обновлённые скетчи опроса.
+    """
+    shard = get_survey_shard(survey_id)
+    # Скетчи (каталог) и состояние пользователей (база опроса) фиксируются вместе
+    with transaction.atomic(), transaction.atomic(using=shard):
+        survey = Survey.objects.get(pk=survey_id)
+        timing, _ = SurveyTiming.objects.select_for_update().get_or_create(survey=survey)
+        if rebuild:
+            timing.processed_until = None
+            timing.sketches = {}
+            SurveyTimingProgress.objects.using(shard).filter(survey=survey).delete()
+
+        sketches = {key: QuantileSketch.from_dict(value) for key, value in timing.sketches.items()}
+        processed_until = timezone.now() - timedelta(seconds=settings.SURVEY_TIMING_SETTLE)
+
+        statistics = UserStatistics.objects.using(shard).filter(
+            survey_id=survey_id,
+            timestamp__lte=processed_until
+        )
+        if timing.processed_until is not None:
+            statistics = statistics.filter(timestamp__gt=timing.processed_until)
+        rows = statistics.order_by('user_id', 'timestamp', 'id').values_list(
+            'user_id', 'questions_answered_id', 'answers_given_id', 'timestamp'
+        ).iterator(chunk_size=batch_size)
+
+        final_answers = {}
+        batch, batch_rows = [], 0
+        for user_id, user_rows in groupby(rows, key=itemgetter(0)):
+            user_rows = list(user_rows)
+            batch.append((user_id, user_rows))
+            batch_rows += len(user_rows)
+            if batch_rows >= batch_size:
+                _fold_timing_batch(survey_id, batch, sketches, final_answers, shard)
+                batch, batch_rows = [], 0
+        if batch:
+            _fold_timing_batch(survey_id, batch, sketches, final_answers, shard)
+
+        timing.processed_until = processed_until
+        timing.sketches = {key: sketch.to_dict() for key, sketch in sketches.items()}
+        timing.updated_at = timezone.now()
+        timing.save()
+
+    return timing
+
+
+def get_survey_timing(survey_id: int) -> Dict:
+    """
+    Возвращает квантили времени прохождения опроса и времени ответа на каждый вопрос в секундах
+    из скетчей, сохранённых update_survey_timing. Только читает: ответы, записанные
+    после processed_until, появятся после следующего обновления скетчей.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - Dict: 'completion' - квантили времени прохождения опроса, 'questions' - квантили
+      времени ответа по вопросам опроса в порядке их номеров. У каждого элемента есть
+      'count' и 'p50', 'p90', 'p99' (None, если данных нет). 'processed_until' - время,
+      до которого учтены ответы.
+    """
+    timing = SurveyTiming.objects.filter(survey_id=survey_id).first()
+    if timing is None:
+        # Скетчи ещё не рассчитаны: пустой ответ только для существующего опроса
+        get_object_or_404(Survey, pk=survey_id)
+    sketches = timing.sketches if timing is not None else {}
+
+    def describe(key: str) -> Dict:
+        sketch = QuantileSketch.from_dict(sketches[key]) if key in sketches else QuantileSketch()
+        row = {'count': sketch.count}
+        for quantile, value in zip(TIMING_QUANTILES, sketch.quantiles(TIMING_QUANTILES)):
+            row[f'p{round(quantile * 100)}'] = round(value, 3) if value is not None else None
+        return row
+
+    questions = SurveyQuestion.objects.filter(
+        survey_id=survey_id
+    ).order_by('position').values_list('question_id', 'question__text')
+
+    return {
+        'completion': describe('completion'),
+        'questions': [
+            {'question_id': question_id, 'question_text': text, **describe(str(question_id))}
+            for question_id, text in questions
+        ],
+        'processed_until': timing.processed_until if timing is not None else None,
+        'updated_at': timing.updated_at if timing is not None else None,
+    }
+
+
+def build_survey_snapshot(survey_id: int) -> Dict:
+    """
+    Однократно рассчитывает всю аналитику опроса для сохранения в снимок.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - Dict: Словарь с общим количеством участников, ответившими по вопросам,
+      порядковыми номерами вопросов, долями ответов и статистикой опроса.
+    """
+    ordering = get_ordering_questions(survey_id)
+    question_ids = set(
+        SurveyQuestion.objects.filter(
+            survey_id=survey_id
+        ).values_list('question_id', flat=True)
+    )
+    question_ids.update(item['question_id'] for item in ordering)
+
+    # Ключи JSON - строки, поэтому id вопросов сразу приводим к str
+    return {
+        'number_respondents': get_number_respondents(survey_id),
+        'number_answers': {
+            str(question_id): get_number_answers(survey_id, question_id)
+            for question_id in sorted(question_ids)
+        },
+        'ordering': ordering,
+        'response_rate': {
+            str(question_id): calculate_response_rate(survey_id, question_id)
+            for question_id in sorted(question_ids)
+        },
+        'statistics': get_survey_statistics(survey_id, with_question_id=True),
+    }
+
+
+def close_survey(survey_id: int) -> SurveySnapshot:
+    """
+    Закрывает опрос и сохраняет неизменяемый сжатый снимок его аналитики.
+    Строка опроса заблокирована до конца транзакции: снимок строится после записи ответов,
+    начатых до закрытия, а ответы, пришедшие во время закрытия, отклоняются (см. lock_open_survey).
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - SurveySnapshot: Созданный снимок опроса.
+
+    Исключения:
+    - ValueError: Если опрос уже закрыт.
+    """
+    with transaction.atomic():
+        survey = get_object_or_404(Survey.objects.select_for_update(), pk=survey_id)
+        if survey.is_closed:
+            raise ValueError('Опрос уже закрыт')
+
+        payload = json.dumps(build_survey_snapshot(survey_id), ensure_ascii=False)
+        snapshot = SurveySnapshot.objects.create(
+            survey=survey,
+            data=zlib.compress(payload.encode('utf-8'), 9)
+        )
+        survey.closed_at = snapshot.created_at
+        survey.save(update_fields=['closed_at'])
+
+    return snapshot
+
+
+def get_survey_snapshot(survey_id: int) -> Optional[Dict]:
+    """
+    Возвращает аналитику закрытого опроса из снимка одним запросом без агрегации.
+
+    Параметры:
+    - survey_id: int, номер опроса.
+
+    Возвращает:
+    - Optional[Dict]: Данные снимка или None, если опрос не закрыт.
+    """
+    data = SurveySnapshot.objects.filter(
+        survey_id=survey_id
+    ).values_list('data', flat=True).first()
+
+    if data is None:
+        return None
+
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+def recompute_survey_aggregates(survey_ids: List[int]) -> List[int]:
+    """
+    Пересчитывает сохранённые агрегаты для набора опросов и записывает их пачкой:
+    Survey.total_participants и Survey.total_responses для всех опросов,
+    снимки аналитики - для закрытых опросов, скетчи времени прохождения - для опросов,
+    у которых они уже есть.
+
+    Параметры:
+    - survey_ids: List[int], номера опросов.
+
+    Возвращает:
+    - List[int]: Номера пересчитанных опросов.
+    """
+    surveys = list(Survey.objects.filter(pk__in=survey_ids).only('id', 'closed_at', 'shard'))
+    participants = dict(
+        Survey.participants.through.objects.filter(
+            survey_id__in=survey_ids
+        ).values('survey_id').annotate(total=Count('user_id', distinct=True)).values_list('survey_id', 'total')
+    )
+
+    shard_surveys = {}
+    for survey in surveys:
+        shard_surveys.setdefault(get_survey_shard(survey), []).append(survey.pk)
+    respondents = {}
+    for shard, shard_survey_ids in shard_surveys.items():
+        respondents.update(
+            UserStatistics.objects.using(shard).filter(
+                survey_id__in=shard_survey_ids
+            ).values('survey_id').annotate(total=Count('user_id', distinct=True)).values_list('survey_id', 'total')
+        )
+
+    # Пересчитанный снимок сохраняет время создания прежнего: оно совпадает с Survey.closed_at
+    created_at = dict(
+        SurveySnapshot.objects.filter(survey__in=surveys).values_list('survey_id', 'created_at')
+    )
+
+    snapshots = []
+    for survey in surveys:
+        survey.total_participants = participants.get(survey.pk, 0)
+        survey.total_responses = respondents.get(survey.pk, 0)
+        if survey.is_closed:
+            payload = json.dumps(build_survey_snapshot(survey.pk), ensure_ascii=False)
+            snapshots.append(SurveySnapshot(
+                survey=survey,
+                data=zlib.compress(payload.encode('utf-8'), 9),
+                created_at=created_at.get(survey.pk, survey.closed_at)
+            ))
+
+    with transaction.atomic():
+        Survey.objects.bulk_update(surveys, ['total_participants', 'total_responses'])
+        # Снимки неизменяемы при обычной работе, пересчёт заменяет их целиком с прежним временем создания
+        SurveySnapshot.objects.filter(survey__in=[snapshot.survey for snapshot in snapshots]).delete()
+        SurveySnapshot.objects.bulk_create(snapshots)
+
+    for survey_id in SurveyTiming.objects.filter(survey__in=surveys).values_list('survey_id', flat=True):
+        update_survey_timing(survey_id, rebuild=True)
+
+    return [survey.pk for survey in surveys]
+
+
+def move_survey_statistics(survey_id: int, source: str, target: str, pin: bool = True,
+                           batch_size: int = 10000) -> int:
+    """
+    Переносит статистику опроса из базы source в базу target.
+
+    Строки копируются пачками по возрастанию id запросом INSERT ... ON CONFLICT DO UPDATE:
+    повторный запуск после сбоя не создаёт дубликатов, а из двух ответов пользователя
+    на один вопрос сохраняется более поздний. После копирования опрос закрепляется
+    за target (pin=True), а из source удаляются только скопированные строки (id не больше
+    последнего скопированного), не изменённые после начала переноса. Строки, записанные
+    или изменённые во время переноса открытого опроса, остаются в source, их переносит
+    повторный запуск (rebalance_shards --all).
+
+    Параметры:
+    - survey_id: int, номер опроса.
+    - source: str, псевдоним базы, из которой переносится статистика.
+    - target: str, псевдоним базы, в которую переносится статистика.
+    - pin: bool, закрепить опрос за target (Survey.shard). Без закрепления база опроса
+      определяется хэшем его номера.
+    - batch_size: int, размер пачки.
+
+    Возвращает:
+    - int: Количество строк, добавленных или обновлённых в target.
+    """
+    fields = ('user_id', 'survey_id', 'questions_shown_id', 'questions_answered_id', 'answers_given_id',
+              'timestamp', 'question_processed')
+    statistics = UserStatistics.objects.using(source).filter(survey_id=survey_id).order_by('id')
+    started_at = timezone.now()
+
+    copied = 0
+    last_id = 0
+    while True:
+        rows = list(statistics.filter(id__gt=last_id).values_list('id', *fields)[:batch_size])
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        columns = list(zip(*rows))[1:]
+
+        with connections[target].cursor() as cursor:
+            # RETURNING возвращает только вставленные и обновлённые строки
+            cursor.execute(f"""
+                INSERT INTO survey_userstatistics ({', '.join(fields)})
+                SELECT * FROM UNNEST(
+                    %s::integer[], %s::bigint[], %s::bigint[], %s::bigint[], %s::bigint[],
+                    %s::timestamptz[], %s::boolean[]
+                )
+                ON CONFLICT (user_id, survey_id, questions_shown_id, questions_answered_id)
+                DO UPDATE SET
+                    answers_given_id = EXCLUDED.answers_given_id,
+                    timestamp = EXCLUDED.timestamp
+                WHERE
+                    survey_userstatistics.timestamp < EXCLUDED.timestamp
+                RETURNING id
+            """, [list(column) for column in columns])
+            copied += len(cursor.fetchall())
+
+    Survey.objects.filter(pk=survey_id).update(shard=target if pin else '')
+    statistics.filter(id__lte=last_id, timestamp__lte=started_at).delete()
+
+    # Скетчи времени прохождения пересчитываются по статистике в новой базе,
+    # состояние пользователей в прежней базе больше не нужно
+    SurveyTimingProgress.objects.using(source).filter(survey_id=survey_id).delete()
+    if SurveyTiming.objects.filter(survey_id=survey_id).exists():
+        update_survey_timing(survey_id, rebuild=True)
+
+    return copied
@@ -0,0 +1,182 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Union
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Q
+from django.db.models.signals import post_delete
+
+from .models import Survey, Question, Answer, UserStatistics, SurveyTimingProgress
+
+# Модели, строки которых хранятся в базе опроса (шарде), а не в каталоге
+SHARDED_MODELS = (UserStatistics, SurveyTimingProgress)
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """
+    Jump consistent hash (Lamping, Veach): номер корзины от 0 до buckets - 1.
+    При добавлении корзины в конец в новую корзину переходит только 1 / buckets ключей.
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * (float(1 << 31) / float((key >> 33) + 1)))
+    return bucket
+
+
+def hash_survey_shard(survey_id: int) -> str:
+    """
+    Возвращает базу опроса по хэшу его номера среди SURVEY_SHARDS.
+    """
+    shards = settings.SURVEY_SHARDS
+    return shards[jump_hash(survey_id, len(shards))]
+
+
+def resolve_survey_shard(survey_id: int, shard: str) -> str:
+    """
+    Возвращает закреплённую за опросом базу shard, если она есть в SURVEY_SHARDS,
+    иначе базу по хэшу номера опроса.
+    """
+    if shard in settings.SURVEY_SHARDS:
+        return shard
+    return hash_survey_shard(survey_id)
+
+
+def get_survey_shard(survey: Union[Survey, int]) -> str:
+    """
+    Возвращает псевдоним базы данных, в которой хранится статистика опроса:
+    закреплённую за опросом базу (Survey.shard) или базу по хэшу номера опроса.
+
+    Параметры:
+    - survey: Union[Survey, int], опрос или его номер. По номеру закреплённая база
+      читается из каталога одним запросом по первичному ключу.
+
+    Возвращает:
+    - str: Псевдоним базы данных из SURVEY_SHARDS.
+    """
+    shards = settings.SURVEY_SHARDS
+    if len(shards) == 1:
+        return shards[0]
+
+    if isinstance(survey, Survey):
+        return resolve_survey_shard(survey.pk, survey.shard)
+    shard = Survey.objects.filter(pk=survey).values_list('shard', flat=True).first()
+    return resolve_survey_shard(survey, shard)
+
+
+class ShardRoutingError(Exception):
+    """
+    Запрос к шардированной модели, базу которого нельзя определить: нет объекта-подсказки
+    с опросом, а баз статистики несколько.
+    """
+
+
+# База для запросов к шардированным моделям без опроса в подсказке (см. using_shard)
+_current_shard: ContextVar[Optional[str]] = ContextVar('survey_current_shard', default=None)
+
+
+@contextmanager
+def using_shard(shard: str):
+    """
+    Направляет в базу shard запросы к шардированным моделям, базу которых роутер
+    не может определить по подсказке, например внутренние запросы админки
+    (транзакции и сбор удаляемых объектов).
+    """
+    token = _current_shard.set(shard)
+    try:
+        yield
+    finally:
+        _current_shard.reset(token)
+
+
+def _hint_survey_id(hints) -> Optional[int]:
+    instance = hints.get('instance')
+    if instance is None:
+        return None
+    if isinstance(instance, Survey):
+        return instance.pk
+    if isinstance(instance, SHARDED_MODELS):
+        return instance.survey_id
+    return None
+
+
+class SurveyShardRouter:
+    """
+    Роутер баз данных: определения опросов, пользователи и все остальные модели
+    хранятся в каталоге (default), статистика ответов и состояние её обработки
+    (SHARDED_MODELS) - в базе опроса из SURVEY_SHARDS (см. get_survey_shard).
+
+    Запросы к шардированным моделям без опроса в подсказке (Model.objects.filter(...),
+    user.user_statistics.all()) при нескольких базах статистики завершаются ошибкой
+    ShardRoutingError, а не уходят молча в default: такие запросы должны явно указывать базу,
+    UserStatistics.objects.using(get_survey_shard(survey_id)), или выполняться внутри using_shard.
+
+    Схема всех баз одинаковая (python manage.py migrate --database <псевдоним>),
+    таблицы каталога в шардах остаются пустыми. Миграции данных (RunPython, RunSQL)
+    выполняются только в default: шарды создаются пустыми, а их данные переносит rebalance_shards.
+    """
+
+    def db_for_read(self, model, **hints):
+        if issubclass(model, SHARDED_MODELS):
+            survey_id = _hint_survey_id(hints)
+            if survey_id is not None:
+                return get_survey_shard(survey_id)
+            if len(settings.SURVEY_SHARDS) == 1:
+                return settings.SURVEY_SHARDS[0]
+            if _current_shard.get() is not None:
+                return _current_shard.get()
+            raise ShardRoutingError(
+                f'Не удалось определить базу запроса к {model.__name__}: '
+                f'укажите её явно, using(get_survey_shard(survey_id))'
+            )
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if (issubclass(model, SHARDED_MODELS) and _hint_survey_id(hints) is None
+                and instance is not None and not isinstance(instance, SHARDED_MODELS)):
+            # Присваивание объекта каталога полю статистики (UserStatistics(user=user)):
+            # база строки выбирается при save() по её опросу
+            return None
+        return self.db_for_read(model, **hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Статистика ссылается на опросы, вопросы и пользователей каталога
+        if isinstance(obj1, SHARDED_MODELS) or isinstance(obj2, SHARDED_MODELS):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Операции без модели - миграции данных: в шардах их данных нет
+        if db != DEFAULT_DB_ALIAS and model_name is None:
+            return False
+        return None
+
+
+# Поля шардированных моделей, по которым удаляются строки в шардах при удалении объекта каталога:
+# Django удаляет связанные объекты (on_delete=CASCADE) только в базе удаляемого объекта
+SHARD_CASCADES = {
+    Survey: {UserStatistics: ('survey',), SurveyTimingProgress: ('survey',)},
+    User: {UserStatistics: ('user',), SurveyTimingProgress: ('user',)},
+    Question: {UserStatistics: ('questions_shown', 'questions_answered')},
+    Answer: {UserStatistics: ('answers_given',)},
+}
+
+
+def delete_sharded_statistics(sender, instance, using, **kwargs):
+    shards = [get_survey_shard(instance)] if sender is Survey else settings.SURVEY_SHARDS
+    for model, fields in SHARD_CASCADES[sender].items():
+        condition = Q()
+        for field in fields:
+            condition |= Q(**{f'{field}_id': instance.pk})
+
+        for shard in shards:
+            if shard != using:
+                model.objects.using(shard).filter(condition).delete()
+
+
+for cascade_model in SHARD_CASCADES:
+    post_delete.connect(delete_sharded_statistics, sender=cascade_model)
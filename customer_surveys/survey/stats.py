@@ -0,0 +1,215 @@
+from statistics import NormalDist
+from typing import Dict, List, Sequence, Hashable, Iterable
+
+import numpy as np
+
+# Коэффициенты приближения erfc (Abramowitz, Stegun 7.1.26), погрешность < 1.5e-7
+ERFC_P = 0.3275911
+ERFC_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+
+
+def _erfc(x: np.ndarray) -> np.ndarray:
+    """
+    Векторная дополнительная функция ошибок для x >= 0.
+    """
+    t = 1.0 / (1.0 + ERFC_P * x)
+    polynomial = np.zeros_like(t)
+    for coefficient in reversed(ERFC_A):
+        polynomial = (polynomial + coefficient) * t
+    return polynomial * np.exp(-x * x)
+
+
+def calculate_confidence(groups: Sequence[Hashable], counts: Sequence[int], level: float = 0.95) -> Dict[str, np.ndarray]:
+    """
+    Рассчитывает доверительные интервалы Уилсона для долей вариантов ответа и попарную
+    значимость различий между вариантами одного вопроса.
+    Все вопросы обрабатываются за один проход векторными операциями NumPy.
+
+    Параметры:
+    - groups: Sequence[Hashable], вопрос каждой строки (id или текст).
+    - counts: Sequence[int], количество выбравших вариант ответа в каждой строке.
+    - level: float, уровень доверия.
+
+    Возвращает:
+    - Dict[str, np.ndarray]: 'share', 'lower', 'upper' - доля и границы интервала для каждой строки
+      (от 0 до 1); 'pair_a', 'pair_b' - индексы строк в каждой паре вариантов одного вопроса;
+      'z', 'p_value' - статистика и двусторонний p-value различия долей в паре.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    z_level = NormalDist().inv_cdf(0.5 + level / 2)
+
+    # Итоги по вопросам: сумма выбравших все варианты ответа
+    _, group_index = np.unique(np.asarray(groups, dtype=object), return_inverse=True)
+    group_totals = np.bincount(group_index, weights=counts)
+    totals = group_totals[group_index]
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        share = np.where(totals > 0, counts / totals, 0.0)
+        z2_n = np.where(totals > 0, z_level ** 2 / totals, 0.0)
+        denominator = 1 + z2_n
+        center = (share + z2_n / 2) / denominator
+        half_width = z_level * np.sqrt(
+            np.where(totals > 0, share * (1 - share) / totals, 0.0) + z2_n ** 2 / (4 * z_level ** 2)
+        ) / denominator
+    lower = np.where(totals > 0, np.clip(center - half_width, 0, 1), 0.0)
+    upper = np.where(totals > 0, np.clip(center + half_width, 0, 1), 0.0)
+
+    # Все пары строк внутри каждого вопроса без циклов по вопросам
+    order = np.argsort(group_index, kind='stable')
+    sizes = np.bincount(group_index)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    max_size = int(sizes.max()) if sizes.size else 0
+    first, second = np.triu_indices(max_size, 1)
+    mask = second[None, :] < sizes[:, None]
+    group_of_pair = np.nonzero(mask)[0]
+    pair_a = order[starts[group_of_pair] + np.broadcast_to(first, mask.shape)[mask]]
+    pair_b = order[starts[group_of_pair] + np.broadcast_to(second, mask.shape)[mask]]
+
+    # Разность долей одного мультиномиального распределения:
+    # Var(p_a - p_b) = (p_a + p_b - (p_a - p_b)^2) / n
+    difference = share[pair_a] - share[pair_b]
+    variance = np.where(
+        totals[pair_a] > 0,
+        (share[pair_a] + share[pair_b] - difference ** 2) / np.where(totals[pair_a] > 0, totals[pair_a], 1),
+        0.0
+    )
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z = np.where(variance > 0, difference / np.sqrt(variance), 0.0)
+    p_value = np.clip(_erfc(np.abs(z) / np.sqrt(2)), 0, 1)
+
+    return {
+        'share': share,
+        'lower': lower,
+        'upper': upper,
+        'pair_a': pair_a,
+        'pair_b': pair_b,
+        'z': z,
+        'p_value': p_value,
+    }
+
+
+def add_confidence(rows: List[Dict], groups: Sequence[Hashable], count_key: str, label_key: str,
+                   level: float = 0.95) -> List[Dict]:
+    """
+    Дополняет строки статистики ответов доверительными интервалами и попарной значимостью.
+
+    К каждой строке добавляются 'ci_lower' и 'ci_upper' (в процентах) и 'pairwise' -
+    список сравнений с другими вариантами того же вопроса ('z', 'p_value', 'significant').
+
+    Параметры:
+    - rows: List[Dict], строки статистики с количеством выбравших вариант ответа.
+    - groups: Sequence[Hashable], вопрос каждой строки.
+    - count_key: str, ключ количества выбравших в строке.
+    - label_key: str, ключ, которым в 'pairwise' обозначается другой вариант ответа.
+    - level: float, уровень доверия.
+
+    Возвращает:
+    - List[Dict]: Те же строки с добавленными полями.
+    """
+    if not rows:
+        return rows
+
+    result = calculate_confidence(groups, [row[count_key] for row in rows], level)
+    lower = np.round(result['lower'] * 100, 2).tolist()
+    upper = np.round(result['upper'] * 100, 2).tolist()
+    for row, row_lower, row_upper in zip(rows, lower, upper):
+        row['ci_lower'] = row_lower
+        row['ci_upper'] = row_upper
+        row['pairwise'] = []
+
+    alpha = 1 - level
+    for a, b, z, p_value in zip(result['pair_a'].tolist(), result['pair_b'].tolist(),
+                                np.round(result['z'], 4).tolist(), result['p_value'].tolist()):
+        significant = p_value < alpha
+        p_value = round(p_value, 6)
+        rows[a]['pairwise'].append(
+            {label_key: rows[b][label_key], 'z': z, 'p_value': p_value, 'significant': significant}
+        )
+        rows[b]['pairwise'].append(
+            {label_key: rows[a][label_key], 'z': -z, 'p_value': p_value, 'significant': significant}
+        )
+
+    return rows
+
+
+class QuantileSketch:
+    """
+    Сливаемый скетч квантилей (t-digest): хранит не больше ~compression центроидов
+    независимо от количества добавленных значений.
+
+    Значения добавляются пачками: пачка и текущие центроиды сортируются и сжимаются
+    векторно - точки, попавшие в один интервал масштабной функции
+    k(q) = compression / (2 * pi) * asin(2q - 1), объединяются в центроид.
+    На краях распределения интервалы узкие, поэтому p99 оценивается точнее, чем медиана.
+    """
+
+    def __init__(self, compression: int = 100, means=None, weights=None, minimum=None, maximum=None):
+        self.compression = compression
+        self.means = np.asarray(means if means is not None else [], dtype=np.float64)
+        self.weights = np.asarray(weights if weights is not None else [], dtype=np.float64)
+        self.minimum = minimum
+        self.maximum = maximum
+
+    @property
+    def count(self) -> int:
+        return int(self.weights.sum())
+
+    def update(self, values: Iterable[float]):
+        """
+        Добавляет пачку значений.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        self.minimum = float(values.min()) if self.minimum is None else min(self.minimum, float(values.min()))
+        self.maximum = float(values.max()) if self.maximum is None else max(self.maximum, float(values.max()))
+        self._compress(np.concatenate((self.means, values)), np.concatenate((self.weights, np.ones(values.size))))
+
+    def merge(self, other: 'QuantileSketch'):
+        """
+        Добавляет центроиды другого скетча.
+        """
+        if not other.weights.size:
+            return
+        self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.maximum = other.maximum if self.maximum is None else max(self.maximum, other.maximum)
+        self._compress(np.concatenate((self.means, other.means)), np.concatenate((self.weights, other.weights)))
+
+    def _compress(self, means: np.ndarray, weights: np.ndarray):
+        order = np.argsort(means, kind='stable')
+        means, weights = means[order], weights[order]
+        total = weights.sum()
+        cumulative = np.cumsum(weights)
+        q = (cumulative - weights / 2) / total
+        k = self.compression / (2 * np.pi) * np.arcsin(2 * q - 1)
+        buckets = np.floor(k)
+        starts = np.concatenate(([0], np.nonzero(np.diff(buckets))[0] + 1))
+        merged_weights = np.add.reduceat(weights, starts)
+        self.means = np.add.reduceat(means * weights, starts) / merged_weights
+        self.weights = merged_weights
+
+    def quantiles(self, qs: Sequence[float]) -> List[float]:
+        """
+        Возвращает оценки квантилей qs (от 0 до 1).
+        """
+        if not self.weights.size:
+            return [None] * len(qs)
+        total = self.weights.sum()
+        centers = np.cumsum(self.weights) - self.weights / 2
+        positions = np.concatenate(([0], centers, [total]))
+        values = np.concatenate(([self.minimum], self.means, [self.maximum]))
+        return np.interp(np.asarray(qs) * total, positions, values).tolist()
+
+    def to_dict(self) -> Dict:
+        return {
+            'compression': self.compression,
+            'means': self.means.tolist(),
+            'weights': self.weights.tolist(),
+            'min': self.minimum,
+            'max': self.maximum,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'QuantileSketch':
+        return cls(data['compression'], data['means'], data['weights'], data['min'], data['max'])
@@ -1,3 +1,1552 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import gzip
+import hashlib
+import json
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import brotli
+import msgpack
+import numpy as np
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, IntegrityError, connection, connections, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .backends import CachedModelBackend
+from .columnar import COLUMNS, export_survey_columns, load_survey_columns
+from .graph import GRAPH_FORMAT_VERSION, clone_survey, export_survey_graph, import_survey_graph
+from .live import SurveyBroadcaster
+from .middleware import list_profiles
+from .models import (Survey, SurveyQuestion, Question, Answer, AnswerGroup, UserStatistics, SurveySnapshot,
+                     SurveyTiming, SurveyTimingProgress)
+from .renderers import to_columns
+from .serializers import PostAnswerSerializer
+from .service import (close_survey, enroll_participants, get_first_question, get_survey_timing,
+                      get_surveys_dashboard, move_survey_statistics, process_user_answer, read_user_ids,
+                      update_survey_timing, upsert_user_answer)
+from .sharding import (ShardRoutingError, SurveyShardRouter, get_survey_shard, hash_survey_shard, jump_hash,
+                       using_shard)
+from .stats import QuantileSketch, add_confidence, calculate_confidence
+
+SHARDS = ['shard_0', 'shard_1', 'shard_2']
+
+
+def create_survey_graph(title='Опрос', questions=3):
+    """
+    Создаёт опрос с цепочкой вопросов: каждый вопрос с двумя ответами, оба ответа ведут
+    к следующему вопросу, у последнего вопроса ответы завершают опрос.
+    Возвращает опрос и список пар (вопрос, [ответы]).
+    """
+    survey = Survey.objects.create(title=title)
+    group = AnswerGroup.objects.create(name=f'{title}: ответы')
+    chain = [Question.objects.create(text=f'{title}: вопрос {index}', answer_group=group)
+             for index in range(1, questions + 1)]
+    graph = []
+    for position, question in enumerate(chain, start=1):
+        next_question = chain[position] if position < len(chain) else None
+        answers = [
+            Answer.objects.create(number_answer=number, text=f'ответ {number}', question=question,
+                                  next_question=next_question, group=group)
+            for number in (1, 2)
+        ]
+        SurveyQuestion.objects.create(survey=survey, question=question, position=position)
+        graph.append((question, answers))
+    return survey, graph
+
+
+def run_in_thread(function, *args):
+    """
+    Запускает function в отдельном потоке (со своим соединением с базой данных).
+    Возвращает поток и список, в который будет записан результат.
+    """
+    result = []
+
+    def target():
+        try:
+            result.append(function(*args))
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=target)
+    thread.start()
+    return thread, result
+
+
+class CloseSurveyTests(TestCase):
+
+    def setUp(self):
+        self.survey, self.graph = create_survey_graph()
+        self.staff = User.objects.create(username='staff', is_staff=True)
+        question, answers = self.graph[0]
+        for index in range(3):
+            user = User.objects.create(username=f'user_{index}')
+            UserStatistics.objects.create(user=user, survey=self.survey, questions_shown=question,
+                                          questions_answered=question, answers_given=answers[index % 2])
+
+    def test_close_saves_snapshot(self):
+        self.client.force_login(self.staff)
+        statistics = self.client.get(f'/survey/{self.survey.pk}/statistics/').json()
+
+        response = self.client.post(f'/survey/{self.survey.pk}/close/')
+        self.assertEqual(response.status_code, 201)
+
+        self.survey.refresh_from_db()
+        snapshot = SurveySnapshot.objects.get(survey=self.survey)
+        self.assertEqual(self.survey.closed_at, snapshot.created_at)
+        self.assertEqual(len(json.loads(zlib.decompress(snapshot.data))['statistics']), len(statistics))
+
+        # Ответы после закрытия не меняют аналитику
+        question, answers = self.graph[0]
+        UserStatistics.objects.create(user=self.staff, survey=self.survey, questions_shown=question,
+                                      questions_answered=question, answers_given=answers[0])
+        self.assertEqual(self.client.get(f'/survey/{self.survey.pk}/statistics/').json(), statistics)
+        self.assertEqual(self.client.post(f'/survey/{self.survey.pk}/close/').status_code, 400)
+
+    def test_close_requires_staff(self):
+        self.client.force_login(User.objects.create(username='respondent'))
+
+        self.assertEqual(self.client.post(f'/survey/{self.survey.pk}/close/').status_code, 403)
+        self.assertFalse(SurveySnapshot.objects.filter(survey=self.survey).exists())
+
+    def test_snapshot_is_immutable(self):
+        snapshot = close_survey(self.survey.pk)
+
+        with self.assertRaises(ValueError):
+            snapshot.save()
+        with self.assertRaises(DatabaseError), transaction.atomic():
+            SurveySnapshot.objects.filter(pk=snapshot.pk).update(data=b'')
+
+    def test_closed_survey_rejects_answers(self):
+        close_survey(self.survey.pk)
+        self.client.force_login(self.staff)
+
+        response = self.client.post(f'/survey/{self.survey.pk}/', {'number_answer': 1})
+        self.assertEqual(response.json(), {'message': 'Опрос закрыт'})
+
+
+class CloseSurveyConcurrencyTests(TransactionTestCase):
+
+    def test_answer_during_close_waits_and_is_rejected(self):
+        survey, _ = create_survey_graph()
+        user = User.objects.create(username='respondent')
+
+        with transaction.atomic():
+            # Закрытие опроса держит блокировку строки опроса, пока строит снимок
+            Survey.objects.select_for_update().get(pk=survey.pk)
+            thread, result = run_in_thread(
+                process_user_answer, user, PostAnswerSerializer(data={'number_answer': 1}), survey
+            )
+            time.sleep(0.5)
+            self.assertTrue(thread.is_alive())
+            Survey.objects.filter(pk=survey.pk).update(closed_at=timezone.now())
+
+        thread.join(10)
+        self.assertEqual(result, [{'message': 'Опрос закрыт'}])
+        self.assertFalse(UserStatistics.objects.filter(survey=survey).exists())
+
+
+class SurveySnapshotMigrationTests(TransactionTestCase):
+    """
+    Поля закрытия опроса добавляются отдельной миграцией после исходной схемы.
+    """
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('survey'))
+
+    def columns(self, table):
+        with connection.cursor() as cursor:
+            return {column.name for column in connection.introspection.get_table_description(cursor, table)}
+
+    def test_initial_schema_has_no_snapshot(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('survey', '0001_initial')])
+        self.assertNotIn('closed_at', self.columns('survey_survey'))
+        self.assertNotIn('survey_surveysnapshot', connection.introspection.table_names())
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('survey', '0002_survey_snapshot')])
+        self.assertIn('closed_at', self.columns('survey_survey'))
+        self.assertIn('survey_surveysnapshot', connection.introspection.table_names())
+
+
+class ColumnarExportTests(TestCase):
+
+    def setUp(self):
+        self.survey, self.graph = create_survey_graph()
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        started = timezone.now().replace(microsecond=123456)
+        for index in range(5):
+            user = User.objects.create(username=f'user_{index}')
+            for position, (question, answers) in enumerate(self.graph[:index % 3 + 1]):
+                UserStatistics.objects.create(
+                    user=user, survey=self.survey, questions_shown=question, questions_answered=question,
+                    answers_given=answers[index % 2],
+                    timestamp=started + datetime.timedelta(seconds=index * 10 + position, microseconds=index)
+                )
+
+    def test_round_trip(self):
+        rows = list(UserStatistics.objects.filter(survey=self.survey).order_by('id').values_list(
+            'user_id', 'questions_shown_id', 'questions_answered_id', 'answers_given_id', 'timestamp'
+        ))
+
+        self.assertEqual(export_survey_columns(self.survey.pk, self.directory), len(rows))
+        data = load_survey_columns(self.directory)
+
+        self.assertEqual((data['survey_id'], data['rows']), (self.survey.pk, len(rows)))
+        for name, dtype in COLUMNS.items():
+            column = data['columns'][name]
+            self.assertEqual(column.dtype, np.dtype(dtype))
+            # Массивы открываются через mmap только для чтения
+            self.assertIsInstance(column, np.memmap)
+            self.assertFalse(column.flags.writeable)
+
+        user_ids, shown_ids, answered_ids, given_ids, timestamps = map(list, zip(*rows))
+        self.assertEqual(data['columns']['user_id'].tolist(), user_ids)
+        self.assertEqual(data['columns']['questions_shown_id'].tolist(), shown_ids)
+        self.assertEqual(data['columns']['questions_answered_id'].tolist(), answered_ids)
+        self.assertEqual(data['columns']['answers_given_id'].tolist(), given_ids)
+        self.assertEqual(
+            [datetime.datetime.fromtimestamp(value / 10 ** 6, datetime.timezone.utc)
+             for value in data['columns']['timestamp'].tolist()],
+            timestamps
+        )
+        self.assertEqual(data['questions'], {question.pk: question.text for question, _ in self.graph})
+        self.assertEqual(data['answers'], dict(Answer.objects.filter(id__in=given_ids).values_list('id', 'text')))
+
+    def test_empty_survey(self):
+        survey, _ = create_survey_graph('Пустой')
+
+        self.assertEqual(export_survey_columns(survey.pk, self.directory), 0)
+        data = load_survey_columns(self.directory)
+        self.assertEqual(data['rows'], 0)
+        self.assertEqual(data['columns']['user_id'].tolist(), [])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('export_survey_columns', self.survey.pk, str(self.directory), stdout=out)
+
+        self.assertIn('Выгружено строк: 9', out.getvalue())
+        self.assertTrue((self.directory / 'user_id.npy').is_file())
+        with self.assertRaises(CommandError):
+            call_command('export_survey_columns', 0, str(self.directory))
+
+
+class IdempotentAnswerTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.survey, self.graph = create_survey_graph()
+        self.user = User.objects.create(username='respondent')
+        self.client.force_login(self.user)
+        self.url = f'/survey/{self.survey.pk}/'
+
+    def post(self, key, number_answer=1, **kwargs):
+        return self.client.post(self.url, {'number_answer': number_answer}, HTTP_IDEMPOTENCY_KEY=key, **kwargs)
+
+    def test_replay_returns_saved_response(self):
+        first = self.post('key-1')
+        replay = self.post('key-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.json()['вопрос'], self.graph[1][0].text)
+        # Без ключа тот же запрос ответил бы уже на второй вопрос
+        self.assertEqual(replay.json(), first.json())
+        self.assertEqual(UserStatistics.objects.filter(survey=self.survey).count(), 1)
+
+    def test_form_and_json_bodies_match(self):
+        first = self.post('key-1')
+        replay = self.client.post(self.url, json.dumps({'number_answer': 1, 'text': 'о1'}),
+                                  content_type='application/json', HTTP_IDEMPOTENCY_KEY='key-1')
+
+        self.assertEqual(replay.status_code, 200)
+        self.assertEqual(replay.json(), first.json())
+
+    def test_key_reused_with_other_answer(self):
+        self.post('key-1')
+        response = self.post('key-1', number_answer=2)
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(UserStatistics.objects.filter(survey=self.survey).count(), 1)
+
+    def test_request_in_progress(self):
+        key_hash = hashlib.sha256(b'key-1').hexdigest()
+        cache.add(f'survey:idempotency:{self.user.pk}:{self.survey.pk}:{key_hash}:lock', True)
+
+        self.assertEqual(self.post('key-1').status_code, 409)
+        self.assertFalse(UserStatistics.objects.filter(survey=self.survey).exists())
+
+    def test_keys_are_per_user_and_survey(self):
+        self.post('key-1')
+        self.client.force_login(User.objects.create(username='other'))
+
+        self.assertEqual(self.post('key-1').status_code, 200)
+        self.assertEqual(UserStatistics.objects.filter(survey=self.survey).count(), 2)
+
+    def test_too_long_key(self):
+        self.assertEqual(self.post('k' * 256).status_code, 400)
+
+
+class SurveysDashboardTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.surveys = [create_survey_graph(f'Опрос {index}')[0] for index in range(5)]
+        self.users = [User.objects.create(username=f'user_{index}') for index in range(4)]
+        for index, survey in enumerate(self.surveys):
+            survey.participants.set(self.users[:index])
+            question = survey.questions.first()
+            for user in self.users[:index // 2]:
+                UserStatistics.objects.create(user=user, survey=survey, questions_shown=question,
+                                              questions_answered=question, answers_given=question.answers.first())
+        self.client.force_login(self.users[0])
+
+    def test_constant_number_of_queries(self):
+        # Один запрос к каталогу и один к базе статистики, независимо от количества опросов
+        with self.assertNumQueries(2):
+            result = get_surveys_dashboard(survey_ids=[survey.pk for survey in self.surveys])
+
+        self.assertEqual(result['count'], 5)
+        self.assertEqual(
+            [(row['total_participants'], row['total_respondents'], row['completion_rate']) for row in result['results']],
+            [(0, 0, 0), (1, 0, 0), (2, 1, 50.0), (3, 1, 33.33), (4, 2, 50.0)]
+        )
+
+    def test_pages(self):
+        ids = ','.join(str(survey.pk) for survey in self.surveys)
+
+        page = self.client.get(f'/survey/dashboard/?ids={ids}&page=2&page_size=2').json()
+        self.assertEqual(page['count'], 5)
+        self.assertEqual([row['survey_id'] for row in page['results']], [survey.pk for survey in self.surveys[2:4]])
+
+        # Страница за пределами списка сохраняет общее количество
+        page = self.client.get(f'/survey/dashboard/?ids={ids}&page=10&page_size=2').json()
+        self.assertEqual((page['count'], page['results']), (5, []))
+
+    def test_id_range(self):
+        first, last = self.surveys[1].pk, self.surveys[3].pk
+        result = self.client.get(f'/survey/dashboard/?start={first}&end={last}').json()
+
+        self.assertEqual([row['survey_id'] for row in result['results']], [first, self.surveys[2].pk, last])
+
+    def test_response_is_cached(self):
+        url = f'/survey/dashboard/?ids={self.surveys[4].pk}'
+        self.client.get(url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.json()['results'][0]['total_respondents'], 2)
+        self.assertFalse([query for query in queries if 'survey_' in query['sql']])
+        self.assertIn('max-age', response['Cache-Control'])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get('/survey/dashboard/').status_code, 400)
+        self.assertEqual(self.client.get('/survey/dashboard/?ids=1,x').status_code, 400)
+        self.assertEqual(self.client.get('/survey/dashboard/?ids=1&page=0').status_code, 400)
+
+
+class ImportSurveyGraphTests(TestCase):
+
+    def graph(self):
+        return {
+            'version': GRAPH_FORMAT_VERSION,
+            'title': 'Импорт',
+            'answer_groups': [{'id': 100, 'name': 'Группа'}],
+            'questions': [
+                {'id': 10, 'text': 'Первый', 'answer_group': 100, 'parent_question': None},
+                {'id': 11, 'text': 'Второй', 'answer_group': 100, 'parent_question': 10},
+            ],
+            'answers': [
+                {'id': 20, 'number_answer': 1, 'text': 'Дальше', 'question': 10, 'next_question': 11, 'group': 100},
+                {'id': 21, 'number_answer': 1, 'text': 'Конец', 'question': 11, 'next_question': None, 'group': 100},
+            ],
+            'survey_questions': [10, 11],
+        }
+
+    def test_import_remaps_references(self):
+        with self.assertNumQueries(8):
+            survey = import_survey_graph(self.graph())
+
+        first, second = [item.question for item in SurveyQuestion.objects.filter(survey=survey).order_by('position')]
+        self.assertEqual((first.text, second.text), ('Первый', 'Второй'))
+        self.assertEqual(second.parent_question, first)
+        self.assertEqual(first.answers.get().next_question, second)
+        self.assertIsNone(second.answers.get().next_question)
+        self.assertEqual(first.answer_group, second.answer_group)
+        self.assertEqual(first.answer_group.name, 'Группа')
+
+    def test_version_1_question_surveys(self):
+        data = self.graph()
+        data.update(version=1, survey_questions=[10], question_surveys=[11, 10])
+        survey = import_survey_graph(data, title='Старый формат')
+
+        self.assertEqual(survey.title, 'Старый формат')
+        self.assertEqual(
+            list(SurveyQuestion.objects.filter(survey=survey).values_list('question__text', flat=True)),
+            ['Первый', 'Второй']
+        )
+
+    def test_invalid_graph_creates_nothing(self):
+        unknown_reference = self.graph()
+        unknown_reference['answers'][0]['next_question'] = 99
+        missing_key = self.graph()
+        del missing_key['answers'][1]['group']
+        surveys = Survey.objects.count()
+
+        for data in (unknown_reference, missing_key, {**self.graph(), 'version': 3}, {**self.graph(), 'questions': 1}):
+            with self.assertRaises(ValueError):
+                import_survey_graph(data)
+        self.assertEqual(Survey.objects.count(), surveys)
+
+    def test_clone_round_trip(self):
+        survey, _ = create_survey_graph('Исходный')
+        large, _ = create_survey_graph('Большой', questions=30)
+        # Количество запросов не зависит от размера опроса
+        with CaptureQueriesContext(connection) as small_queries:
+            copy = clone_survey(survey.pk)
+        with CaptureQueriesContext(connection) as large_queries:
+            clone_survey(large.pk)
+        self.assertEqual(len(small_queries), len(large_queries))
+
+        original, cloned = export_survey_graph(survey.pk), export_survey_graph(copy.pk)
+        self.assertEqual(cloned['title'], 'Исходный (копия)')
+        self.assertEqual(
+            [question['text'] for question in cloned['questions']],
+            [question['text'] for question in original['questions']]
+        )
+        self.assertEqual(len(cloned['answers']), len(original['answers']))
+        self.assertTrue(set(cloned['survey_questions']).isdisjoint(original['survey_questions']))
+
+
+class SurveyGraphApiTests(TestCase):
+
+    def setUp(self):
+        self.survey, _ = create_survey_graph('Исходный')
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+
+    def test_export_and_import(self):
+        data = self.client.get(f'/survey/{self.survey.pk}/export/').json()
+        response = self.client.post('/survey/import/', {**data, 'new_title': 'Из выгрузки'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        imported = Survey.objects.get(pk=response.json()['id'])
+        self.assertEqual(imported.title, 'Из выгрузки')
+        self.assertEqual(imported.questions.count(), 3)
+
+    def test_clone(self):
+        response = self.client.post(f'/survey/{self.survey.pk}/clone/', {'title': 'Копия'},
+                                    content_type='application/json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Survey.objects.get(pk=response.json()['id']).title, 'Копия')
+
+    def test_invalid_bodies(self):
+        surveys = Survey.objects.count()
+        for url in ('/survey/import/', f'/survey/{self.survey.pk}/clone/'):
+            for body in ([1, 2], 'опрос', {'title': ['x'], 'new_title': ['x']}):
+                response = self.client.post(url, body, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (url, body))
+        self.assertEqual(self.client.post('/survey/import/', {'version': 2}, content_type='application/json').status_code,
+                         400)
+        self.assertEqual(Survey.objects.count(), surveys)
+
+    def test_staff_only(self):
+        self.client.force_login(User.objects.create(username='respondent'))
+
+        self.assertEqual(self.client.get(f'/survey/{self.survey.pk}/export/').status_code, 403)
+        self.assertEqual(self.client.post(f'/survey/{self.survey.pk}/clone/').status_code, 403)
+
+
+class EnrollParticipantsTests(TestCase):
+
+    def setUp(self):
+        self.survey, _ = create_survey_graph()
+        self.users = [User.objects.create(username=f'user_{index}') for index in range(5)]
+        self.ids = [user.pk for user in self.users]
+
+    def test_existing_and_missing_users_are_skipped(self):
+        result = enroll_participants(self.survey.pk, [self.ids[0], self.ids[1], self.ids[1], 0])
+        self.assertEqual(result, {'inserted': 2, 'skipped': 2})
+
+        result = enroll_participants(self.survey.pk, self.ids[1:4], batch_size=2)
+        self.assertEqual(result, {'inserted': 2, 'skipped': 1})
+
+        self.survey.refresh_from_db()
+        self.assertEqual(self.survey.total_participants, 4)
+        self.assertEqual(set(self.survey.participants.values_list('id', flat=True)), set(self.ids[:4]))
+
+    def test_constant_queries_per_batch(self):
+        with self.assertNumQueries(4):
+            enroll_participants(self.survey.pk, iter(self.ids))
+
+    def test_read_user_ids(self):
+        lines = ['user_id,name', f'{self.ids[0]},a', '', ' 7 ,b', 'x,c']
+        self.assertEqual(list(read_user_ids(lines)), [self.ids[0], 7])
+
+    def test_api(self):
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+        url = f'/survey/{self.survey.pk}/participants/'
+
+        response = self.client.post(url, {'user_ids': self.ids[:2]}, content_type='application/json')
+        self.assertEqual(response.json(), {'inserted': 2, 'skipped': 0})
+
+        csv_file = SimpleUploadedFile('users.csv', '\ufeffuser_id\n{}\n{}\n'.format(*self.ids[1:3]).encode('utf-8'))
+        self.assertEqual(self.client.post(url, {'file': csv_file}).json(), {'inserted': 1, 'skipped': 1})
+
+        response = self.client.post(url, {'user_ids': ['1']}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        path = Path(tempfile.mkdtemp()) / 'users.csv'
+        self.addCleanup(shutil.rmtree, path.parent)
+        path.write_text('\n'.join(map(str, self.ids)), encoding='utf-8')
+        out = StringIO()
+
+        call_command('enroll_participants', self.survey.pk, str(path), batch_size=2, stdout=out)
+        self.assertIn('Добавлено: 5, пропущено: 0', out.getvalue())
+
+
+class EnrollParticipantsConcurrencyTests(TransactionTestCase):
+
+    def test_parallel_enrollments_count_each_user_once(self):
+        survey, _ = create_survey_graph()
+        ids = [User.objects.create(username=f'user_{index}').pk for index in range(7)]
+
+        threads = [run_in_thread(enroll_participants, survey.pk, ids) for _ in range(4)]
+        for thread, _ in threads:
+            thread.join(10)
+
+        self.assertEqual(sum(result[0]['inserted'] for _, result in threads), 7)
+        survey.refresh_from_db()
+        self.assertEqual(survey.total_participants, 7)
+        self.assertEqual(survey.participants.count(), 7)
+
+
+class CalculateConfidenceTests(SimpleTestCase):
+
+    def test_wilson_interval(self):
+        result = calculate_confidence(['q', 'q'], [30, 70], level=0.95)
+
+        self.assertAlmostEqual(result['share'][0], 0.3)
+        # Интервал Уилсона для 30 из 100 при уровне 0.95
+        self.assertAlmostEqual(result['lower'][0], 0.2189, places=3)
+        self.assertAlmostEqual(result['upper'][0], 0.3958, places=3)
+        self.assertAlmostEqual(result['lower'][1], 1 - result['upper'][0])
+
+    def test_pairs_stay_within_question(self):
+        groups = [1, 2, 1, 2, 2]
+        result = calculate_confidence(groups, [10, 5, 20, 5, 10])
+
+        pairs = {tuple(sorted(pair)) for pair in zip(result['pair_a'].tolist(), result['pair_b'].tolist())}
+        self.assertEqual(pairs, {(0, 2), (1, 3), (1, 4), (3, 4)})
+        # Доли считаются от итога своего вопроса
+        self.assertAlmostEqual(result['share'][0], 10 / 30)
+        self.assertAlmostEqual(result['share'][4], 10 / 20)
+
+    def test_equal_shares_are_not_significant(self):
+        result = calculate_confidence(['q', 'q', 'q'], [50, 50, 5])
+
+        significant = dict(zip(zip(result['pair_a'].tolist(), result['pair_b'].tolist()), result['p_value']))
+        self.assertAlmostEqual(significant[(0, 1)], 1.0)
+        self.assertLess(significant[(0, 2)], 0.001)
+
+    def test_question_without_answers(self):
+        result = calculate_confidence(['q', 'q'], [0, 0])
+
+        self.assertEqual(result['lower'].tolist(), [0.0, 0.0])
+        self.assertEqual(result['upper'].tolist(), [0.0, 0.0])
+        self.assertEqual(result['z'].tolist(), [0.0])
+        self.assertAlmostEqual(result['p_value'][0], 1.0)
+
+    def test_add_confidence_groups_by_question_not_text(self):
+        rows = [
+            {'question_text': 'Default Text', 'answer_text': 'да', 'answer_count': 9},
+            {'question_text': 'Default Text', 'answer_text': 'нет', 'answer_count': 1},
+            {'question_text': 'Default Text', 'answer_text': 'да', 'answer_count': 1},
+        ]
+        add_confidence(rows, [1, 1, 2], 'answer_count', 'answer_text')
+
+        self.assertEqual(len(rows[0]['pairwise']), 1)
+        self.assertEqual(rows[2]['pairwise'], [])
+        # Единственный ответ своего вопроса - доля 100%
+        self.assertEqual(rows[2]['ci_upper'], 100.0)
+
+
+class ConfidenceApiTests(TestCase):
+
+    def setUp(self):
+        # Тексты вопросов совпадают: интервалы должны считаться по номерам вопросов
+        self.survey = Survey.objects.create(title='Опрос')
+        self.questions = []
+        for position in (1, 2):
+            question = Question.objects.create()
+            answers = [Answer.objects.create(question=question, text=text) for text in ('да', 'нет')]
+            SurveyQuestion.objects.create(survey=self.survey, question=question, position=position)
+            self.questions.append((question, answers))
+        for index in range(10):
+            user = User.objects.create(username=f'user_{index}')
+            for number, (question, answers) in enumerate(self.questions):
+                UserStatistics.objects.create(user=user, survey=self.survey, questions_shown=question,
+                                              questions_answered=question,
+                                              answers_given=answers[index < 7 + number * 2])
+        self.client.force_login(User.objects.create(username='staff', is_staff=True))
+
+    def statistics(self):
+        rows = self.client.get(f'/survey/{self.survey.pk}/statistics/?confidence=0.95').json()
+        return {(row['answer_text'], row['answer_count']): row for row in rows}
+
+    def test_statistics_intervals_per_question(self):
+        rows = self.statistics()
+
+        self.assertEqual(len(rows), 4)
+        for row in rows.values():
+            self.assertEqual(len(row['pairwise']), 1)
+            self.assertLess(row['ci_lower'], row['answer_count'] * 10)
+            self.assertGreater(row['ci_upper'], row['answer_count'] * 10)
+
+    def test_snapshot_intervals_match_live(self):
+        live = self.statistics()
+        close_survey(self.survey.pk)
+
+        self.assertEqual(self.statistics(), live)
+
+    def test_response_rate(self):
+        question, answers = self.questions[0]
+        rows = self.client.get(f'/survey/{self.survey.pk}/response_rate/{question.pk}/?confidence=0.9').json()
+
+        self.assertEqual(rows[-1], {'total_users_count': 10})
+        self.assertEqual([row['pairwise'][0]['answer_id'] for row in rows[:-1]], [answers[0].pk, answers[1].pk])
+
+    def test_invalid_level(self):
+        self.assertEqual(self.client.get(f'/survey/{self.survey.pk}/statistics/?confidence=1.5').status_code, 400)
+
+
+@override_settings(SURVEY_LIVE_TICK=0.01)
+class SurveyBroadcasterTests(SimpleTestCase):
+
+    def test_publish_without_subscribers_is_ignored(self):
+        broadcaster = SurveyBroadcaster()
+        broadcaster.publish(1, 10, 100)
+
+        self.assertEqual(broadcaster._pending, {})
+
+    def test_delta_event(self):
+        async def scenario():
+            broadcaster = SurveyBroadcaster()
+            queue = broadcaster.subscribe(1)
+            other = broadcaster.subscribe(2)
+            broadcaster.publish(1, 10, 100)
+            broadcaster.publish(1, 10, 101)
+            broadcaster.publish(1, 11, 110)
+            # Повторный ответ: прежний вариант -1, новый +1, количество ответов не меняется
+            broadcaster.publish(1, 10, 101, previous_answer_id=100)
+            event = await asyncio.wait_for(queue.get(), 1)
+            broadcaster.unsubscribe(1, queue)
+            broadcaster.unsubscribe(2, other)
+            return event, other.empty(), broadcaster._subscribers
+
+        event, other_empty, subscribers = asyncio.run(scenario())
+
+        self.assertEqual(event, {
+            'survey_id': 1,
+            'responses': 3,
+            'questions': {'10': 2, '11': 1},
+            'answers': {'101': 2, '110': 1},
+        })
+        self.assertTrue(other_empty)
+        self.assertEqual(subscribers, {})
+
+    def test_zero_deltas_are_dropped(self):
+        async def scenario():
+            broadcaster = SurveyBroadcaster()
+            queue = broadcaster.subscribe(1)
+            broadcaster.publish(1, 10, 100, previous_answer_id=101)
+            broadcaster.publish(1, 10, 101, previous_answer_id=100)
+            broadcaster._flush()
+            return queue.get_nowait()
+
+        self.assertEqual(asyncio.run(scenario()),
+                         {'survey_id': 1, 'responses': 0, 'questions': {}, 'answers': {}})
+
+    def test_slow_subscriber_is_closed(self):
+        async def scenario():
+            broadcaster = SurveyBroadcaster(queue_size=2)
+            queue = broadcaster.subscribe(1)
+            for _ in range(3):
+                broadcaster.publish(1, 10, 100)
+                broadcaster._flush()
+            return queue.get_nowait(), queue.empty(), broadcaster._subscribers
+
+        self.assertEqual(asyncio.run(scenario()), (None, True, {}))
+
+
+class SurveyLiveViewTests(TestCase):
+
+    def test_wsgi_request_not_implemented(self):
+        survey = Survey.objects.create(title='Опрос')
+
+        self.assertEqual(self.client.get(f'/survey/{survey.pk}/live/').status_code, 501)
+
+    def test_answer_is_published_on_commit(self):
+        survey, graph = create_survey_graph('Опрос')
+        user = User.objects.create(username='user')
+        published = []
+        broadcaster = SurveyBroadcaster()
+        broadcaster._subscribers[survey.pk] = set()
+        broadcaster.publish = lambda *args: published.append(args)
+
+        with mock.patch('survey.service.broadcaster', broadcaster):
+            with self.captureOnCommitCallbacks(execute=True):
+                process_user_answer(user, PostAnswerSerializer(data={'number_answer': 1}), survey)
+
+        self.assertEqual(len(published), 1)
+        self.assertEqual(published[0][:2], (survey.pk, graph[0][0].pk))
+
+
+class SurveyQuestionTests(TestCase):
+
+    def test_first_question_by_position(self):
+        survey = Survey.objects.create(title='Опрос')
+        first, second = Question.objects.create(), Question.objects.create()
+        SurveyQuestion.objects.create(survey=survey, question=first, position=2)
+        SurveyQuestion.objects.create(survey=survey, question=second, position=1)
+
+        self.assertEqual(get_first_question(survey.pk), second)
+        self.assertEqual(list(survey.questions.order_by('question_surveys__position')), [second, first])
+        self.assertIsNone(get_first_question(Survey.objects.create(title='Пустой').pk))
+
+    def test_unique_position(self):
+        survey = Survey.objects.create(title='Опрос')
+        SurveyQuestion.objects.create(survey=survey, question=Question.objects.create(), position=1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SurveyQuestion.objects.create(survey=survey, question=Question.objects.create(), position=1)
+
+    def test_unique_question(self):
+        survey = Survey.objects.create(title='Опрос')
+        question = Question.objects.create()
+        SurveyQuestion.objects.create(survey=survey, question=question, position=1)
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            SurveyQuestion.objects.create(survey=survey, question=question, position=2)
+
+
+class SurveyQuestionMigrationTests(TransactionTestCase):
+    """
+    Связи из обеих M2M-таблиц переносятся в SurveyQuestion с номерами по возрастанию id вопроса.
+    """
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('survey'))
+
+    def test_merge_survey_questions(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('survey', '0002_survey_snapshot')])
+        apps = executor.loader.project_state(('survey', '0002_survey_snapshot')).apps
+        OldSurvey = apps.get_model('survey', 'Survey')
+        OldQuestion = apps.get_model('survey', 'Question')
+
+        survey = OldSurvey.objects.create(title='Опрос')
+        other = OldSurvey.objects.create(title='Другой опрос')
+        questions = [OldQuestion.objects.create(text=f'вопрос {index}') for index in range(4)]
+        # Связи записаны вразнобой в обе таблицы, одна связь - в обе сразу
+        survey.questions.add(questions[2], questions[0])
+        questions[1].survey.add(survey)
+        questions[2].survey.add(survey)
+        questions[3].survey.add(other)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate([('survey', '0003_survey_question_position')])
+        apps = executor.loader.project_state(('survey', '0003_survey_question_position')).apps
+        NewSurveyQuestion = apps.get_model('survey', 'SurveyQuestion')
+
+        self.assertEqual(
+            list(NewSurveyQuestion.objects.order_by('survey_id', 'position').values_list(
+                'survey_id', 'question_id', 'position')),
+            [(survey.pk, questions[0].pk, 1), (survey.pk, questions[1].pk, 2), (survey.pk, questions[2].pk, 3),
+             (other.pk, questions[3].pk, 1)]
+        )
+
+
+class SampledAnalyticsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.survey, graph = create_survey_graph('Опрос', questions=1)
+        cls.question, cls.answers = graph[0]
+        users = User.objects.bulk_create([User(username=f'user_{index}') for index in range(2000)])
+        UserStatistics.objects.bulk_create([
+            UserStatistics(user=user, survey=cls.survey, questions_shown=cls.question,
+                           questions_answered=cls.question, answers_given=cls.answers[index % 4 == 0])
+            for index, user in enumerate(users)
+        ])
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def response_rate(self, query):
+        response = self.client.get(f'/survey/{self.survey.pk}/response_rate/{self.question.pk}/{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_bernoulli_by_default(self):
+        rows = self.response_rate('?sample=10')
+        total = rows[-1]
+
+        self.assertEqual(total['sample_method'], 'BERNOULLI')
+        self.assertEqual(total['sample_percent'], 10)
+        self.assertLess(abs(total['total_users_count'] - 2000), 5 * total['total_users_count_se'])
+        expected = {self.answers[0].pk: 1500, self.answers[1].pk: 500}
+        for row in rows[:-1]:
+            self.assertLess(abs(row['user_count'] - expected[row['answer_id']]), 5 * row['user_count_se'])
+            self.assertIn('user_percentage_se', row)
+
+    def test_system_without_standard_errors(self):
+        rows = self.response_rate('?sample=10&sample_method=system')
+
+        self.assertEqual(rows[-1]['sample_method'], 'SYSTEM')
+        for row in rows:
+            self.assertFalse([key for key in row if key.endswith('_se')])
+
+        ordering = self.client.get(f'/survey/{self.survey.pk}/ordering/?sample=10&sample_method=system').json()
+        self.assertFalse([key for row in ordering for key in row if key.endswith('_se')])
+
+    def test_ordering_standard_error(self):
+        ordering = self.client.get(f'/survey/{self.survey.pk}/ordering/?sample=10').json()
+
+        self.assertEqual([row['question_id'] for row in ordering], [self.question.pk])
+        self.assertLess(abs(ordering[0]['total_users'] - 2000), 5 * ordering[0]['total_users_se'])
+
+    def test_full_sample_is_exact(self):
+        self.assertEqual(self.response_rate('?sample=100'), self.response_rate(''))
+        self.assertEqual(self.response_rate('')[-1], {'total_users_count': 2000})
+
+    def test_invalid_params(self):
+        for query in ('?sample=0', '?sample=101', '?sample=abc', '?sample=5&sample_method=random'):
+            with self.subTest(query=query):
+                response = self.client.get(f'/survey/{self.survey.pk}/response_rate/{self.question.pk}/{query}')
+                self.assertEqual(response.status_code, 400)
+
+
+class ProfilingMiddlewareTests(TestCase):
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        override = override_settings(SURVEY_PROFILING_DIR=self.directory, SURVEY_PROFILING_SAMPLE_RATE=0,
+                                     SURVEY_PROFILING_MAX_FILES=3)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.survey, _ = create_survey_graph('Опрос')
+        self.staff = User.objects.create(username='staff', is_staff=True)
+
+    def get(self, **headers):
+        return self.client.get(f'/survey/{self.survey.pk}/ordering/', headers=headers)
+
+    def test_staff_request_is_profiled(self):
+        self.client.force_login(self.staff)
+        response = self.get(x_profile='1')
+
+        name = response['X-Profile-Id']
+        self.assertTrue((self.directory / f'{name}.prof').is_file())
+        profile = json.loads((self.directory / f'{name}.json').read_text(encoding='utf-8'))
+        self.assertEqual(profile['user'], 'staff')
+        self.assertEqual(profile['status'], 200)
+        self.assertEqual(profile['sql_count'], len(profile['queries']))
+        self.assertGreater(profile['sql_count'], 0)
+
+    def test_header_ignored_for_non_staff(self):
+        self.client.force_login(User.objects.create(username='user'))
+        response = self.get(x_profile='1')
+
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(list(self.directory.iterdir()), [])
+
+    def test_sample_rate(self):
+        with override_settings(SURVEY_PROFILING_SAMPLE_RATE=1):
+            response = self.get()
+
+        self.assertIn('X-Profile-Id', response)
+
+    def test_rotation_and_listing(self):
+        self.client.force_login(self.staff)
+        names = [self.get(x_profile='1')['X-Profile-Id'] for _ in range(5)]
+
+        self.assertEqual(sorted(path.stem for path in self.directory.glob('*.json')), names[2:])
+        self.assertEqual(sorted(path.stem for path in self.directory.glob('*.prof')), names[2:])
+        profiles = list_profiles()
+        self.assertEqual(sorted(profile['name'] for profile in profiles), names[2:])
+        durations = [profile['duration_ms'] for profile in profiles]
+        self.assertEqual(durations, sorted(durations, reverse=True))
+        self.assertNotIn('queries', profiles[0])
+
+    def test_admin_pages(self):
+        self.client.force_login(self.staff)
+        name = self.get(x_profile='1')['X-Profile-Id']
+        User.objects.filter(pk=self.staff.pk).update(is_superuser=True)
+
+        self.assertContains(self.client.get('/admin/profiles/'), name)
+        response = self.client.get(f'/admin/profiles/{name}.json')
+        self.assertEqual(json.loads(b''.join(response.streaming_content))['name'], name)
+        self.assertEqual(self.client.get(f'/admin/profiles/{name}.txt').status_code, 404)
+
+
+class UpsertUserAnswerTests(TestCase):
+
+    def setUp(self):
+        self.survey, self.graph = create_survey_graph()
+        self.user = User.objects.create(username='respondent')
+
+    def test_reanswer_updates_row(self):
+        question, (first, second) = self.graph[0]
+
+        self.assertEqual(upsert_user_answer(self.user.pk, self.survey.pk, question.pk, question.pk, first.pk),
+                         (True, None))
+        self.assertEqual(upsert_user_answer(self.user.pk, self.survey.pk, question.pk, question.pk, second.pk),
+                         (False, first.pk))
+
+        statistics = UserStatistics.objects.get(survey=self.survey, user=self.user)
+        self.assertEqual(statistics.answers_given, second)
+
+    def test_answer_endpoint(self):
+        self.client.force_login(self.user)
+
+        response = self.client.post(f'/survey/{self.survey.pk}/', {'number_answer': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['вопрос'], self.graph[1][0].text)
+        self.assertEqual(UserStatistics.objects.filter(survey=self.survey, user=self.user).count(), 1)
+
+
+class UpsertUserAnswerConcurrencyTests(TransactionTestCase):
+
+    def test_concurrent_first_answers(self):
+        survey, graph = create_survey_graph()
+        user = User.objects.create(username='respondent')
+        question, (first, second) = graph[0]
+
+        with transaction.atomic():
+            # Первая вставка ещё не зафиксирована: параллельный запрос ждёт её на уникальном индексе
+            self.assertEqual(upsert_user_answer(user.pk, survey.pk, question.pk, question.pk, first.pk),
+                             (True, None))
+            thread, result = run_in_thread(
+                upsert_user_answer, user.pk, survey.pk, question.pk, question.pk, second.pk
+            )
+            time.sleep(0.5)
+            self.assertTrue(thread.is_alive())
+
+        thread.join(10)
+        self.assertEqual(result, [(False, first.pk)])
+        self.assertEqual(UserStatistics.objects.get(survey=survey, user=user).answers_given, second)
+
+
+class DeduplicateStatisticsMigrationTests(TransactionTestCase):
+    """
+    Миграция 0004 удаляет повторные ответы, оставляя самый поздний, и добавляет ограничение уникальности.
+    """
+    before = [('survey', '0003_survey_question_position')]
+    after = [('survey', '0004_unique_user_statistics_response')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+        self.executor.loader.build_graph()
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes('survey'))
+
+    def test_keeps_latest_answer(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        HistoricalUser = apps.get_model('auth', 'User')
+        HistoricalStatistics = apps.get_model('survey', 'UserStatistics')
+        survey = apps.get_model('survey', 'Survey').objects.create(title='Опрос')
+        question = apps.get_model('survey', 'Question').objects.create(text='Вопрос')
+        Answer = apps.get_model('survey', 'Answer')
+        old, new = Answer.objects.create(question=question), Answer.objects.create(question=question)
+        user = HistoricalUser.objects.create(username='duplicate')
+        other = HistoricalUser.objects.create(username='single')
+
+        now = timezone.now()
+        rows = [
+            (user, old, now - datetime.timedelta(minutes=2)),
+            (user, new, now),
+            (user, old, now - datetime.timedelta(minutes=1)),
+            (other, old, now),
+        ]
+        for row_user, answer, timestamp in rows:
+            HistoricalStatistics.objects.create(user=row_user, survey=survey, questions_shown=question,
+                                                questions_answered=question, answers_given=answer,
+                                                timestamp=timestamp)
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        HistoricalStatistics = apps.get_model('survey', 'UserStatistics')
+
+        self.assertEqual(
+            sorted(HistoricalStatistics.objects.values_list('user_id', 'answers_given_id')),
+            [(user.pk, new.pk), (other.pk, old.pk)]
+        )
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            HistoricalStatistics.objects.create(user_id=other.pk, survey_id=survey.pk, questions_shown_id=question.pk,
+                                                questions_answered_id=question.pk, answers_given_id=new.pk)
+
+
+class RecomputeStatisticsTests(TransactionTestCase):
+    """
+    Пересчёт идёт в пуле процессов, поэтому данные должны быть зафиксированы в базе.
+    """
+
+    def setUp(self):
+        self.directory = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.state_file = str(self.directory / 'recompute.state')
+
+        self.surveys = []
+        for index in range(3):
+            survey, graph = create_survey_graph(f'Опрос {index}')
+            question, answers = graph[0]
+            for number in range(index + 2):
+                user = User.objects.create(username=f'user_{index}_{number}')
+                survey.participants.add(user)
+                if number:
+                    UserStatistics.objects.create(user=user, survey=survey, questions_shown=question,
+                                                  questions_answered=question, answers_given=answers[0])
+            self.surveys.append(survey)
+        close_survey(self.surveys[0].pk)
+        self.created_at = SurveySnapshot.objects.get(survey=self.surveys[0]).created_at
+        Survey.objects.update(total_participants=0, total_responses=0)
+
+    def recompute(self, **options):
+        call_command('recompute_statistics', workers=2, chunk_size=1, state_file=self.state_file,
+                     stdout=StringIO(), **options)
+
+    def totals(self):
+        return [(survey.total_participants, survey.total_responses)
+                for survey in Survey.objects.filter(pk__in=[survey.pk for survey in self.surveys]).order_by('pk')]
+
+    def test_recompute(self):
+        self.recompute()
+
+        self.assertEqual(self.totals(), [(2, 1), (3, 2), (4, 3)])
+        snapshot = SurveySnapshot.objects.get(survey=self.surveys[0])
+        self.assertEqual(snapshot.created_at, self.created_at)
+        self.assertEqual(json.loads(zlib.decompress(snapshot.data))['ordering'][0]['total_users'], 1)
+        self.assertFalse(Path(self.state_file).exists())
+
+    def test_resume_skips_processed_surveys(self):
+        Path(self.state_file).write_text(f'{self.surveys[0].pk}\n')
+
+        self.recompute(resume=True)
+
+        self.assertEqual(self.totals(), [(0, 0), (3, 2), (4, 3)])
+
+    def test_state_file_ignored_without_resume(self):
+        Path(self.state_file).write_text(f'{self.surveys[0].pk}\n')
+
+        self.recompute()
+
+        self.assertEqual(self.totals()[0], (2, 1))
+
+
+class CachedModelBackendTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='respondent')
+        self.backend = CachedModelBackend()
+
+    def test_user_is_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.backend.get_user(self.user.pk), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.backend.get_user(self.user.pk), self.user)
+
+    def test_cache_invalidated_on_save_and_delete(self):
+        self.backend.get_user(self.user.pk)
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(self.backend.get_user(self.user.pk))
+
+        self.user.is_active = True
+        self.user.save()
+        self.backend.get_user(self.user.pk)
+        user_id = self.user.pk
+        self.user.delete()
+        self.assertIsNone(self.backend.get_user(user_id))
+
+    @override_settings(SURVEY_USER_CACHE_TTL=0)
+    def test_zero_ttl_disables_cache(self):
+        for _ in range(2):
+            with self.assertNumQueries(1):
+                self.backend.get_user(self.user.pk)
+
+
+class SessionQueriesTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.survey, _ = create_survey_graph()
+        self.user = User.objects.create(username='respondent')
+
+    def tables_read(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/survey/{self.survey.pk}/ordering/')
+        self.assertEqual(response.status_code, 200)
+        return ' '.join(query['sql'] for query in queries)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookies_without_session_and_user_queries(self):
+        self.client.force_login(self.user)
+        self.tables_read()
+
+        sql = self.tables_read()
+        self.assertNotIn('django_session', sql)
+        self.assertNotIn('auth_user', sql)
+
+    def test_db_sessions_read_session_table(self):
+        self.client.force_login(self.user)
+
+        self.assertIn('django_session', self.tables_read())
+
+
+class QuantileSketchTests(SimpleTestCase):
+
+    def test_small_sample_is_exact(self):
+        sketch = QuantileSketch()
+        sketch.update([5, 1, 4, 2, 3])
+
+        self.assertEqual(sketch.count, 5)
+        self.assertEqual(sketch.quantiles([0, 0.5, 1]), [1.0, 3.0, 5.0])
+
+    def test_empty_sketch(self):
+        sketch = QuantileSketch()
+        sketch.update([float('nan'), float('inf')])
+
+        self.assertEqual(sketch.count, 0)
+        self.assertEqual(sketch.quantiles([0.5, 0.9]), [None, None])
+
+    def test_large_sample_accuracy_and_size(self):
+        values = np.random.default_rng(1).lognormal(2, 0.5, 200000)
+        sketch = QuantileSketch()
+        for batch in np.array_split(values, 20):
+            sketch.update(batch)
+
+        self.assertEqual(sketch.count, values.size)
+        self.assertLessEqual(sketch.weights.size, 2 * sketch.compression)
+        for quantile, estimate in zip((0.5, 0.9, 0.99), sketch.quantiles((0.5, 0.9, 0.99))):
+            expected = np.quantile(values, quantile)
+            self.assertAlmostEqual(estimate / expected, 1, delta=0.02)
+
+    def test_merge_matches_single_sketch(self):
+        values = np.random.default_rng(2).exponential(10, 50000)
+        whole = QuantileSketch()
+        whole.update(values)
+        left, right = QuantileSketch(), QuantileSketch()
+        left.update(values[:20000])
+        right.update(values[20000:])
+        left.merge(right)
+
+        self.assertEqual(left.count, whole.count)
+        self.assertEqual((left.minimum, left.maximum), (whole.minimum, whole.maximum))
+        for merged, single in zip(left.quantiles((0.5, 0.99)), whole.quantiles((0.5, 0.99))):
+            self.assertAlmostEqual(merged / single, 1, delta=0.02)
+
+    def test_dict_round_trip(self):
+        sketch = QuantileSketch(compression=50)
+        sketch.update(range(1000))
+        restored = QuantileSketch.from_dict(json.loads(json.dumps(sketch.to_dict())))
+
+        self.assertEqual(restored.compression, 50)
+        self.assertEqual(restored.count, 1000)
+        self.assertEqual(restored.quantiles((0.1, 0.5, 0.9)), sketch.quantiles((0.1, 0.5, 0.9)))
+
+
+@override_settings(SURVEY_TIMING_SETTLE=0)
+class SurveyTimingTests(TestCase):
+
+    def setUp(self):
+        self.survey, self.graph = create_survey_graph()
+        self.started = timezone.now() - datetime.timedelta(hours=1)
+
+    def answer(self, user, index, seconds, number=0):
+        question, answers = self.graph[index]
+        UserStatistics.objects.update_or_create(
+            user=user, survey=self.survey, questions_shown=question, questions_answered=question,
+            defaults={'answers_given': answers[number],
+                      'timestamp': self.started + datetime.timedelta(seconds=seconds)}
+        )
+
+    def describe(self):
+        timing = get_survey_timing(self.survey.pk)
+        questions = {row['question_id']: row for row in timing['questions']}
+        return timing['completion'], [questions[question.pk] for question, _ in self.graph]
+
+    def test_dwell_and_completion(self):
+        user = User.objects.create(username='first')
+        for index, seconds in enumerate((0, 10, 30)):
+            self.answer(user, index, seconds)
+        update_survey_timing(self.survey.pk)
+
+        completion, questions = self.describe()
+        self.assertEqual((completion['count'], completion['p50']), (1, 30.0))
+        # Для первого вопроса время ответа не определено
+        self.assertEqual([row['count'] for row in questions], [0, 1, 1])
+        self.assertEqual([row['p50'] for row in questions[1:]], [10.0, 20.0])
+
+    def test_incremental_updates_continue_user_progress(self):
+        user = User.objects.create(username='second')
+        self.answer(user, 0, 0)
+        update_survey_timing(self.survey.pk)
+        self.assertEqual(self.describe()[0]['count'], 0)
+
+        # Следующий запуск учитывает ответы, записанные после предыдущего
+        SurveyTiming.objects.filter(survey=self.survey).update(
+            processed_until=self.started + datetime.timedelta(seconds=5)
+        )
+        self.answer(user, 1, 15)
+        self.answer(user, 2, 20)
+        update_survey_timing(self.survey.pk)
+
+        completion, questions = self.describe()
+        self.assertEqual((completion['count'], completion['p50']), (1, 20.0))
+        self.assertEqual([row['p50'] for row in questions[1:]], [15.0, 5.0])
+
+    def test_reanswer_after_completion_is_not_counted_twice(self):
+        user = User.objects.create(username='third')
+        for index, seconds in enumerate((0, 10, 20)):
+            self.answer(user, index, seconds)
+        update_survey_timing(self.survey.pk)
+
+        # Повторный ответ на последний вопрос обновляет время существующей записи
+        SurveyTiming.objects.filter(survey=self.survey).update(
+            processed_until=self.started + datetime.timedelta(seconds=50)
+        )
+        self.answer(user, 2, 100, number=1)
+        update_survey_timing(self.survey.pk)
+
+        completion, questions = self.describe()
+        self.assertEqual(completion['count'], 1)
+        self.assertEqual(questions[2]['count'], 1)
+        self.assertEqual(UserStatistics.objects.filter(survey=self.survey).count(), 3)
+
+    def test_reanswer_before_completion_is_not_counted_twice(self):
+        user = User.objects.create(username='sixth')
+        self.answer(user, 0, 0)
+        self.answer(user, 1, 10)
+        update_survey_timing(self.survey.pk)
+
+        # Повторный ответ на учтённый второй вопрос до завершения опроса
+        SurveyTiming.objects.filter(survey=self.survey).update(
+            processed_until=self.started + datetime.timedelta(seconds=20)
+        )
+        self.answer(user, 1, 40, number=1)
+        update_survey_timing(self.survey.pk)
+
+        completion, questions = self.describe()
+        self.assertEqual((questions[1]['count'], questions[1]['p50']), (1, 10.0))
+        self.assertEqual(completion['count'], 0)
+
+        SurveyTiming.objects.filter(survey=self.survey).update(
+            processed_until=self.started + datetime.timedelta(seconds=45)
+        )
+        self.answer(user, 2, 50)
+        update_survey_timing(self.survey.pk)
+
+        completion, questions = self.describe()
+        self.assertEqual((questions[1]['count'], questions[1]['p50']), (1, 10.0))
+        self.assertEqual((questions[2]['count'], questions[2]['p50']), (1, 10.0))
+        self.assertEqual((completion['count'], completion['p50']), (1, 50.0))
+        progress = SurveyTimingProgress.objects.get(survey=self.survey, user=user)
+        self.assertEqual(progress.questions, sorted(question.pk for question, _ in self.graph))
+
+    def test_answers_inside_settle_window_wait(self):
+        user = User.objects.create(username='fourth')
+        self.answer(user, 0, 0)
+        self.answer(user, 1, 10)
+        UserStatistics.objects.filter(user=user, questions_answered=self.graph[1][0]).update(
+            timestamp=timezone.now() + datetime.timedelta(minutes=1)
+        )
+        update_survey_timing(self.survey.pk)
+        self.assertEqual(self.describe()[1][1]['count'], 0)
+
+        timing = SurveyTiming.objects.get(survey=self.survey)
+        timing.processed_until -= datetime.timedelta(minutes=5)
+        timing.save()
+        with override_settings(SURVEY_TIMING_SETTLE=-120):
+            update_survey_timing(self.survey.pk)
+        self.assertEqual(self.describe()[1][1]['count'], 1)
+
+    def test_rebuild_resets_progress(self):
+        user = User.objects.create(username='fifth')
+        for index, seconds in enumerate((0, 10, 20)):
+            self.answer(user, index, seconds)
+        update_survey_timing(self.survey.pk)
+        update_survey_timing(self.survey.pk, rebuild=True)
+
+        self.assertEqual(self.describe()[0]['count'], 1)
+        self.assertEqual(SurveyTimingProgress.objects.filter(survey=self.survey).count(), 1)
+
+    def test_endpoint_only_reads(self):
+        staff = User.objects.create(username='viewer')
+        self.client.force_login(staff)
+
+        response = self.client.get(f'/survey/{self.survey.pk}/timing/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['completion']['count'], 0)
+        self.assertFalse(SurveyTiming.objects.filter(survey=self.survey).exists())
+        self.assertEqual(self.client.get('/survey/0/timing/').status_code, 404)
+
+
+class ToColumnsTests(SimpleTestCase):
+
+    def test_rows_to_columns(self):
+        rows = [{'id': 1, 'text': 'а'}, {'id': 2, 'text': 'б'}]
+        self.assertEqual(to_columns(rows), {'id': [1, 2], 'text': ['а', 'б']})
+
+    def test_missing_fields_are_none(self):
+        rows = [{'answer_id': 1, 'user_count': 3}, {'total_users_count': 3}]
+        self.assertEqual(to_columns(rows), {
+            'answer_id': [1, None],
+            'user_count': [3, None],
+            'total_users_count': [None, 3],
+        })
+
+    def test_nested_structures(self):
+        data = {'count': 2, 'results': [{'id': 1, 'pairwise': [{'z': 1.5}]}, {'id': 2, 'pairwise': []}]}
+        self.assertEqual(to_columns(data), {
+            'count': 2,
+            'results': {'id': [1, 2], 'pairwise': [{'z': [1.5]}, []]},
+        })
+
+    def test_scalars_and_plain_lists_unchanged(self):
+        self.assertEqual(to_columns([]), [])
+        self.assertEqual(to_columns([1, 2]), [1, 2])
+        self.assertEqual(to_columns('текст'), 'текст')
+
+
+class AnalyticsFormatsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.survey, graph = create_survey_graph('Опрос', questions=20)
+        cls.question = graph[0][0]
+        for index in range(4):
+            user = User.objects.create(username=f'user_{index}')
+            for question, answers in graph:
+                UserStatistics.objects.create(user=user, survey=cls.survey, questions_shown=question,
+                                              questions_answered=question, answers_given=answers[index % 2])
+        cls.staff = User.objects.create(username='staff', is_staff=True)
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+
+    def test_columns_format(self):
+        url = f'/survey/{self.survey.pk}/response_rate/{self.question.pk}/'
+        rows = self.client.get(url).json()
+
+        for response in (self.client.get(url, {'format': 'columns'}),
+                         self.client.get(url, headers={'accept': 'application/vnd.survey.columns+json'})):
+            self.assertEqual(response['Content-Type'], 'application/vnd.survey.columns+json')
+            self.assertEqual(json.loads(response.content), to_columns(rows))
+
+    def test_msgpack_format(self):
+        url = f'/survey/{self.survey.pk}/statistics/'
+        rows = self.client.get(url).json()
+
+        for response in (self.client.get(url, {'format': 'msgpack'}),
+                         self.client.get(url, headers={'accept': 'application/msgpack'})):
+            self.assertEqual(response['Content-Type'], 'application/msgpack')
+            self.assertEqual(msgpack.unpackb(response.content), rows)
+
+    def test_large_response_compressed(self):
+        url = f'/survey/{self.survey.pk}/statistics/'
+        plain = self.client.get(url)
+        self.assertGreater(len(plain.content), settings.SURVEY_COMPRESS_MIN_SIZE)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain['Vary'].count('Accept-Encoding'), 1)
+
+        response = self.client.get(url, headers={'accept-encoding': 'gzip, br;q=1.0'})
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(brotli.decompress(response.content), plain.content)
+        self.assertEqual(response['Content-Length'], str(len(response.content)))
+
+        response = self.client.get(url, headers={'accept-encoding': 'gzip'})
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+    def test_small_response_not_compressed(self):
+        response = self.client.get(f'/survey/{self.survey.pk}/respondents/', headers={'accept-encoding': 'br'})
+
+        self.assertLess(len(response.content), settings.SURVEY_COMPRESS_MIN_SIZE)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_html_not_compressed(self):
+        response = self.client.get('/register/', headers={'accept-encoding': 'br'})
+
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+
+class JumpHashTests(SimpleTestCase):
+
+    def test_range_and_determinism(self):
+        for key in range(1000):
+            bucket = jump_hash(key, 7)
+            self.assertTrue(0 <= bucket < 7)
+            self.assertEqual(bucket, jump_hash(key, 7))
+        self.assertEqual({jump_hash(key, 1) for key in range(100)}, {0})
+
+    def test_balanced(self):
+        counts = Counter(jump_hash(key, 4) for key in range(20000))
+        for bucket in range(4):
+            self.assertAlmostEqual(counts[bucket] / 20000, 0.25, delta=0.02)
+
+    def test_adding_bucket_moves_keys_only_to_it(self):
+        moved = 0
+        for key in range(20000):
+            before, after = jump_hash(key, 3), jump_hash(key, 4)
+            if before != after:
+                self.assertEqual(after, 3)
+                moved += 1
+        self.assertAlmostEqual(moved / 20000, 0.25, delta=0.02)
+
+
+@override_settings(SURVEY_SHARDS=SHARDS)
+class SurveyShardRouterTests(TestCase):
+
+    def setUp(self):
+        self.router = SurveyShardRouter()
+
+    def test_statistics_follow_survey(self):
+        survey = Survey.objects.create(title='По хэшу')
+        pinned = Survey.objects.create(title='Закреплённый', shard='shard_2')
+
+        self.assertEqual(get_survey_shard(survey), hash_survey_shard(survey.pk))
+        self.assertEqual(get_survey_shard(pinned.pk), 'shard_2')
+        self.assertEqual(self.router.db_for_read(UserStatistics, instance=survey), hash_survey_shard(survey.pk))
+        self.assertEqual(self.router.db_for_read(UserStatistics, instance=pinned), 'shard_2')
+        self.assertEqual(self.router.db_for_write(UserStatistics, instance=UserStatistics(survey_id=pinned.pk)),
+                         'shard_2')
+
+    def test_catalog_models_use_default(self):
+        self.assertEqual(self.router.db_for_read(Survey), DEFAULT_DB_ALIAS)
+        self.assertEqual(self.router.db_for_write(Answer, instance=UserStatistics(survey_id=1)), DEFAULT_DB_ALIAS)
+
+    def test_timing_progress_follows_survey(self):
+        pinned = Survey.objects.create(title='Закреплённый', shard='shard_2')
+
+        self.assertEqual(self.router.db_for_write(SurveyTimingProgress,
+                                                  instance=SurveyTimingProgress(survey_id=pinned.pk)), 'shard_2')
+        with self.assertRaises(ShardRoutingError):
+            SurveyTimingProgress.objects.count()
+
+    def test_unrouted_statistics_query_raises(self):
+        with self.assertRaises(ShardRoutingError):
+            self.router.db_for_read(UserStatistics)
+        with self.assertRaises(ShardRoutingError):
+            self.router.db_for_read(UserStatistics, instance=User(pk=1))
+        with self.assertRaises(ShardRoutingError):
+            UserStatistics.objects.count()
+
+    def test_unrouted_statistics_query_inside_using_shard(self):
+        with using_shard('shard_1'):
+            self.assertEqual(self.router.db_for_read(UserStatistics), 'shard_1')
+        with self.assertRaises(ShardRoutingError):
+            self.router.db_for_write(UserStatistics)
+
+    def test_assigning_catalog_object_defers_to_save(self):
+        self.assertIsNone(self.router.db_for_write(UserStatistics, instance=User(pk=1)))
+
+    @override_settings(SURVEY_SHARDS=['shard_0'])
+    def test_single_shard(self):
+        self.assertEqual(self.router.db_for_read(UserStatistics), 'shard_0')
+
+    def test_data_migrations_skip_shards(self):
+        self.assertFalse(self.router.allow_migrate('shard_1', 'survey'))
+        self.assertIsNone(self.router.allow_migrate('shard_1', 'survey', model_name='userstatistics'))
+        self.assertIsNone(self.router.allow_migrate(DEFAULT_DB_ALIAS, 'survey'))
+
+
+@skipUnless(len(settings.SURVEY_SHARDS) > 1, 'нужны несколько баз SURVEY_SHARDS (см. README)')
+@override_settings(SURVEY_TIMING_SETTLE=0)
+class ShardMoveTests(TestCase):
+    """
+    Перенос статистики между базами шардов. Запускается с несколькими базами SURVEY_SHARDS.
+    """
+    databases = '__all__'
+
+    def setUp(self):
+        self.source, self.target = settings.SURVEY_SHARDS[:2]
+        self.survey, self.graph = create_survey_graph()
+        self.started = timezone.now() - datetime.timedelta(hours=1)
+
+    def answer_all(self, using):
+        for index in range(3):
+            user = User.objects.create(username=f'user_{index}')
+            for position, (question, answers) in enumerate(self.graph):
+                UserStatistics.objects.using(using).create(
+                    user=user, survey=self.survey, questions_shown=question, questions_answered=question,
+                    answers_given=answers[0], timestamp=self.started + datetime.timedelta(seconds=position * 10)
+                )
+
+    def counts(self, model):
+        return {shard: model.objects.using(shard).filter(survey_id=self.survey.pk).count()
+                for shard in (self.source, self.target)}
+
+    def test_move_survey_statistics(self):
+        Survey.objects.filter(pk=self.survey.pk).update(shard=self.source)
+        self.answer_all(self.source)
+        update_survey_timing(self.survey.pk)
+        self.assertEqual(self.counts(SurveyTimingProgress), {self.source: 3, self.target: 0})
+
+        self.assertEqual(move_survey_statistics(self.survey.pk, self.source, self.target), 9)
+
+        self.assertEqual(Survey.objects.get(pk=self.survey.pk).shard, self.target)
+        self.assertEqual(self.counts(UserStatistics), {self.source: 0, self.target: 9})
+        self.assertEqual(self.counts(SurveyTimingProgress), {self.source: 0, self.target: 3})
+        self.assertEqual(get_survey_timing(self.survey.pk)['completion']['count'], 3)
+
+    def test_rebalance_all(self):
+        Survey.objects.filter(pk=self.survey.pk).update(shard='')
+        home = hash_survey_shard(self.survey.pk)
+        self.source, self.target = [shard for shard in settings.SURVEY_SHARDS if shard != home][0], home
+        self.answer_all(self.source)
+
+        call_command('rebalance_shards', all=True, force=True, stdout=StringIO())
+
+        self.assertEqual(self.counts(UserStatistics), {self.source: 0, self.target: 9})
+        # Опрос, перенесённый в базу по хэшу, за ней не закрепляется
+        self.assertEqual(Survey.objects.get(pk=self.survey.pk).shard, '')
+
+    def test_survey_delete_cascades_to_shard(self):
+        Survey.objects.filter(pk=self.survey.pk).update(shard=self.source)
+        self.answer_all(self.source)
+        update_survey_timing(self.survey.pk)
+
+        Survey.objects.get(pk=self.survey.pk).delete()
+
+        self.assertEqual(self.counts(UserStatistics), {self.source: 0, self.target: 0})
+        self.assertEqual(self.counts(SurveyTimingProgress), {self.source: 0, self.target: 0})
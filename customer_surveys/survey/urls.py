@@ -8,8 +8,15 @@ from .api import (
     OrderingQuestions,
     ResponseRate,
     SurveyStatistics,
+    CloseSurvey,
+    SurveysDashboard,
+    ExportSurvey,
+    ImportSurvey,
+    CloneSurvey,
+    EnrollParticipants,
+    CompletionTime,
 )
-from .views import RegisterUserView, HomeView
+from .views import RegisterUserView, HomeView, SurveyLiveView
 
 
 urlpatterns = [
@@ -17,10 +24,18 @@ urlpatterns = [
     path('register/', RegisterUserView.as_view(), name='register'),
     path('login/', auth_views.LoginView.as_view(template_name='survey/login.html'), name='login'),
     path('logout/', auth_views.LogoutView.as_view(next_page='register'), name='logout'),
+    path('survey/dashboard/', SurveysDashboard.as_view(), name='surveys_dashboard'),
+    path('survey/import/', ImportSurvey.as_view(), name='import_survey'),
     path('survey/<int:pk>/', SurveyView.as_view(), name='survey_view'),
     path('survey/<int:pk>/respondents/', NumberRespondents.as_view(), name='number_respondents'),
     path('survey/<int:survey_id>/statistics/', SurveyStatistics.as_view(), name='survey_statistics'),
     path('survey/<int:survey_id>/respondents/<int:question_id>/', NumberAnswers.as_view(), name='number_respondents'),
     path('survey/<int:survey_id>/ordering/', OrderingQuestions.as_view(), name='surveys_ordering'),
     path('survey/<int:survey_id>/response_rate/<int:question_id>/', ResponseRate.as_view(), name='response_rate'),
+    path('survey/<int:survey_id>/timing/', CompletionTime.as_view(), name='survey_timing'),
+    path('survey/<int:survey_id>/close/', CloseSurvey.as_view(), name='close_survey'),
+    path('survey/<int:survey_id>/live/', SurveyLiveView.as_view(), name='survey_live'),
+    path('survey/<int:survey_id>/export/', ExportSurvey.as_view(), name='export_survey'),
+    path('survey/<int:survey_id>/clone/', CloneSurvey.as_view(), name='clone_survey'),
+    path('survey/<int:survey_id>/participants/', EnrollParticipants.as_view(), name='enroll_participants'),
 ]
@@ -1,10 +1,22 @@
+import asyncio
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib import admin
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, logout
 from django.contrib import messages
+from django.core.handlers.asgi import ASGIRequest
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render, redirect
 from django.views import View
 from django.views.generic import TemplateView
 
+from .live import broadcaster
+from .middleware import list_profiles
+from .models import Survey
+
 
 class RegisterUserView(View):
     """
@@ -52,3 +64,89 @@ class HomeView(TemplateView):
 
     def get_template_names(self):
         return [self.template_name]
+
+
+class SurveyLiveView(View):
+    """
+    Трансляция изменений результатов опроса через Server-Sent Events.
+    (survey/<int:survey_id>/live/)
+
+    Раз в SURVEY_LIVE_TICK секунд отправляет событие delta с изменением количества ответов
+    по вопросам и вариантам ответа (при повторном ответе прежний вариант уменьшается).
+    Начальные значения берутся из эндпоинтов статистики.
+    Работает только под ASGI-сервером, запущенным одним процессом
+    (uvicorn customer_surveys.asgi:application без --workers): изменения раздаются
+    внутри процесса, ответы, принятые другими процессами, в поток не попадают.
+    Под WSGI поток занял бы воркер целиком, поэтому там вью отвечает 501.
+    """
+
+    async def get(self, request, survey_id: int):
+        """
+        Обработчик GET-запроса. Открывает поток событий опроса.
+
+        Returns:
+        - StreamingHttpResponse: Поток text/event-stream.
+        - HttpResponse: 501, если приложение запущено не под ASGI.
+        """
+        if not isinstance(request, ASGIRequest):
+            return HttpResponse('Трансляция доступна только под ASGI-сервером', status=501)
+        if not await Survey.objects.filter(pk=survey_id).aexists():
+            raise Http404
+
+        response = StreamingHttpResponse(self.stream(survey_id), content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @staticmethod
+    async def stream(survey_id: int):
+        queue = broadcaster.subscribe(survey_id)
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), settings.SURVEY_LIVE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                if event is None:
+                    break
+                yield f'event: delta\ndata: {json.dumps(event)}\n\n'
+        finally:
+            broadcaster.unsubscribe(survey_id, queue)
+
+
+class ProfileListView(TemplateView):
+    """
+    Страница админки со списком самых медленных профилированных запросов.
+    (admin/profiles/)
+
+    Attributes:
+    - template_name (str): Название шаблона страницы.
+    """
+    template_name = 'survey/profiles.html'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context.update(admin.site.each_context(self.request))
+        context.update({
+            'title': 'Профили медленных запросов',
+            'profiles': list_profiles(),
+            'directory': settings.SURVEY_PROFILING_DIR,
+        })
+        return context
+
+
+class ProfileFileView(View):
+    """
+    Скачивание файла профиля (.prof или .json).
+    (admin/profiles/<name>.<extension>)
+    """
+
+    def get(self, request, name: str, extension: str):
+        if extension not in ('prof', 'json'):
+            raise Http404
+        path = Path(settings.SURVEY_PROFILING_DIR) / f'{name}.{extension}'
+        if not path.is_file():
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name)